@@ -1,35 +1,195 @@
+import asyncio
+import io
+import discord
 import openai
 import logging
 from dotenv import load_dotenv
 import os
+from executor import BusyError
+import http_client
+from metrics import track_upstream
 
 # Load environment variables
 load_dotenv()
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # OpenAI API key
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 openai.api_key = OPENAI_API_KEY
 
-def generate_image(prompt):
+ERROR_REPLY = "An error occurred while generating the image. Please try again later."
+
+
+class ImageQueueBusyError(BusyError):
+    """Raised when the image queue is full."""
+
+
+class ImageJob:
+    """One image generation, shared by everyone who asked for the same prompt."""
+
+    __slots__ = ("key", "prompt", "requests", "task", "cancelled")
+
+    def __init__(self, key, prompt):
+        self.key = key
+        self.prompt = prompt
+        self.requests = []  # (user_id, status message) pairs to deliver the result to
+        self.task = None
+        self.cancelled = False
+
+
+class ImageJobQueue:
     """
-    Generate an AI image based on the prompt using OpenAI's API.
-    :param prompt: The textual description for the image.
-    :return: URL of the generated image or an error message.
+    Runs !image requests on a fixed pool of workers. Users get their place in the
+    queue right away and the "Generating your image" message is edited with the result.
     """
-    try:
-        logger.info(f"Generating image for prompt: {prompt}")
-        response = openai.Image.create(
-            prompt=prompt,
-            n=1,
-            size="1024x1024"
-        )
+
+    def __init__(self, workers=2, user_quota=2, max_queue=50, reupload=True):
+        """
+        :param workers: Number of images generated at the same time.
+        :param user_quota: Maximum queued or running requests per user.
+        :param max_queue: Maximum number of queued jobs.
+        :param reupload: Download the image and attach it, since OpenAI's URLs expire.
+        """
+        self.workers = workers
+        self.user_quota = user_quota
+        self.max_queue = max_queue
+        self.reupload = reupload
+        self.pending = []  # Jobs waiting for a worker, oldest first
+        self._jobs = {}  # Normalized prompt -> queued or running job
+        self._queue = asyncio.Queue()
+        self._worker_tasks = []
+
+    def start(self):
+        """Start the worker tasks."""
+        if not self._worker_tasks:
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop the workers, cancelling any running generations."""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def _user_jobs(self, user_id):
+        return [job for job in self._jobs.values() if any(uid == user_id for uid, _ in job.requests)]
+
+    async def submit(self, message, prompt):
+        """
+        Queue an image for a !image message and reply with its place in the queue.
+        :param message: The discord.Message that asked for the image.
+        :param prompt: The textual description for the image.
+        """
+        user_id = message.author.id
+        if len(self._user_jobs(user_id)) >= self.user_quota:
+            await message.channel.send(
+                f"You already have {self.user_quota} images in progress. Use `!cancel_image` to cancel them.")
+            return
+
+        key = " ".join(prompt.lower().split())
+        job = self._jobs.get(key)
+        if job is None and len(self.pending) >= self.max_queue:
+            raise ImageQueueBusyError("Too many queued image requests.")
+
+        if job is not None:
+            status = await message.channel.send("Generating your image, please wait...")
+        else:
+            status = await message.channel.send(
+                f"Generating your image, please wait... You're #{len(self.pending) + 1} in the queue.")
+
+        # The job may have been created or finished while the status message was sent
+        job = self._jobs.get(key)
+        if job is None:
+            job = ImageJob(key, prompt)
+            self._jobs[key] = job
+            self.pending.append(job)
+            self._queue.put_nowait(job)
+        job.requests.append((user_id, status))
+
+    async def cancel(self, user_id):
+        """
+        Cancel a user's image requests. Jobs shared with other users keep running for them.
+        :return: Number of requests cancelled.
+        """
+        cancelled = 0
+        for job in self._user_jobs(user_id):
+            mine = [request for request in job.requests if request[0] == user_id]
+            job.requests = [request for request in job.requests if request[0] != user_id]
+            for _, status in mine:
+                await status.edit(content="Image request cancelled.")
+                cancelled += 1
+            if not job.requests:
+                self._drop(job)
+        return cancelled
+
+    def _drop(self, job):
+        job.cancelled = True
+        self._jobs.pop(job.key, None)
+        if job in self.pending:
+            self.pending.remove(job)
+        if job.task is not None:
+            job.task.cancel()
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            if job.cancelled:
+                continue
+            self.pending.remove(job)
+            job.task = asyncio.create_task(self._generate(job))
+            try:
+                image_url, image_data = await job.task
+            except asyncio.CancelledError:
+                if not job.cancelled:
+                    raise  # The worker itself is being stopped
+                continue
+            except Exception as e:
+                logger.error("Error generating image: %s", e)
+                image_url, image_data = None, None
+            finally:
+                # A cancelled job's key may already belong to a newer job for the same prompt
+                if self._jobs.get(job.key) is job:
+                    del self._jobs[job.key]
+            await self._deliver(job, image_url, image_data)
+
+    async def _generate(self, job):
+        logger.debug("Generating image for prompt: %s", job.prompt)
+        # Reuse the shared connection pool instead of a session per call
+        openai.aiosession.set(http_client.get_session())
+        with track_upstream("openai"):
+            response = await openai.Image.acreate(prompt=job.prompt, n=1, size="1024x1024")
         image_url = response['data'][0]['url']
-        logger.info("Image generated successfully")
-        return image_url
-    except Exception as e:
-        logger.error(f"Error generating image: {e}")
-        return "An error occurred while generating the image. Please try again later."
+        logger.debug("Image generated successfully")
+        image_data = None
+        if self.reupload:
+            try:
+                image_response = await http_client.get(image_url, upstream="openai_images")
+                image_response.raise_for_status()
+                image_data = image_response.body
+            except Exception as e:
+                logger.warning("Couldn't download generated image, sending the URL instead: %s", e)
+        return image_url, image_data
+
+    async def _deliver(self, job, image_url, image_data):
+        for _, status in job.requests:
+            try:
+                if image_url is None:
+                    await status.edit(content=ERROR_REPLY)
+                elif image_data is not None:
+                    # A fresh File per message, discord.py consumes the buffer on upload
+                    image = discord.File(io.BytesIO(image_data), filename="image.png")
+                    await status.edit(content="Here is your image:", attachments=[image])
+                else:
+                    await status.edit(content=f"Here is your image: {image_url}")
+            except discord.HTTPException as e:
+                logger.error("Error delivering image: %s", e)
+
+
+image_jobs = ImageJobQueue(
+    workers=int(os.getenv("IMAGE_WORKERS", "2")),
+    user_quota=int(os.getenv("IMAGE_USER_QUOTA", "2")),
+    max_queue=int(os.getenv("IMAGE_MAX_QUEUE", "50")),
+    reupload=os.getenv("IMAGE_REUPLOAD", "true").lower() == "true",
+)
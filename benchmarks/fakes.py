@@ -0,0 +1,266 @@
+"""
+Stand-ins for Discord and the bot's upstream APIs, used by load_test.py.
+
+The fake Discord objects implement just the parts of discord.Message, User,
+TextChannel and Interaction the commands use. StubServices serves Twitch,
+OpenWeather, ipapi, uselessfacts and OpenAI from one local aiohttp server,
+on its own thread and event loop so it doesn't skew the bot's loop lag.
+"""
+import asyncio
+import itertools
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from aiohttp import web
+
+_ids = itertools.count(1000)
+
+
+class FakeMessage:
+    def __init__(self, content, author, channel):
+        self.id = next(_ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.edits = 0
+        self.edited = asyncio.Event()
+
+    async def edit(self, content=None, **kwargs):
+        await self.channel.pause()
+        self.content = content
+        self.edits += 1
+        self.edited.set()
+        return self
+
+
+class FakeChannel:
+    """A text or DM channel that records what was sent, with simulated API latency."""
+
+    def __init__(self, channel_id, latency=0.0):
+        self.id = channel_id
+        self.latency = latency
+        self.sent = []
+
+    async def pause(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send(self, content=None, **kwargs):
+        await self.pause()
+        message = FakeMessage(content, BOT_USER, self)
+        self.sent.append(message)
+        return message
+
+
+class FakeUser:
+    def __init__(self, user_id, latency=0.0):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.bot = False
+        self.dm_channel = FakeChannel(user_id, latency)
+
+    async def send(self, content=None, **kwargs):
+        return await self.dm_channel.send(content, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
+BOT_USER = FakeUser(1)
+
+# One object per id, like discord.py's cache. The outbox queues sends by channel id
+# and keeps the first channel object it saw, so a fresh object per message would
+# have its replies recorded on an earlier one.
+_channels = {}
+_users = {}
+
+
+def get_channel(channel_id, latency=0.0):
+    channel = _channels.get(channel_id)
+    if channel is None:
+        channel = _channels[channel_id] = FakeChannel(channel_id, latency)
+    return channel
+
+
+def get_user(user_id, latency=0.0):
+    user = _users.get(user_id)
+    if user is None:
+        user = _users[user_id] = FakeUser(user_id, latency)
+    return user
+
+
+def make_message(content, user_id, channel_id=1, latency=0.0):
+    """Build an incoming message from a user, as the gateway would deliver it."""
+    return FakeMessage(content, get_user(user_id, latency), get_channel(channel_id, latency))
+
+
+class FakeInteraction:
+    """An application command interaction, for driving tree commands like /calculate."""
+
+    class Response:
+        def __init__(self, channel):
+            self.channel = channel
+            self.done = False
+
+        def is_done(self):
+            return self.done
+
+        async def send_message(self, content=None, **kwargs):
+            self.done = True
+            await self.channel.send(content, **kwargs)
+
+        async def defer(self, **kwargs):
+            self.done = True
+            await self.channel.pause()
+
+    def __init__(self, user_id, channel_id=1, guild_id=1, latency=0.0):
+        self.id = next(_ids)
+        self.user = FakeUser(user_id, latency)
+        self.channel = FakeChannel(channel_id, latency)
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.response = self.Response(self.channel)
+        self.followup = self.channel
+
+
+class StubServices:
+    """
+    One local HTTP server standing in for every upstream API the bot calls.
+
+    Each service has its own latency (seconds, +-50% jitter) and error rate, the
+    fraction of requests answered with HTTP 500.
+    """
+
+    SERVICES = ("twitch", "openweather", "ipapi", "facts", "openai")
+
+    def __init__(self, latency=0.05, error_rate=0.0, overrides=None, token_delay=0.01, tokens=20):
+        """
+        :param latency: Default latency for every service.
+        :param error_rate: Default error rate for every service.
+        :param overrides: {service: {"latency": s, "error_rate": r}} per-service settings.
+        :param token_delay: Seconds between streamed OpenAI chunks.
+        :param tokens: Chunks per streamed OpenAI reply.
+        """
+        self.config = {name: {"latency": latency, "error_rate": error_rate} for name in self.SERVICES}
+        for name, settings in (overrides or {}).items():
+            self.config[name].update(settings)
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.requests = {name: 0 for name in self.SERVICES}
+        self.errors = {name: 0 for name in self.SERVICES}
+        self.base_url = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def start(self):
+        """Start the server on a free port in a background thread."""
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(started,), daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.base_url
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def _serve(self, started):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.add_routes([
+            web.post("/twitch/oauth2/token", self._service("twitch", self._twitch_token)),
+            web.get("/twitch/helix/streams", self._service("twitch", self._twitch_streams)),
+            web.get("/openweather/geo/1.0/direct", self._service("openweather", self._geocode)),
+            web.get("/openweather/data/2.5/weather", self._service("openweather", self._weather)),
+            web.get("/ipapi/{ip}/json/", self._service("ipapi", self._ipapi)),
+            web.get("/facts/random.json", self._service("facts", self._fact)),
+            web.post("/openai/v1/chat/completions", self._service("openai", self._chat)),
+            web.post("/openai/v1/images/generations", self._service("openai", self._image)),
+            web.get("/openai/image.png", self._image_data),
+        ])
+        self._runner = web.AppRunner(app)
+        self._loop.run_until_complete(self._runner.setup())
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        self._loop.run_until_complete(web.SockSite(self._runner, sock).start())
+        self.base_url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+        started.set()
+        self._loop.run_forever()
+
+    def _service(self, name, handler):
+        async def wrapped(request):
+            settings = self.config[name]
+            self.requests[name] += 1
+            await asyncio.sleep(settings["latency"] * random.uniform(0.5, 1.5))
+            if random.random() < settings["error_rate"]:
+                self.errors[name] += 1
+                return web.json_response({"error": "stub failure"}, status=500)
+            return await handler(request)
+        return wrapped
+
+    async def _twitch_token(self, request):
+        return web.json_response({"access_token": "stub-token", "expires_in": 3600, "token_type": "bearer"})
+
+    async def _twitch_streams(self, request):
+        headers = {"Ratelimit-Limit": "800", "Ratelimit-Remaining": "799",
+                   "Ratelimit-Reset": str(int(time.time()) + 60)}
+        data = [{"id": str(next(_ids)), "user_login": login, "type": "live", "title": f"{login} live"}
+                for login in request.query.getall("user_login", []) if random.random() < 0.5]
+        return web.json_response({"data": data}, headers=headers)
+
+    async def _geocode(self, request):
+        return web.json_response([{"name": request.query.get("q"), "lat": random.uniform(-60, 60),
+                                   "lon": random.uniform(-180, 180)}])
+
+    async def _weather(self, request):
+        return web.json_response({
+            "name": "Stubville", "sys": {"country": "US"}, "main": {"temp": 71.2, "humidity": 40},
+            "weather": [{"description": "clear sky"}], "wind": {"speed": 3.1},
+        })
+
+    async def _ipapi(self, request):
+        ip = request.match_info["ip"]
+        return web.json_response({"ip": ip, "city": "Stubville", "region": "Nowhere", "country_name": "Stubland",
+                                  "org": "Stub ISP", "latitude": 1.0, "longitude": 2.0})
+
+    async def _fact(self, request):
+        fact_id = uuid.uuid4().hex
+        return web.json_response({"id": fact_id, "text": f"Stub fact {fact_id[:8]}."})
+
+    async def _chat(self, request):
+        body = await request.json()
+        words = [f"word{i} " for i in range(self.tokens)]
+        if not body.get("stream"):
+            return web.json_response({
+                "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)},
+                             "finish_reason": "stop"}],
+            })
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for word in words:
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": body.get("model"),
+                     "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(self.token_delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def _image(self, request):
+        return web.json_response({"created": int(time.time()), "data": [{"url": f"{self.base_url}/openai/image.png"}]})
+
+    async def _image_data(self, request):
+        return web.Response(body=b"\x89PNG\r\n\x1a\n" + bytes(4096), content_type="image/png")
+
+    def stats(self):
+        return {name: {"requests": self.requests[name], "errors": self.errors[name], **self.config[name]}
+                for name in self.SERVICES}
@@ -0,0 +1,300 @@
+"""
+Load test of the bot's command handling against local stub APIs.
+
+    python benchmarks/load_test.py [--requests 200] [--concurrency 20] [--commands fact,weather,...]
+
+Drives main.on_message and the /calculate tree command with synthetic messages
+while Twitch, OpenWeather, ipapi, uselessfacts and OpenAI are served by a local
+stub server (see fakes.py) with configurable latency and error rates. Reports
+throughput, latency percentiles and event loop lag per command, and saves the
+results as JSON under benchmarks/results/ so runs can be compared across commits.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+from fakes import StubServices, FakeInteraction, make_message
+
+CITIES = ["london", "paris", "tokyo", "new york", "sydney", "berlin", "madrid", "toronto", "cairo", "lima",
+          "oslo", "rome", "seoul", "dublin", "austin", "denver", "boston", "miami", "chicago", "phoenix"]
+PLACES = ["london", "tokyo", "europe/berlin", "america/chicago", "sydney", "utc", "paris, france", "texas"]
+
+
+def _random_ip():
+    return ".".join(str(random.randint(1, 254)) for _ in range(4))
+
+
+# Command name -> function returning the message content for one request
+SCENARIOS = {
+    "roll": lambda: "!roll",
+    "help": lambda: "!help",
+    "fact": lambda: "!fact",
+    "lookup_ip": lambda: "!lookup_ip " + " ".join(_random_ip() for _ in range(random.randint(1, 3))),
+    "time": lambda: f"!time {random.choice(PLACES)}",
+    "weather": lambda: f"!weather {random.choice(CITIES)}",
+    "chat": lambda: f"!chat tell me about {random.choice(CITIES)}",
+    "password": lambda: "!password 16",
+    "get_password": lambda: "!get_password",
+    "image": lambda: f"!image a cat in {random.choice(CITIES)}",
+    # Not message commands, handled by run_request
+    "calculate": lambda: ("sqrt(2) * pi + " + str(random.randint(1, 1000)), None),
+    "calculate_batch": lambda: ("x**2 + " + str(random.randint(1, 1000)), "1..50"),
+    "twitch": lambda: None,
+}
+DEFAULT_COMMANDS = ["roll", "help", "fact", "lookup_ip", "time", "weather", "chat", "password", "get_password",
+                    "image", "calculate", "calculate_batch", "twitch"]
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(samples):
+    """Milliseconds summary of a list of durations in seconds."""
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 0.5) * 1000, 2),
+        "p90_ms": round(percentile(ordered, 0.9) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+
+class LoopLagMonitor:
+    """Samples how late the event loop wakes up a task that sleeps for a fixed interval."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return self.samples
+
+
+def configure_environment(workdir):
+    """Settings the bot reads at import, pointed at throwaway values and a scratch directory."""
+    for name, value in {
+        "DISCORD_TOKEN": "stub", "NOTIFY_CHANNEL_ID": "0", "OPENAI_API_KEY": "stub", "WEATHER_API_KEY": "stub",
+        "TWITCH_CLIENT_ID": "stub", "TWITCH_CLIENT_SECRET": "stub", "IP_DATABASE_PATH": "", "WARMUP": "false",
+        "RATE_LIMIT_ENABLED": "false",
+    }.items():
+        os.environ.setdefault(name, value)
+    os.chdir(workdir)  # secret.key, passwords.db and the disk caches go here
+
+
+def install_stubs(base_url):
+    """Point every upstream API at the stub server."""
+    import openai
+    import ip_lookup
+    import random_fact
+    import twitch_notifier
+    import weather_module
+
+    twitch_notifier.BASE_TWITCH_URL = f"{base_url}/twitch/helix"
+    twitch_notifier.TOKEN_URL = f"{base_url}/twitch/oauth2/token"
+    weather_module.GEO_URL = f"{base_url}/openweather/geo/1.0/direct"
+    weather_module.WEATHER_URL = f"{base_url}/openweather/data/2.5/weather"
+    ip_lookup.IPAPI_URL = base_url + "/ipapi/{ip_address}/json/"
+    random_fact.FACT_URL = f"{base_url}/facts/random.json"
+    openai.api_base = f"{base_url}/openai/v1"
+
+
+async def run_request(main, name, user_id, discord_latency, settle_timeout):
+    """Handle one synthetic request and wait until the bot has answered it."""
+    if name in ("calculate", "calculate_batch"):
+        expression, values = SCENARIOS[name]()
+        interaction = FakeInteraction(user_id, latency=discord_latency)
+        await main.calculate_command.callback(interaction, expression, values)
+        return interaction.channel.sent
+    if name == "twitch":
+        await main.monitor_streams.coro()
+        return [True]
+
+    message = make_message(SCENARIOS[name](), user_id, channel_id=user_id % 10, latency=discord_latency)
+    # Channels and users are shared across requests, only count what was sent during this one
+    channel_start, dm_start = len(message.channel.sent), len(message.author.dm_channel.sent)
+    await main.on_message(message)
+    sent = message.channel.sent[channel_start:] + message.author.dm_channel.sent[dm_start:]
+    if name == "image" and sent:
+        # !image answers with a status message that is edited once the image is ready
+        await asyncio.wait_for(sent[0].edited.wait(), settle_timeout)
+    return sent
+
+
+async def run_scenario(main, name, args):
+    latencies = []
+    errors = 0
+    busy = 0
+    remaining = iter(range(args.requests))
+    monitor = LoopLagMonitor()
+
+    async def worker():
+        nonlocal errors, busy
+        for _ in remaining:
+            user_id = random.randint(1, args.users) + 1  # 1 is the bot itself
+            started = time.perf_counter()
+            try:
+                sent = await run_request(main, name, user_id, args.discord_latency / 1000, args.settle_timeout)
+                if not sent:
+                    errors += 1
+                elif any(str(getattr(m, "content", "")).startswith("I'm busy") for m in sent):
+                    busy += 1
+            except Exception as e:
+                errors += 1
+                if args.verbose:
+                    print(f"  {name}: {type(e).__name__}: {e}")
+            latencies.append(time.perf_counter() - started)
+
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    lag = await monitor.stop()
+    return {
+        "requests": args.requests,
+        "errors": errors,
+        "busy": busy,
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(args.requests / elapsed, 2) if elapsed else 0.0,
+        "latency": summarize(latencies),
+        "loop_lag": summarize(lag),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_overrides(pairs, key, scale=1.0):
+    overrides = {}
+    for pair in pairs:
+        service, value = pair.split("=", 1)
+        overrides.setdefault(service, {})[key] = float(value) * scale
+    return overrides
+
+
+async def run(args, stubs):
+    import main
+    import plugins
+
+    install_stubs(stubs.base_url)
+    # Load every lazy module up front so import time doesn't land in the first requests
+    await plugins.warm_up()
+    main.fact_buffer.start()
+
+    results = {}
+    try:
+        for name in args.commands:
+            print(f"Running {name}...")
+            results[name] = await run_scenario(main, name, args)
+    finally:
+        await main.fact_buffer.stop()
+        if main.images.loaded:
+            await main.images.module.image_jobs.stop()
+        await main.http_client.close()
+    return results
+
+
+def print_table(results):
+    print(f"\n{'command':<16} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'lag p99':>9} "
+          f"{'errors':>7} {'busy':>6}")
+    for name, result in results.items():
+        print(f"{name:<16} {result['throughput_per_s']:>8} {result['latency']['p50_ms']:>9} "
+              f"{result['latency']['p99_ms']:>9} {result['latency']['max_ms']:>9} "
+              f"{result['loop_lag']['p99_ms']:>9} {result['errors']:>7} {result['busy']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--requests", type=int, default=200, help="Requests per command.")
+    parser.add_argument("--concurrency", type=int, default=20, help="Requests in flight at once.")
+    parser.add_argument("--users", type=int, default=50, help="Distinct users sending requests.")
+    parser.add_argument("--commands", default=",".join(DEFAULT_COMMANDS),
+                        help=f"Comma separated commands to run, from: {', '.join(SCENARIOS)}")
+    parser.add_argument("--latency", type=float, default=50, help="Stub API latency in ms.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub API requests that fail.")
+    parser.add_argument("--service-latency", action="append", default=[], metavar="SERVICE=MS",
+                        help=f"Latency for one service ({', '.join(StubServices.SERVICES)}).")
+    parser.add_argument("--service-error-rate", action="append", default=[], metavar="SERVICE=RATE",
+                        help="Error rate for one service.")
+    parser.add_argument("--discord-latency", type=float, default=0, help="Simulated Discord API latency in ms.")
+    parser.add_argument("--settle-timeout", type=float, default=30, help="Seconds to wait for !image results.")
+    parser.add_argument("--output", help="Result file (default benchmarks/results/<commit>-<time>.json).")
+    parser.add_argument("--verbose", action="store_true", help="Print every failed request.")
+    args = parser.parse_args()
+    args.commands = [name.strip() for name in args.commands.split(",") if name.strip()]
+    unknown = [name for name in args.commands if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown commands: {', '.join(unknown)}")
+
+    overrides = parse_overrides(args.service_latency, "latency", scale=1 / 1000)
+    for service, settings in parse_overrides(args.service_error_rate, "error_rate").items():
+        overrides.setdefault(service, {}).update(settings)
+    stubs = StubServices(latency=args.latency / 1000, error_rate=args.error_rate, overrides=overrides)
+    stubs.start()
+
+    commit = git_commit()
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"{commit or 'unknown'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    output = os.path.abspath(output)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(workdir)
+        try:
+            results = asyncio.run(run(args, stubs))
+        finally:
+            stubs.stop()
+
+    report = {
+        "commit": commit,
+        "time": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "verbose")},
+        "stubs": stubs.stats(),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print_table(results)
+    print(f"\nSaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
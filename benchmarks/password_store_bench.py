@@ -0,0 +1,65 @@
+"""
+Lookup latency of the password store at scale.
+
+    python benchmarks/password_store_bench.py [users] [lookups]
+
+Fills a temporary database with random user IDs (1M by default), then times
+random lookups through PasswordStore and, for comparison, against the old
+schema without a primary key.
+"""
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from password_manager import PasswordStore
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda fraction: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1e6
+    return f"p50 {pick(0.5):.1f}us  p99 {pick(0.99):.1f}us  mean {statistics.mean(ordered) * 1e6:.1f}us"
+
+
+def time_lookups(lookup, user_ids, count):
+    samples = []
+    for user_id in random.sample(user_ids, count):
+        started = time.perf_counter()
+        lookup(user_id)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    user_ids = [str(random.getrandbits(63)) for _ in range(users)]
+    # Lookups only read the column, so a fixed blob stands in for Fernet output
+    password = os.urandom(100)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = PasswordStore(os.path.join(tmp, "bench.db"))
+        started = time.perf_counter()
+        for i in range(0, users, 50_000):
+            store.put_many((user_id, password) for user_id in user_ids[i:i + 50_000])
+        print(f"Inserted {users} users in {time.perf_counter() - started:.1f}s")
+        print(f"PasswordStore.get:  {percentiles(time_lookups(store.get, user_ids, lookups))}")
+        store.close()
+
+        # The old schema, which scans the whole table for every lookup
+        legacy = sqlite3.connect(os.path.join(tmp, "legacy.db"))
+        legacy.execute("CREATE TABLE passwords (user_id TEXT NOT NULL, password TEXT NOT NULL)")
+        legacy.executemany("INSERT INTO passwords VALUES (?, ?)", ((user_id, password) for user_id in user_ids))
+        legacy.commit()
+        lookup = lambda user_id: legacy.execute(
+            "SELECT password FROM passwords WHERE user_id = ?", (user_id,)).fetchone()
+        print(f"Old schema:         {percentiles(time_lookups(lookup, user_ids, min(lookups, 200)))}")
+        legacy.close()
+
+
+if __name__ == "__main__":
+    main()
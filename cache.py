@@ -0,0 +1,231 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Returned by get() when a key isn't cached, since None can be a cached value
+MISSING = object()
+
+# Every Cache by name, for stats
+caches = {}
+
+
+class TTLCache:
+    """In-memory LRU cache whose entries expire after a fixed TTL."""
+
+    def __init__(self, maxsize, ttl, keep_stale=False):
+        """
+        :param maxsize: Maximum number of entries before the least recently used is evicted.
+        :param ttl: Seconds an entry stays valid.
+        :param keep_stale: Keep expired entries (until evicted) for get_stale.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.keep_stale = keep_stale
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or MISSING."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            if entry[0] < time.monotonic():
+                if not self.keep_stale:
+                    del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def get_stale(self, key):
+        """Return the value for key even if it has expired, or MISSING."""
+        with self._lock:
+            entry = self._data.get(key)
+        return MISSING if entry is None else entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    """A sqlite-backed cache for JSON-serializable values that survives restarts."""
+
+    def __init__(self, path, ttl):
+        """
+        :param path: Path of the sqlite file.
+        :param ttl: Seconds an entry stays valid.
+        """
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Writes can happen on the event loop, so skip the fsync per commit
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, key):
+        """Return the cached value for key, or MISSING."""
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return MISSING
+        return json.loads(row[0])
+
+    def get_stale(self, key):
+        """Return the value for key even if it has expired but not been purged, or MISSING."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        return MISSING if row is None else json.loads(row[0])
+
+    def set(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + self.ttl),
+            )
+            self._conn.commit()
+
+    def purge_expired(self):
+        """Delete expired rows."""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+
+
+class Cache:
+    """
+    An in-memory LRU with an optional disk tier behind it. Concurrent loads
+    of the same key are coalesced into a single call to the loader.
+    """
+
+    def __init__(self, name, maxsize, ttl, disk_path=None, disk_ttl=None):
+        """
+        :param name: Name used in logs and stats.
+        :param maxsize: Maximum number of in-memory entries.
+        :param ttl: Seconds an in-memory entry stays valid.
+        :param disk_path: Optional sqlite file for the second tier.
+        :param disk_ttl: Seconds a disk entry stays valid, defaults to ttl.
+        """
+        self.name = name
+        self.memory = TTLCache(maxsize, ttl, keep_stale=True)
+        self.disk = DiskCache(disk_path, disk_ttl or ttl) if disk_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale_hits = 0
+        self._inflight = {}  # key -> asyncio.Future for loads in progress
+        caches[name] = self
+
+    def get(self, key):
+        """Return the cached value from either tier, or MISSING."""
+        value = self.memory.get(key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not MISSING:
+                self.disk_hits += 1
+                self.memory.set(key, value)
+                return value
+        return MISSING
+
+    def get_stale(self, key):
+        """Return the value for key from either tier even if it has expired, or MISSING."""
+        value = self.memory.get_stale(key)
+        if value is MISSING and self.disk is not None:
+            value = self.disk.get_stale(key)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    async def get_or_load_async(self, key, loader, stale_if_error=False):
+        """
+        Return the cached value for key, awaiting loader() on a miss. Concurrent
+        callers for the same key wait for the first one's load.
+        :param key: A string key.
+        :param loader: Coroutine function returning the value. None results are not cached.
+        :param stale_if_error: If the load fails, return an expired value instead of raising, if there is one.
+        :return: The cached or loaded value.
+        """
+        try:
+            return await self._get_or_load_async(key, loader)
+        except Exception as e:
+            if not stale_if_error:
+                raise
+            value = self.get_stale(key)
+            if value is MISSING:
+                raise
+            self.stale_hits += 1
+            logger.warning("Serving stale %s entry for %s: %s", self.name, key, e)
+            return value
+
+    async def _get_or_load_async(self, key, loader):
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+            if value is not None:
+                self.set(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else may be waiting, don't log "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self):
+        """Return hit/miss counters for this cache."""
+        lookups = self.hits + self.disk_hits + self.misses + self.coalesced
+        return {
+            "size": len(self.memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "stale_hits": self.stale_hits,
+            "hit_ratio": (lookups - self.misses) / lookups if lookups else 0.0,
+        }
+
+
+def cache_stats():
+    """Return stats() for every Cache by name."""
+    return {name: cache.stats() for name, cache in list(caches.items())}
@@ -1,9 +1,174 @@
+import ast
 import logging
+import math
+import operator
+from functools import lru_cache
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Limits that keep every calculation fast
+MAX_LENGTH = 200        # Characters in an expression
+MAX_NODES = 100         # Operations, numbers and names in an expression
+MAX_EXPONENT = 1000     # Largest exponent allowed in **
+MAX_ROUND_DIGITS = 15   # Largest ndigits allowed in round(), either sign
+MAX_INT_BITS = 4096     # Largest integer result (about 1200 digits)
+MAX_BATCH = 100         # Values per batch evaluation
+MAX_STEPS = 5000        # Nodes evaluated per batch (nodes x values)
+
+CONSTANTS = {"pi": math.pi, "e": math.e, "tau": math.tau}
+
+
+class CalculationError(ValueError):
+    """Raised for expressions that aren't allowed or can't be evaluated."""
+
+
+def _check(result):
+    """Reject results that are too large or not real numbers."""
+    if isinstance(result, int):
+        if result.bit_length() > MAX_INT_BITS:
+            raise CalculationError("Result is too large.")
+    elif isinstance(result, float):
+        if math.isinf(result):
+            raise CalculationError("Result is too large.")
+    else:
+        raise CalculationError("Result is not a real number.")
+    return result
+
+
+def _power(base, exponent):
+    if abs(exponent) > MAX_EXPONENT:
+        raise CalculationError(f"Exponents are limited to {MAX_EXPONENT}.")
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0 and abs(base) > 1:
+        # Check the size before computing it, big integer powers are what freeze the bot
+        if (abs(base).bit_length() - 1) * exponent > MAX_INT_BITS:
+            raise CalculationError("Result is too large.")
+    return base ** exponent
+
+
+def _round(number, ndigits=None):
+    if ndigits is None:
+        return round(number)
+    # round(5, -10**9) builds 10**(10**9), check the digits before it can freeze the bot
+    if not float(ndigits).is_integer() or abs(ndigits) > MAX_ROUND_DIGITS:
+        raise CalculationError(f"round() takes a whole number of digits from -{MAX_ROUND_DIGITS} "
+                               f"to {MAX_ROUND_DIGITS}.")
+    return round(number, int(ndigits))
+
+
+def _factorial(n):
+    if not float(n).is_integer() or not 0 <= n <= 170:
+        raise CalculationError("factorial() takes a whole number from 0 to 170.")
+    return math.factorial(int(n))
+
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: _power,
+}
+
+UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+FUNCTIONS = {
+    "abs": abs,
+    "round": _round,
+    "min": min,
+    "max": max,
+    "sqrt": math.sqrt,
+    "exp": math.exp,
+    "log": math.log,
+    "log10": math.log10,
+    "log2": math.log2,
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "asin": math.asin,
+    "acos": math.acos,
+    "atan": math.atan,
+    "atan2": math.atan2,
+    "sinh": math.sinh,
+    "cosh": math.cosh,
+    "tanh": math.tanh,
+    "degrees": math.degrees,
+    "radians": math.radians,
+    "hypot": math.hypot,
+    "floor": math.floor,
+    "ceil": math.ceil,
+    "factorial": _factorial,
+}
+
+
+def _compile_node(node, variable):
+    """Turn an AST node into a function of the variable's value."""
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        value = node.value
+        return lambda x: value
+    if isinstance(node, ast.Name):
+        if node.id in CONSTANTS:
+            value = CONSTANTS[node.id]
+            return lambda x: value
+        if node.id == variable:
+            return lambda x: x
+        raise CalculationError(f"Unknown name: {node.id}")
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        op = BINARY_OPERATORS[type(node.op)]
+        left = _compile_node(node.left, variable)
+        right = _compile_node(node.right, variable)
+        return lambda x: _check(op(left(x), right(x)))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        op = UNARY_OPERATORS[type(node.op)]
+        operand = _compile_node(node.operand, variable)
+        return lambda x: op(operand(x))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        func = FUNCTIONS.get(node.func.id)
+        if func is None:
+            raise CalculationError(f"Unknown function: {node.func.id}")
+        args = [_compile_node(arg, variable) for arg in node.args]
+        return lambda x: _check(func(*[arg(x) for arg in args]))
+    raise CalculationError(f"Unsupported syntax: {type(node).__name__}")
+
+
+@lru_cache(maxsize=256)
+def compile_expression(expression, variable="x"):
+    """
+    Parse and compile an expression using only whitelisted operators and functions.
+    :param expression: The expression text.
+    :param variable: Name of the variable batch evaluation substitutes values for.
+    :return: A tuple (function of the variable's value, number of nodes).
+    """
+    if len(expression) > MAX_LENGTH:
+        raise CalculationError(f"Expressions are limited to {MAX_LENGTH} characters.")
+    try:
+        tree = ast.parse(expression.replace("^", "**"), mode="eval")
+    except (SyntaxError, ValueError):
+        raise CalculationError("Invalid mathematical expression.")
+    nodes = sum(1 for _ in ast.walk(tree))
+    if nodes > MAX_NODES:
+        raise CalculationError("Expression is too long.")
+    return _compile_node(tree.body, variable), nodes
+
+
+def _evaluate(func, value=None):
+    try:
+        return func(value)
+    except CalculationError:
+        raise
+    except ZeroDivisionError:
+        raise CalculationError("Division by zero.")
+    except OverflowError:
+        raise CalculationError("Result is too large.")
+    except (ValueError, TypeError) as e:
+        raise CalculationError(f"Math error: {e}")
+
+
 def calculate(expression):
     """
     Evaluates a mathematical expression and returns the result.
@@ -11,11 +176,72 @@ def calculate(expression):
     :return: Result of the calculation.
     """
     try:
-        logger.info(f"Calculating expression: {expression}")
-        # Evaluate the mathematical expression securely
-        result = eval(expression, {"__builtins__": None}, {})
-        logger.info(f"Calculation result: {result}")
+        logger.debug("Calculating expression: %s", expression)
+        func, _ = compile_expression(expression.strip(), None)
+        result = _evaluate(func)
+        logger.debug("Calculation result: %s", result)
         return result
-    except Exception as e:
-        logger.error(f"Error in calculation: {e}")
-        return "Error: Invalid mathematical expression."
+    except CalculationError as e:
+        logger.debug("Error in calculation: %s", e)
+        return f"Error: {e}"
+
+
+def parse_values(text):
+    """
+    Parse batch values: a range "start..stop" or "start..stop..step" (inclusive), or a comma separated list.
+    :param text: The values text.
+    :return: List of numbers, never empty.
+    """
+    def number(part):
+        value = float(part)
+        return int(value) if value.is_integer() else value
+
+    try:
+        if ".." in text:
+            parts = [number(part) for part in text.split("..")]
+            if len(parts) not in (2, 3):
+                raise CalculationError("Ranges look like 1..10 or 0..1..0.1")
+            start, stop = parts[0], parts[1]
+            step = parts[2] if len(parts) == 3 else 1
+            if step <= 0:
+                raise CalculationError("The range step must be positive.")
+            if (stop - start) / step >= MAX_BATCH:
+                raise CalculationError(f"Ranges are limited to {MAX_BATCH} values.")
+            count = int(round((stop - start) / step)) + 1
+            values = [number(f"{start + i * step:.10g}") for i in range(max(count, 0))]
+        else:
+            values = [number(part) for part in text.replace(" ", "").split(",") if part]
+    except CalculationError:
+        raise
+    except ValueError:
+        raise CalculationError("Values must be numbers.")
+    if not values:
+        raise CalculationError("No values to evaluate.")
+    if len(values) > MAX_BATCH:
+        raise CalculationError(f"Batches are limited to {MAX_BATCH} values.")
+    return values
+
+
+def calculate_batch(expression, values):
+    """
+    Evaluate an expression in x for each value, compiling it only once.
+    :param expression: Expression using the variable x, e.g. "x**2 + 1".
+    :param values: Values text for parse_values, e.g. "1..10" or "1,2,3".
+    :return: List of (value, result) pairs, or an error message string.
+    """
+    try:
+        logger.debug("Calculating expression: %s for x in %s", expression, values)
+        func, nodes = compile_expression(expression.strip())
+        xs = parse_values(values)
+        if nodes * len(xs) > MAX_STEPS:
+            raise CalculationError("That batch is too large, use fewer values or a shorter expression.")
+        results = []
+        for x in xs:
+            try:
+                results.append((x, _evaluate(func, x)))
+            except CalculationError as e:
+                results.append((x, f"Error: {e}"))
+        return results
+    except CalculationError as e:
+        logger.debug("Error in calculation: %s", e)
+        return f"Error: {e}"
@@ -2,35 +2,100 @@ import openai
 import os
 from dotenv import load_dotenv
 import logging
+from conversation_memory import ConversationStore
+from llm_scheduler import LLMScheduler, SchedulerBusyError
+import http_client
+from metrics import track_upstream
 
 # Load environment variables
 load_dotenv()
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # OpenAI API key
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-def get_chatgpt_response(prompt):
+MODEL = "gpt-4o-mini"
+SYSTEM_PROMPT = "You are Donald Trump and very full of yourself."
+ERROR_REPLY = "Sorry, I couldn't process your request."
+# Stream !chat replies into the message as they are generated
+STREAMING = os.getenv("CHAT_STREAMING", "true").lower() == "true"
+
+# Recent !chat history per (channel, user), so follow-ups have context
+conversations = ConversationStore(
+    max_conversations=int(os.getenv("CHAT_MAX_CONVERSATIONS", "1000")),
+    token_budget=int(os.getenv("CHAT_CONTEXT_TOKENS", "3000")),
+)
+
+def _build_messages(prompt, conversation_key=None):
+    if conversation_key is None:
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+    return conversations.build_messages(conversation_key, SYSTEM_PROMPT, prompt)
+
+async def _request_stream(messages):
+    """Stream a completion for a message list straight from the API."""
+    # Reuse the shared connection pool instead of a session per call
+    openai.aiosession.set(http_client.get_session())
+    # Timed until the stream ends, so this is the full generation time
+    with track_upstream("openai"):
+        response = await openai.ChatCompletion.acreate(
+            model=MODEL,
+            messages=messages,
+            max_tokens=1000,
+            temperature=0.7,
+            stream=True
+        )
+        async for chunk in response:
+            delta = chunk.choices[0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+
+# Queues !chat requests fairly per user, coalesces identical prompts and caches replies briefly.
+# The legacy openai client doesn't expose rate limit headers, so concurrency backs off on
+# RateLimitError instead.
+scheduler = LLMScheduler(
+    _request_stream,
+    max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "4")),
+    max_queue=int(os.getenv("OPENAI_MAX_QUEUE", "100")),
+    cache_ttl=int(os.getenv("CHAT_CACHE_TTL", "60")),
+    rate_limit_errors=(openai.error.RateLimitError,),
+)
+
+async def stream_chatgpt_response(prompt, conversation_key=None):
     """
-    Get a response from ChatGPT for a given prompt.
+    Stream a response from ChatGPT for a given prompt as it is generated.
     :param prompt: User input string.
-    :return: ChatGPT's response string.
+    :param conversation_key: Optional (channel, user) key to continue a conversation.
+    :return: Async generator of text fragments.
     """
+    user_id = conversation_key[1] if conversation_key else None
+    received = []
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are Donald Trump and very full of yourself."},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=1000,
-            temperature=0.7
-        )
-        logger.info("Successfully fetched response from ChatGPT.")
-        return response.choices[0].message['content']
+        async for delta in scheduler.stream(user_id, _build_messages(prompt, conversation_key)):
+            received.append(delta)
+            yield delta
+        logger.debug("Successfully streamed response from ChatGPT.")
+        if conversation_key is not None:
+            conversations.record(conversation_key, prompt, "".join(received))
+    except SchedulerBusyError:
+        raise
     except Exception as e:
-        logger.error(f"Error communicating with ChatGPT: {e}")
-        return "Sorry, I couldn't process your request."
+        logger.error("Error communicating with ChatGPT: %s", e)
+        yield ("\n\n" if received else "") + ERROR_REPLY
+
+async def get_chatgpt_reply(prompt, conversation_key=None):
+    """
+    Get a complete response from ChatGPT through the scheduler.
+    :param prompt: User input string.
+    :param conversation_key: Optional (channel, user) key to continue a conversation.
+    :return: ChatGPT's response string.
+    """
+    return "".join([delta async for delta in stream_chatgpt_response(prompt, conversation_key)])
+
+def forget_conversation(conversation_key):
+    """Clear the history for a (channel, user) key."""
+    conversations.forget(conversation_key)
@@ -0,0 +1,105 @@
+import logging
+import os
+import time
+import metrics
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+transitions_total = metrics.Counter("bot_circuit_transitions_total", "Circuit breaker state changes.",
+                                    ("upstream", "state"))
+metrics.METRICS.append(transitions_total)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+    def __init__(self, upstream, retry_in):
+        super().__init__(f"{upstream} is unavailable, retrying in {retry_in:.0f}s.")
+        self.upstream = upstream
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream after repeated failures. Closed lets every call through;
+    after failure_threshold consecutive failures it opens and fails calls immediately.
+    After reset_timeout it goes half-open and lets one probe through, which closes it
+    on success or opens it again on failure.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        """
+        :param name: Upstream name, for logs and metrics.
+        :param failure_threshold: Consecutive failures that open the circuit.
+        :param reset_timeout: Seconds to stay open before probing again.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def _transition(self, state):
+        if state != self.state:
+            logger.warning("Circuit for %s is now %s.", self.name, state.replace("_", "-"))
+            self.state = state
+            transitions_total.inc(self.name, state)
+
+    def before_call(self):
+        """
+        Check that a call may go ahead.
+        :raises CircuitOpenError: If the circuit is open, or half-open with a probe already in flight.
+        """
+        if self.state == CLOSED:
+            return
+        retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+        if self.state == OPEN and retry_in <= 0:
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        raise CircuitOpenError(self.name, max(retry_in, 0))
+
+    def record_success(self):
+        self.failures = 0
+        self._probing = False
+        self._transition(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._transition(OPEN)
+
+    def record_cancelled(self):
+        """A call was abandoned before it finished, e.g. the losing half of a hedged request."""
+        self._probing = False
+
+
+breakers = {}
+
+
+def get_breaker(upstream):
+    """Return the circuit breaker for an upstream, creating it on first use."""
+    breaker = breakers.get(upstream)
+    if breaker is None:
+        breaker = breakers[upstream] = CircuitBreaker(
+            upstream,
+            failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30")),
+        )
+    return breaker
+
+
+metrics.register_collector("circuit", lambda: {
+    f'bot_circuit_state{{upstream="{name}"}}': STATE_VALUES[breaker.state] for name, breaker in breakers.items()
+})
@@ -0,0 +1,138 @@
+import logging
+import time
+from metrics import observe_command
+from rate_limit import limiter, retry_message
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+PREFIX = "!"
+
+# Argument styles a command can declare
+NO_ARGS = "none"            # handler(message)
+TEXT = "text"               # handler(message, text), text is required
+OPTIONAL_TEXT = "optional"  # handler(message, text), text may be empty
+
+
+class UsageError(Exception):
+    """Raised by a handler or argument parser when the command was used incorrectly."""
+
+
+class Command:
+    """A registered prefix command."""
+
+    __slots__ = ("name", "handler", "usage", "description", "args", "aliases")
+
+    def __init__(self, name, handler, usage, description, args, aliases):
+        self.name = name
+        self.handler = handler
+        self.usage = usage
+        self.description = description
+        self.args = args
+        self.aliases = aliases
+
+    def parse(self, text):
+        """
+        Turn the text after the command name into handler arguments.
+        :param text: Everything after the command name, stripped.
+        :return: A tuple of positional arguments for the handler.
+        """
+        if self.args == NO_ARGS:
+            return ()
+        if self.args == TEXT:
+            if not text:
+                raise UsageError()
+            return (text,)
+        if self.args == OPTIONAL_TEXT:
+            return (text,)
+        # Custom parser callable
+        try:
+            return tuple(self.args(text))
+        except ValueError as e:
+            raise UsageError(str(e)) from e
+
+
+# Command name or alias -> Command
+registry = {}
+
+
+def command(name, usage=None, description="", args=NO_ARGS, aliases=()):
+    """
+    Decorator that registers a coroutine as a prefix command.
+    :param name: Command name without the prefix.
+    :param usage: Usage text shown when the command is used incorrectly.
+    :param description: Short description shown by !help.
+    :param args: NO_ARGS, TEXT, OPTIONAL_TEXT or a callable that parses the argument text.
+    :param aliases: Other names that run the same command.
+    """
+    def decorator(handler):
+        cmd = Command(name, handler, usage or f"{PREFIX}{name}", description, args, tuple(aliases))
+        for key in (name, *aliases):
+            key = key.lower()
+            if key in registry:
+                raise ValueError(f"Command '{key}' is already registered.")
+            registry[key] = cmd
+        return handler
+    return decorator
+
+
+def parse_command(content):
+    """
+    Split a message into its command and argument text.
+    :param content: Raw message content.
+    :return: A tuple (Command, argument text) or None if the message isn't a known command.
+    """
+    if not content.startswith(PREFIX):
+        return None
+    parts = content[len(PREFIX):].split(None, 1)
+    if not parts:
+        return None
+    cmd = registry.get(parts[0].lower())
+    if cmd is None:
+        return None
+    return cmd, parts[1].strip() if len(parts) > 1 else ""
+
+
+async def dispatch(message):
+    """
+    Run the command contained in a message.
+    :param message: The discord.Message to handle.
+    :return: True if the message was a registered command.
+    """
+    parsed = parse_command(message.content)
+    if parsed is None:
+        return False
+
+    cmd, text = parsed
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        args = cmd.parse(text)
+        # Usage errors are checked first so they don't cost anything
+        guild = getattr(message, "guild", None)
+        retry_in, notify = limiter.acquire(cmd.name, message.author.id, guild.id if guild else None)
+        if retry_in:
+            status = "limited"
+            if notify:
+                await message.channel.send(retry_message(retry_in))
+            return True
+        await cmd.handler(message, *args)
+    except UsageError as e:
+        status = "usage"
+        reason = f"{e} " if str(e) else ""
+        await message.channel.send(f"{reason}Usage: `{cmd.usage}`")
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        observe_command(cmd.name, status, time.perf_counter() - started)
+    return True
+
+
+def unique_commands():
+    """Return each registered command once, in registration order."""
+    seen = []
+    for cmd in registry.values():
+        if cmd not in seen:
+            seen.append(cmd)
+    return seen
@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except ImportError:
+    _encoding = None  # Fall back to the ~4 characters per token estimate
+
+
+def count_tokens(text):
+    """Count (or estimate, without tiktoken) the tokens in a piece of text."""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+class Turn:
+    """One message in a conversation."""
+
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role, content):
+        self.role = role
+        self.content = content
+        self.tokens = count_tokens(content) + 4  # Per-message overhead
+
+
+class Conversation:
+    """The recent turns of one user's conversation in one channel."""
+
+    __slots__ = ("turns", "summary", "last_used")
+
+    def __init__(self):
+        self.turns = []
+        self.summary = ""  # Short notes on turns that no longer fit
+        self.last_used = time.monotonic()
+
+
+class ConversationStore:
+    """
+    Bounded store of !chat conversations keyed by (channel, user). Idle conversations
+    are evicted least recently used first, and each conversation keeps a fixed number
+    of turns, folding older ones into a short summary.
+    """
+
+    def __init__(self, max_conversations=1000, max_turns=12, idle_ttl=3600, token_budget=3000,
+                 summary_chars=600):
+        """
+        :param max_conversations: Conversations kept before the least recently used is evicted.
+        :param max_turns: Turns kept per conversation before older ones are summarized.
+        :param idle_ttl: Seconds of inactivity after which a conversation is forgotten.
+        :param token_budget: Maximum tokens of prompt sent per request, excluding the reply.
+        :param summary_chars: Maximum length of a conversation's summary.
+        """
+        self.max_conversations = max_conversations
+        self.max_turns = max_turns
+        self.idle_ttl = idle_ttl
+        self.token_budget = token_budget
+        self.summary_chars = summary_chars
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()  # The non-streaming path calls in from executor threads
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._conversations:
+            key, conversation = next(iter(self._conversations.items()))
+            if len(self._conversations) <= self.max_conversations and now - conversation.last_used < self.idle_ttl:
+                break
+            del self._conversations[key]
+
+    def _get(self, key):
+        self._evict()
+        conversation = self._conversations.get(key)
+        if conversation is None:
+            conversation = self._conversations[key] = Conversation()
+        self._conversations.move_to_end(key)
+        conversation.last_used = time.monotonic()
+        return conversation
+
+    def build_messages(self, key, system_prompt, prompt):
+        """
+        Assemble the messages for a request, fitting as much history as the budget allows.
+        :param key: Conversation key, e.g. (channel_id, user_id).
+        :param system_prompt: The system prompt.
+        :param prompt: The new user message.
+        :return: List of chat messages for the API.
+        """
+        with self._lock:
+            conversation = self._get(key)
+            turns = list(conversation.turns)
+            summary = conversation.summary
+        system = system_prompt
+        if summary:
+            system += f"\n\nEarlier in this conversation: {summary}"
+        budget = self.token_budget - count_tokens(system) - count_tokens(prompt) - 8
+
+        # Add whole exchanges, newest first, until the budget runs out
+        start = len(turns)
+        while start >= 2:
+            tokens = turns[start - 2].tokens + turns[start - 1].tokens
+            if tokens > budget:
+                break
+            budget -= tokens
+            start -= 2
+        history = [{"role": turn.role, "content": turn.content} for turn in turns[start:]]
+        return [{"role": "system", "content": system}, *history, {"role": "user", "content": prompt}]
+
+    def record(self, key, prompt, reply):
+        """
+        Add a completed exchange to a conversation.
+        :param key: Conversation key, e.g. (channel_id, user_id).
+        :param prompt: The user's message.
+        :param reply: The assistant's reply.
+        """
+        new_turns = [Turn("user", prompt), Turn("assistant", reply)]
+        with self._lock:
+            conversation = self._get(key)
+            conversation.turns.extend(new_turns)
+            while len(conversation.turns) > self.max_turns:
+                summary = conversation.summary
+                for old in conversation.turns[:2]:
+                    note = old.content if len(old.content) <= 120 else old.content[:117] + "..."
+                    speaker = "User" if old.role == "user" else "You"
+                    summary = f"{summary} {speaker}: {note}".strip()
+                del conversation.turns[:2]
+                # Keep the most recent part of the summary
+                conversation.summary = summary[-self.summary_chars:]
+
+    def forget(self, key):
+        """Drop a conversation."""
+        with self._lock:
+            self._conversations.pop(key, None)
+
+    def __len__(self):
+        return len(self._conversations)
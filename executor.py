@@ -0,0 +1,125 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Default (workers, max queued) per command class. Override with
+# EXECUTOR_<CLASS>_WORKERS and EXECUTOR_<CLASS>_QUEUE in the .env file.
+DEFAULT_LIMITS = {
+    "db": (1, 128),       # sqlite, one writer at a time
+    "startup": (1, 16),   # Lazy module imports, see plugins.py
+}
+
+
+class BusyError(Exception):
+    """Base for errors raised when a queue is full. Commands reply with "I'm busy" to any of them."""
+
+
+class ExecutorBusyError(BusyError):
+    """Raised when a command class already has its maximum number of queued jobs."""
+
+    def __init__(self, command_class):
+        super().__init__(f"Too many pending '{command_class}' commands.")
+        self.command_class = command_class
+
+
+class CommandExecutor:
+    """A bounded thread pool for one class of blocking commands."""
+
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pending = 0  # Jobs submitted but not finished (running + waiting)
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"cmd-{name}")
+
+    @property
+    def queue_depth(self):
+        """Number of jobs waiting for a free worker."""
+        return self.pending - self.running
+
+    def _run(self, func, args, kwargs):
+        with self._lock:
+            self.running += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run a blocking function on this executor without blocking the event loop.
+        :param func: The blocking callable.
+        :return: Whatever the callable returns.
+        """
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            logger.warning("Executor '%s' is full (%s pending), rejecting job.", self.name, self.pending)
+            raise ExecutorBusyError(self.name)
+
+        self.pending += 1
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool, functools.partial(self._run, func, args, kwargs))
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self):
+        """Return a snapshot of this executor's counters."""
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": self.queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _load_executors():
+    executors = {}
+    for name, (workers, max_queue) in DEFAULT_LIMITS.items():
+        workers = int(os.getenv(f"EXECUTOR_{name.upper()}_WORKERS", workers))
+        max_queue = int(os.getenv(f"EXECUTOR_{name.upper()}_QUEUE", max_queue))
+        executors[name] = CommandExecutor(name, max(1, workers), max(0, max_queue))
+    return executors
+
+
+executors = _load_executors()
+
+
+async def run_blocking(command_class, func, *args, **kwargs):
+    """
+    Run a blocking call on the executor for the given command class.
+    :param command_class: One of the keys in DEFAULT_LIMITS.
+    :param func: The blocking callable.
+    :return: Whatever the callable returns.
+    """
+    return await executors[command_class].run(func, *args, **kwargs)
+
+
+def executor_stats():
+    """Return counters and queue depth for every command class."""
+    return {name: executor.stats() for name, executor in executors.items()}
+
+
+def shutdown_executors():
+    for executor in executors.values():
+        executor.shutdown()
@@ -0,0 +1,265 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import aiohttp
+from dotenv import load_dotenv
+import metrics
+from circuit_breaker import CircuitOpenError, get_breaker
+from metrics import LatencyStats, track_upstream
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Connection pool and timeout defaults, seconds unless noted
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "10"))
+DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+TIMEOUT = aiohttp.ClientTimeout(
+    total=float(os.getenv("HTTP_TIMEOUT", "10")),
+    connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", "3")),
+)
+MAX_RETRIES = 2
+BACKOFF_BASE = 0.25  # First retry waits up to this long, doubling after that
+BACKOFF_MAX = 5.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+# Statuses that count as an upstream failure for metrics and circuit breakers
+FAILURE_STATUSES = (429, 500, 502, 503, 504)
+
+# Hedged GETs: a second copy is sent once a request is slower than the upstream's p95
+HEDGING = os.getenv("HTTP_HEDGING", "true").lower() == "true"
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.05
+hedged_total = metrics.Counter("bot_hedged_requests_total", "Requests sent a second time after the p95 deadline.",
+                               ("upstream",))
+metrics.METRICS.append(hedged_total)
+latencies = {}  # upstream -> LatencyStats of successful requests
+_hedge_delays = {}  # upstream -> (sample count when computed, delay)
+
+# aiohttp only speaks HTTP/1.1. The upstreams are a handful of hosts with small JSON
+# responses, so pooled keep-alive connections already remove the per-call handshakes
+# HTTP/2 multiplexing would.
+session = None
+
+
+class HTTPError(Exception):
+    """Raised for responses with an error status."""
+
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status} from {response.url}")
+        self.response = response
+        self.status = response.status
+
+
+# Everything request() can raise for a failed request, for callers that handle any of them
+REQUEST_ERRORS = (HTTPError, CircuitOpenError, aiohttp.ClientError, asyncio.TimeoutError, ValueError)
+
+
+class Response:
+    """A response whose body has already been read, so the connection is back in the pool."""
+
+    __slots__ = ("status", "headers", "url", "body")
+
+    def __init__(self, status, headers, url, body):
+        self.status = status
+        self.headers = headers
+        self.url = url
+        self.body = body
+
+    @property
+    def ok(self):
+        return self.status < 400
+
+    @property
+    def text(self):
+        return self.body.decode("utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise HTTPError(self)
+
+
+def get_session():
+    """Return the shared session, creating it on first use."""
+    global session
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=MAX_CONNECTIONS,
+            limit_per_host=MAX_CONNECTIONS_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        session = aiohttp.ClientSession(connector=connector, timeout=TIMEOUT)
+    return session
+
+
+async def close():
+    """Close the shared session and its pooled connections."""
+    if session is not None and not session.closed:
+        await session.close()
+
+
+def _backoff(attempt, retry_after=None):
+    """Full jitter exponential backoff, honouring a Retry-After in seconds if the server sent one."""
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass  # An HTTP date, fall back to our own backoff
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+async def _send(method, url, upstream, kwargs):
+    """Make one request, recording its latency for the hedging deadline."""
+    started = time.perf_counter()
+    try:
+        with track_upstream(upstream or "other"):
+            async with get_session().request(method, url, **kwargs) as raw:
+                response = Response(raw.status, raw.headers, str(raw.url), await raw.read())
+                if response.status in FAILURE_STATUSES:
+                    raise HTTPError(response)  # So metrics count it as an error
+    except HTTPError as e:
+        return e.response
+    if upstream is not None:
+        stats = latencies.get(upstream)
+        if stats is None:
+            stats = latencies[upstream] = LatencyStats(size=200)
+        stats.add(time.perf_counter() - started)
+    return response
+
+
+def _hedge_delay(upstream):
+    """p95 latency of an upstream's recent successful requests, or None without enough samples."""
+    stats = latencies.get(upstream)
+    if stats is None or stats.count < HEDGE_MIN_SAMPLES:
+        return None
+    # Sorting the samples on every request would cost more than it saves, refresh every so often
+    cached = _hedge_delays.get(upstream)
+    if cached is None or stats.count - cached[0] >= HEDGE_MIN_SAMPLES:
+        cached = _hedge_delays[upstream] = (stats.count, max(HEDGE_MIN_DELAY, stats.percentile(0.95)))
+    return cached[1]
+
+
+async def _send_hedged(method, url, upstream, kwargs, delay):
+    """
+    Send a request, and a second copy if the first hasn't answered after delay seconds.
+    The first successful response wins and the other request is cancelled.
+    """
+    first = asyncio.ensure_future(_send(method, url, upstream, kwargs))
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return first.result()
+
+        hedged_total.inc(upstream)
+        pending.add(asyncio.ensure_future(_send(method, url, upstream, kwargs)))
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            good = [task for task in done
+                    if task.exception() is None and task.result().status not in FAILURE_STATUSES]
+            if good:
+                return good[0].result()
+            if not pending:
+                # Both failed, settle for the last one
+                return done.pop().result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _attempt(method, url, upstream, hedge, kwargs):
+    breaker = get_breaker(upstream) if upstream is not None else None
+    if breaker is not None:
+        breaker.before_call()
+    try:
+        delay = _hedge_delay(upstream) if hedge else None
+        if delay is not None:
+            response = await _send_hedged(method, url, upstream, kwargs, delay)
+        else:
+            response = await _send(method, url, upstream, kwargs)
+    except asyncio.CancelledError:
+        if breaker is not None:
+            breaker.record_cancelled()
+        raise
+    except Exception:
+        if breaker is not None:
+            breaker.record_failure()
+        raise
+    if breaker is not None:
+        if response.status in FAILURE_STATUSES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+    return response
+
+
+async def request(method, url, *, upstream=None, retries=None, retry_statuses=RETRY_STATUSES, timeout=None,
+                  hedge=False, **kwargs):
+    """
+    Make a request on the shared session, retrying connection errors, timeouts and
+    retry_statuses with jittered backoff. Only idempotent methods are retried unless
+    retries is given explicitly. Requests to a named upstream go through its circuit
+    breaker and fail fast with CircuitOpenError while it's open.
+    :param method: HTTP method.
+    :param url: The URL.
+    :param upstream: Name for metrics and the circuit breaker, e.g. "weather".
+    :param retries: Retries after the first attempt, defaults to MAX_RETRIES.
+    :param retry_statuses: Statuses worth retrying, the last response is returned if they persist.
+    :param timeout: Optional aiohttp.ClientTimeout overriding the default.
+    :param hedge: For GET requests to an upstream, send a second copy if the first is
+                  slower than the upstream's recent p95 latency.
+    :param kwargs: Passed to aiohttp, e.g. params, headers, json.
+    :return: A Response.
+    """
+    method = method.upper()
+    if retries is None:
+        retries = MAX_RETRIES if method in IDEMPOTENT_METHODS else 0
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    hedge = hedge and HEDGING and method == "GET" and upstream is not None
+
+    for attempt in range(retries + 1):
+        try:
+            response = await _attempt(method, url, upstream, hedge, kwargs)
+            if response.status not in retry_statuses or attempt == retries:
+                return response
+            delay = _backoff(attempt, response.headers.get("Retry-After"))
+            logger.warning("%s %s returned %d, retrying in %.2fs.", method, url, response.status, delay)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt == retries:
+                raise
+            delay = _backoff(attempt)
+            logger.warning("%s %s failed (%s: %s), retrying in %.2fs.", method, url, type(e).__name__, e, delay)
+        await asyncio.sleep(delay)
+
+
+async def get(url, **kwargs):
+    """GET a URL, see request()."""
+    return await request("GET", url, **kwargs)
+
+
+async def post(url, **kwargs):
+    """POST to a URL, see request(). Not retried unless retries is given."""
+    return await request("POST", url, **kwargs)
+
+
+async def get_json(url, **kwargs):
+    """
+    GET a URL and decode its JSON body.
+    :return: The decoded JSON.
+    :raises HTTPError: For error statuses.
+    """
+    response = await get(url, **kwargs)
+    response.raise_for_status()
+    return response.json()
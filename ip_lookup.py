@@ -1,8 +1,19 @@
-import requests
+import asyncio
 import logging
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import http_client
+from circuit_breaker import CircuitOpenError
+from cache import Cache
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Headers to mimic a legitimate browser request
@@ -12,38 +23,201 @@ HEADERS = {
     "Accept": "application/json",
 }
 
-def lookup_ip(ip_address):
+# Optional local database, either our own range format (built with build_range_database)
+# or a MaxMind .mmdb file if the maxminddb package is installed
+IP_DATABASE_PATH = os.getenv("IP_DATABASE_PATH")
+IPAPI_URL = "https://ipapi.co/{ip_address}/json/"
+MAX_BATCH = 10  # Addresses per !lookup_ip, keeps the reply under Discord's message limit
+FIELDS = ("ip", "city", "region", "country_name", "org", "latitude", "longitude")
+
+ip_cache = Cache(
+    "ip_lookup",
+    maxsize=4096,
+    ttl=int(os.getenv("IP_CACHE_TTL", str(24 * 3600))),
+    disk_path=os.getenv("IP_CACHE_PATH", "ip_cache.db"),
+)
+
+
+class IpapiBackend:
+    """Looks addresses up with the ipapi.co web API."""
+
+    async def lookup(self, ip_address):
+        url = IPAPI_URL.format(ip_address=ip_address)
+        response = await http_client.get(url, headers=HEADERS, upstream="ipapi", hedge=True)
+        if response.status != 200:
+            logger.error("Failed to fetch IP info: %d - %s", response.status, response.text)
+            return None
+        data = response.json()
+        if data.get("error"):
+            logger.error("ipapi error for %s: %s", ip_address, data.get("reason"))
+            return None
+        return {field: data.get(field) for field in FIELDS}
+
+
+class RangeDatabaseBackend:
+    """
+    Looks addresses up in a memory-mapped file of sorted, non-overlapping IP ranges.
+
+    Layout: b"IPRD" magic, uint32 record count, then fixed-size records of
+    (start: 16 bytes, end: 16 bytes, data offset: uint32, data length: uint32)
+    with IPv4 stored as IPv4-mapped IPv6, followed by the JSON data blobs.
+    """
+
+    MAGIC = b"IPRD"
+    HEADER = struct.Struct(">4sI")
+    RECORD = struct.Struct(">16s16sII")
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = self.HEADER.unpack_from(self._data, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not an IP range database.")
+        logger.info("Loaded IP range database %s with %s ranges.", path, self._count)
+
+    async def lookup(self, ip_address):
+        key = _to_key(ip_address)
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, end, offset, length = self.RECORD.unpack_from(
+                self._data, self.HEADER.size + mid * self.RECORD.size)
+            if key < start:
+                hi = mid
+            elif key > end:
+                lo = mid + 1
+            else:
+                record = json.loads(self._data[offset:offset + length])
+                record["ip"] = ip_address
+                return record
+        return None
+
+
+class MaxMindBackend:
+    """Looks addresses up in a MaxMind/DB-IP .mmdb city database."""
+
+    def __init__(self, path):
+        import maxminddb  # Optional dependency, only needed for .mmdb files
+        self._reader = maxminddb.open_database(path, maxminddb.MODE_MMAP)
+
+    async def lookup(self, ip_address):
+        data = self._reader.get(ip_address)
+        if not data:
+            return None
+        location = data.get("location", {})
+        subdivisions = data.get("subdivisions") or [{}]
+        return {
+            "ip": ip_address,
+            "city": data.get("city", {}).get("names", {}).get("en"),
+            "region": subdivisions[0].get("names", {}).get("en"),
+            "country_name": data.get("country", {}).get("names", {}).get("en"),
+            "org": data.get("traits", {}).get("organization"),
+            "latitude": location.get("latitude"),
+            "longitude": location.get("longitude"),
+        }
+
+
+def _to_key(ip_address):
+    """Encode an address as 16 big-endian bytes so IPv4 and IPv6 sort together."""
+    address = ipaddress.ip_address(ip_address)
+    if address.version == 4:
+        address = ipaddress.IPv6Address(f"::ffff:{address}")
+    return address.packed
+
+
+def build_range_database(rows, path):
+    """
+    Write a database for RangeDatabaseBackend.
+    :param rows: Iterable of (start_ip, end_ip, record dict) with non-overlapping ranges.
+    :param path: Output path.
+    :return: Number of ranges written.
+    """
+    ranges = sorted((_to_key(start), _to_key(end), json.dumps(record).encode()) for start, end, record in rows)
+    header = RangeDatabaseBackend.HEADER
+    record = RangeDatabaseBackend.RECORD
+    offset = header.size + len(ranges) * record.size
+    with open(path, "wb") as f:
+        f.write(header.pack(RangeDatabaseBackend.MAGIC, len(ranges)))
+        for start, end, blob in ranges:
+            f.write(record.pack(start, end, offset, len(blob)))
+            offset += len(blob)
+        for _, _, blob in ranges:
+            f.write(blob)
+    return len(ranges)
+
+
+def _load_backends():
+    backends = []
+    if IP_DATABASE_PATH:
+        try:
+            if IP_DATABASE_PATH.endswith(".mmdb"):
+                backends.append(MaxMindBackend(IP_DATABASE_PATH))
+            else:
+                backends.append(RangeDatabaseBackend(IP_DATABASE_PATH))
+        except Exception as e:
+            logger.error("Could not load IP database %s: %s", IP_DATABASE_PATH, e)
+    # ipapi answers whatever the local database doesn't know
+    backends.append(IpapiBackend())
+    return backends
+
+
+backends = _load_backends()
+
+
+async def _lookup_record(ip_address):
+    for backend in backends:
+        record = await backend.lookup(ip_address)
+        if record:
+            return record
+    return None
+
+
+def _format_record(record):
+    details = {field: record.get(field) or "N/A" for field in FIELDS}
+    return (
+        f"**IP Address:** {details['ip']}\n"
+        f"**City:** {details['city']}\n"
+        f"**Region:** {details['region']}\n"
+        f"**Country:** {details['country_name']}\n"
+        f"**Organization:** {details['org']}\n"
+        f"**Latitude/Longitude:** {details['latitude']}, {details['longitude']}"
+    )
+
+
+async def lookup_ip(ip_address):
     """
-    Perform an IP lookup using ipapi.co.
+    Perform an IP lookup, using the cache and local database before ipapi.co.
     :param ip_address: The IP address to look up.
     :return: A formatted string with IP details or an error message.
     """
     try:
-        url = f"https://ipapi.co/{ip_address}/json/"
-        response = requests.get(url, headers=HEADERS)
+        ip_address = str(ipaddress.ip_address(ip_address.strip()))
+    except ValueError:
+        return f"`{ip_address}` is not a valid IP address."
 
-        if response.status_code != 200:
-            logger.error(f"Failed to fetch IP info: {response.status_code} - {response.text}")
+    try:
+        record = await ip_cache.get_or_load_async(ip_address, lambda: _lookup_record(ip_address),
+                                                  stale_if_error=True)
+        if record is None:
             return "Error fetching IP details. Please try again later."
 
-        data = response.json()
-        ip = data.get("ip", "N/A")
-        city = data.get("city", "N/A")
-        region = data.get("region", "N/A")
-        country = data.get("country_name", "N/A")
-        org = data.get("org", "N/A")
-        latitude = data.get("latitude", "N/A")
-        longitude = data.get("longitude", "N/A")
-
-        logger.info(f"IP lookup successful for {ip_address}")
-        return (
-            f"**IP Address:** {ip}\n"
-            f"**City:** {city}\n"
-            f"**Region:** {region}\n"
-            f"**Country:** {country}\n"
-            f"**Organization:** {org}\n"
-            f"**Latitude/Longitude:** {latitude}, {longitude}"
-        )
+        logger.debug("IP lookup successful for %s", ip_address)
+        return _format_record(record)
+    except CircuitOpenError as e:
+        logger.warning("Not looking up %s: %s", ip_address, e)
+        return f"IP lookups are unavailable right now. Please try again in {max(1, round(e.retry_in))}s."
     except Exception as e:
-        logger.error(f"Error during IP lookup: {e}")
+        logger.error("Error during IP lookup: %s", e)
         return "An error occurred during the IP lookup. Please try again later."
+
+
+async def lookup_ips(ip_addresses):
+    """
+    Look up several IP addresses concurrently.
+    :param ip_addresses: List of IP addresses.
+    :return: One formatted string with the details for every address.
+    """
+    if len(ip_addresses) > MAX_BATCH:
+        return f"Please look up at most {MAX_BATCH} addresses at a time."
+    results = await asyncio.gather(*(lookup_ip(ip_address) for ip_address in ip_addresses))
+    return "\n\n".join(results)
@@ -0,0 +1,153 @@
+import argparse
+import json
+import logging
+import math
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from dotenv import load_dotenv
+from logging_setup import setup_logging
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+setup_logging()
+logger = logging.getLogger("launcher")
+
+DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+IDENTIFY_INTERVAL = 5.0  # Discord allows max_concurrency shards to connect per 5 seconds
+MAX_RESTART_DELAY = 60.0
+STABLE_SECONDS = 300  # A worker that ran this long restarts without backoff
+STOP_TIMEOUT = 30.0
+
+
+def recommended_shards():
+    """
+    Ask Discord how many shards the bot should run.
+    :return: A tuple (shard count, max concurrency).
+    """
+    request = urllib.request.Request(GATEWAY_URL, headers={
+        "Authorization": f"Bot {DISCORD_TOKEN}",
+        "User-Agent": "DiscordBot launcher",
+    })
+    with urllib.request.urlopen(request, timeout=10) as response:
+        data = json.load(response)
+    return data["shards"], data.get("session_start_limit", {}).get("max_concurrency", 1)
+
+
+def shard_ranges(shard_count, processes):
+    """
+    Split shard ids into contiguous ranges, one per process.
+    :return: List of lists of shard ids, none of them empty.
+    """
+    processes = max(1, min(processes, shard_count))
+    return [list(range(i * shard_count // processes, (i + 1) * shard_count // processes))
+            for i in range(processes)]
+
+
+class Worker:
+    """One bot process running a range of shards, restarted if it exits."""
+
+    def __init__(self, index, shard_ids, shard_count):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process = None
+        self.restarts = 0
+        self.restart_at = None  # When to restart it after an exit
+        self.started_at = 0.0
+
+    def env(self):
+        env = dict(os.environ)
+        env["SHARD_COUNT"] = str(self.shard_count)
+        env["SHARD_IDS"] = ",".join(str(shard_id) for shard_id in self.shard_ids)
+        # Files each process writes on its own, the shared store and caches are safe to share
+        env["FACT_BUFFER_PATH"] = f"facts_buffer-{self.index}.json"
+        env["METRICS_PORT"] = str(int(os.getenv("METRICS_PORT", "9108")) + self.index)
+        return env
+
+    def start(self):
+        logger.info("Starting worker %d with shards %d-%d of %d.", self.index, self.shard_ids[0],
+                    self.shard_ids[-1], self.shard_count)
+        self.process = subprocess.Popen([sys.executable, MAIN], env=self.env())
+        self.restart_at = None
+        self.started_at = time.monotonic()
+
+    def check(self):
+        """Schedule a restart if the process has exited, and restart it once it's due."""
+        if self.restart_at is None:
+            code = self.process.poll()
+            if code is None:
+                return
+            if time.monotonic() - self.started_at >= STABLE_SECONDS:
+                self.restarts = 0
+            delay = min(MAX_RESTART_DELAY, 2 ** self.restarts)
+            logger.error("Worker %s exited with code %s, restarting in %ss.", self.index, code, delay)
+            self.restarts += 1
+            self.restart_at = time.monotonic() + delay
+        elif time.monotonic() >= self.restart_at:
+            self.start()
+
+
+def run(workers, stagger):
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for worker in workers:
+        if stopping:
+            break
+        worker.start()
+        # Give this worker's shards time to identify before the next worker's start
+        deadline = time.monotonic() + stagger(worker)
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(0.5)
+
+    while not stopping:
+        for worker in workers:
+            worker.check()
+        time.sleep(1)
+
+    logger.info("Stopping workers...")
+    running = [worker.process for worker in workers if worker.process is not None and worker.process.poll() is None]
+    for process in running:
+        # Workers shut down cleanly on SIGINT, releasing leases and flushing buffers
+        process.send_signal(signal.SIGINT)
+    deadline = time.monotonic() + STOP_TIMEOUT
+    for process in running:
+        try:
+            process.wait(max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot as several processes, each with a range of shards.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Worker processes to start.")
+    parser.add_argument("--shards", type=int, help="Total shards, defaults to Discord's recommendation.")
+    args = parser.parse_args()
+
+    max_concurrency = 1
+    shard_count = args.shards
+    if shard_count is None:
+        shard_count, max_concurrency = recommended_shards()
+        logger.info("Discord recommends %s shards.", shard_count)
+
+    ranges = shard_ranges(shard_count, args.processes)
+    workers = [Worker(index, shard_ids, shard_count) for index, shard_ids in enumerate(ranges)]
+    run(workers, lambda worker: IDENTIFY_INTERVAL * math.ceil(len(worker.shard_ids) / max_concurrency))
+
+
+if __name__ == "__main__":
+    main()
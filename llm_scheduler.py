@@ -0,0 +1,207 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import deque
+from cache import TTLCache, MISSING
+from executor import BusyError
+from metrics import LatencyStats
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+def prompt_key(messages):
+    """
+    Key identical requests the same way, ignoring case and whitespace differences.
+    :param messages: List of chat messages.
+    :return: A hex digest.
+    """
+    normalized = [(m["role"], " ".join(m["content"].lower().split())) for m in messages]
+    return hashlib.sha256(json.dumps(normalized).encode()).hexdigest()
+
+
+class SchedulerBusyError(BusyError):
+    """Raised when the queue, or the user's share of it, is full."""
+
+
+class _Job:
+    """One upstream request, shared by every caller that asked for the same prompt."""
+
+    __slots__ = ("key", "user_id", "messages", "chunks", "subscribers", "done", "error", "enqueued_at")
+
+    def __init__(self, key, user_id, messages):
+        self.key = key
+        self.user_id = user_id
+        self.messages = messages
+        self.chunks = []
+        self.subscribers = []
+        self.done = False
+        self.error = None
+        self.enqueued_at = time.monotonic()
+
+    def subscribe(self):
+        """Return a queue that replays what was streamed so far, then follows the stream."""
+        queue = asyncio.Queue()
+        for chunk in self.chunks:
+            queue.put_nowait(chunk)
+        if self.done:
+            queue.put_nowait(None)
+        self.subscribers.append(queue)
+        return queue
+
+    def publish(self, chunk):
+        self.chunks.append(chunk)
+        for queue in self.subscribers:
+            queue.put_nowait(chunk)
+
+    def close(self):
+        self.done = True
+        for queue in self.subscribers:
+            queue.put_nowait(None)
+
+
+class LLMScheduler:
+    """
+    Schedules streaming LLM requests: a bounded queue served round-robin per user,
+    an in-flight limit that backs off on rate limit errors, single-flight coalescing
+    of identical prompts and a short-lived response cache.
+    """
+
+    def __init__(self, request_stream, max_concurrency=4, max_queue=100, max_per_user=3, cache_ttl=60,
+                 rate_limit_errors=()):
+        """
+        :param request_stream: Function taking a message list and returning an async iterator of text.
+        :param max_concurrency: Upper bound on requests in flight.
+        :param max_queue: Maximum number of queued requests across all users.
+        :param max_per_user: Maximum number of queued requests per user.
+        :param cache_ttl: Seconds a completed response is reused for identical prompts.
+        :param rate_limit_errors: Exception types that mean the API is rate limiting us.
+        """
+        self.request_stream = request_stream
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency  # Current in-flight limit, lowered on rate limit errors
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.rate_limit_errors = tuple(rate_limit_errors)
+        self.cache = TTLCache(maxsize=512, ttl=cache_ttl)
+        self.in_flight = 0
+        self.queued = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.queue_wait = LatencyStats()
+        self.api_latency = LatencyStats()
+        self._user_queues = {}  # user_id -> deque of queued jobs
+        self._inflight_jobs = {}  # key -> job, queued or running
+        self._running_per_user = {}  # user_id -> jobs in flight
+        self._last_served = {}  # user_id -> dispatch sequence number, for round-robin
+        self._served = 0
+        self._successes = 0
+
+    async def stream(self, user_id, messages):
+        """
+        Stream the reply to a message list, sharing work with identical requests.
+        :param user_id: Who is asking, for per-user fairness.
+        :param messages: List of chat messages.
+        :return: Async generator of text fragments.
+        """
+        key = prompt_key(messages)
+        cached = self.cache.get(key)
+        if cached is not MISSING:
+            self.cache_hits += 1
+            yield cached
+            return
+
+        job = self._inflight_jobs.get(key)
+        if job is None:
+            job = self._enqueue(key, user_id, messages)
+        else:
+            self.coalesced += 1
+
+        queue = job.subscribe()
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            yield chunk
+        if job.error is not None:
+            raise job.error
+
+    def _enqueue(self, key, user_id, messages):
+        user_queue = self._user_queues.get(user_id)
+        if self.queued >= self.max_queue or (user_queue and len(user_queue) >= self.max_per_user):
+            raise SchedulerBusyError("Too many queued chat requests.")
+        job = _Job(key, user_id, messages)
+        self._inflight_jobs[key] = job
+        if user_queue is None:
+            user_queue = self._user_queues[user_id] = deque()
+        user_queue.append(job)
+        self.queued += 1
+        self._dispatch()
+        return job
+
+    def _dispatch(self):
+        """Start queued jobs, one user at a time, while there is room in flight."""
+        while self.in_flight < self.limit and self._user_queues:
+            # Prefer users with the fewest requests running, then whoever was served longest ago
+            user_id = min(self._user_queues, key=lambda user: (self._running_per_user.get(user, 0),
+                                                               self._last_served.get(user, 0)))
+            user_queue = self._user_queues[user_id]
+            job = user_queue.popleft()
+            if not user_queue:
+                del self._user_queues[user_id]
+            self._served += 1
+            self._last_served[user_id] = self._served
+            self.queued -= 1
+            self.in_flight += 1
+            self._running_per_user[user_id] = self._running_per_user.get(user_id, 0) + 1
+            self.queue_wait.add(time.monotonic() - job.enqueued_at)
+            asyncio.create_task(self._run(job))
+
+    async def _run(self, job):
+        started = time.monotonic()
+        try:
+            async for chunk in self.request_stream(job.messages):
+                job.publish(chunk)
+            self.cache.set(job.key, "".join(job.chunks))
+            self._on_success()
+        except self.rate_limit_errors as e:
+            self.rate_limited += 1
+            self.limit = max(1, self.limit // 2)
+            logger.warning("LLM rate limited, lowering concurrency to %s.", self.limit)
+            job.error = e
+        except Exception as e:
+            job.error = e
+        finally:
+            self.api_latency.add(time.monotonic() - started)
+            self.in_flight -= 1
+            self._running_per_user[job.user_id] -= 1
+            if not self._running_per_user[job.user_id]:
+                del self._running_per_user[job.user_id]
+                if job.user_id not in self._user_queues:
+                    self._last_served.pop(job.user_id, None)
+            del self._inflight_jobs[job.key]
+            job.close()
+            self._dispatch()
+
+    def _on_success(self):
+        # Creep back up to the configured limit after a run of successes
+        self._successes += 1
+        if self.limit < self.max_concurrency and self._successes >= 10:
+            self.limit += 1
+            self._successes = 0
+
+    def stats(self):
+        """Return queue, cache and latency metrics."""
+        return {
+            "in_flight": self.in_flight,
+            "limit": self.limit,
+            "queued": self.queued,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "rate_limited": self.rate_limited,
+            "queue_wait": self.queue_wait.summary(),
+            "api_latency": self.api_latency.summary(),
+        }
@@ -0,0 +1,222 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")  # Per logger overrides, e.g. "http_client=DEBUG,discord=WARNING"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+# Each event (logger and message template) is written at most LOG_RATE_LIMIT times per window
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "20"))
+LOG_RATE_WINDOW = float(os.getenv("LOG_RATE_WINDOW", "60"))
+# Fraction of INFO and DEBUG records kept per logger, e.g. "command_router=0.1"
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+QUEUE_SIZE = 10000
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+# LogRecord attributes that aren't extra fields passed by the caller
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+# Arguments that can be formatted on the logging thread, since they can't change in the meantime
+_IMMUTABLE = (str, int, float, bool, type(None))
+
+listener = None
+_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any extra={...} fields the caller passed."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Caps how often each event is logged, so a hot loop or a flood of identical
+    errors can't dominate the log. Events are told apart by logger and message
+    template, which is why log calls should pass arguments instead of f-strings.
+    The next record let through after a suppressed stretch says how many were dropped.
+    """
+
+    def __init__(self, limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW, samples=None):
+        """
+        :param limit: Records per event per window, 0 for no limit.
+        :param window: Seconds the limit is counted over.
+        :param samples: Dict of {logger name: fraction of INFO and DEBUG records kept}.
+        """
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.samples = samples or {}
+        self.events = {}  # (logger, template) -> [window start, count, suppressed]
+        self._lock = threading.Lock()
+
+    def _sample_rate(self, name):
+        # The most specific configured logger wins, "a.b" falls back to "a"
+        while name:
+            if name in self.samples:
+                return self.samples[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING and self.samples:
+            rate = self._sample_rate(record.name)
+            if rate < 1.0 and random.random() >= rate:
+                return False
+        if not self.limit:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            event = self.events.get(key)
+            if event is None or now - event[0] >= self.window:
+                if len(self.events) > QUEUE_SIZE:
+                    self.events.clear()  # Too many distinct events, start counting afresh
+                suppressed = event[2] if event is not None else 0
+                event = self.events[key] = [now, 0, 0]
+            else:
+                suppressed = 0
+            if event[1] >= self.limit:
+                event[2] += 1
+                return False
+            event[1] += 1
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on the queue without formatting them first when their arguments
+    are immutable, so the message is built on the logging thread, not the caller's.
+    Records are dropped rather than blocking the caller if the queue is full.
+    """
+
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        args = record.args
+        if args and not all(isinstance(arg, _IMMUTABLE) for arg in
+                            (args.values() if isinstance(args, dict) else args)):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            # Traceback objects keep frames alive and can't cross threads safely
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_settings(text):
+    """
+    Parse per-logger settings like LOG_LEVELS and LOG_SAMPLE.
+    :param text: Comma separated logger=value pairs.
+    :return: Dict of {logger name: value}.
+    """
+    settings = {}
+    for pair in text.split(","):
+        name, _, value = pair.partition("=")
+        if name.strip() and value.strip():
+            settings[name.strip()] = value.strip()
+    return settings
+
+
+def set_level(name, level):
+    """
+    Change a logger's level while the bot runs.
+    :param name: Logger name, "root" or "" for the root logger.
+    :param level: Level name like "DEBUG", or a number.
+    :raises ValueError: For an unknown level name.
+    """
+    if isinstance(level, str):
+        level = level.upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level '{level}'.")
+    logging.getLogger(None if name in ("", "root") else name).setLevel(level)
+
+
+def levels():
+    """Return {logger name: level name} for the root logger and every logger with its own level."""
+    result = {"root": logging.getLevelName(logging.getLogger().level)}
+    for name, logger in sorted(logging.Logger.manager.loggerDict.items()):
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+            result[name] = logging.getLevelName(logger.level)
+    return result
+
+
+def setup_logging():
+    """
+    Send every log record through a queue to a background thread that writes it
+    to stderr. Safe to call more than once, later calls do nothing.
+    """
+    global listener
+    with _lock:
+        if listener is not None:
+            return
+        output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+        handler = LazyQueueHandler(queue.Queue(QUEUE_SIZE))
+        samples = {name: float(rate) for name, rate in parse_settings(LOG_SAMPLE).items()}
+        handler.addFilter(RateLimitFilter(samples=samples))
+
+        root = logging.getLogger()
+        for existing in root.handlers[:]:
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        set_level("root", LOG_LEVEL)
+        for name, level in parse_settings(LOG_LEVELS).items():
+            try:
+                set_level(name, level)
+            except ValueError as e:
+                logging.getLogger(__name__).error("Ignoring LOG_LEVELS entry for %s: %s", name, e)
+
+        listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+        listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write out queued records and stop the background thread."""
+    global listener
+    with _lock:
+        if listener is not None:
+            listener.stop()
+            listener = None
@@ -1,22 +1,31 @@
+import time
+STARTED = time.perf_counter()  # For the startup timing report
+from logging_setup import setup_logging, set_level, levels
+setup_logging()  # Before the other imports, so their log records go through the queue too
+import asyncio
 import discord
 import random
 from discord.ext import commands, tasks
-from random_fact import get_random_fact
+from random_fact import fact_buffer
 import logging
 from dotenv import load_dotenv
 import os
-from calculator import calculate
-from twitch_notifier import check_stream_status, update_live_status
-from chatgpt_integration import get_chatgpt_response
-import pytz
-from timezonefinder import TimezoneFinder
-from geopy.geocoders import Nominatim
-from datetime import datetime
-from ip_lookup import lookup_ip
-from password_manager import generate_password, store_password, retrieve_password
-from ai_image_generator import generate_image
-from weather_module import get_weather
-from vulnerability_scan import scan_ip
+import signal
+from calculator import calculate, calculate_batch
+from twitch_notifier import (check_streams_status, update_live_status, load_live_status, eventsub_enabled,
+                             subscribe_stream_events, EventSubReceiver, EVENTSUB_SECRET)
+import http_client
+from vulnerability_scan import scanner, ScanLimitError
+from executor import run_blocking, BusyError, ExecutorBusyError, shutdown_executors, executor_stats
+from messaging import StreamingReply, outbox, send_long, split_message
+from command_router import command, dispatch, unique_commands, TEXT, OPTIONAL_TEXT
+from plugins import plugin, record, warm_up
+from cache import cache_stats
+from rate_limit import limiter, retry_message
+from shared_store import get_store
+import metrics
+
+record("main (eager imports)", time.perf_counter() - STARTED)
 
 
 # Load environment variables
@@ -27,198 +36,430 @@ DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 NOTIFY_CHANNEL_ID = int(os.getenv("NOTIFY_CHANNEL_ID"))
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("main")
 
+metrics_server = None
+
+async def start_image_jobs(module):
+    module.image_jobs.start()
+
+# Heavy command modules (openai, cryptography, geopy, pytz, ...) are imported the
+# first time a command needs them, or by the warm-up after on_ready
+chatgpt = plugin("chatgpt_integration")
+images = plugin("ai_image_generator", init=start_image_jobs)
+passwords = plugin("password_manager", init=lambda module: module.get_store())
+timezones = plugin("timezone_lookup", init=lambda module: module.preload())
+ip_lookup = plugin("ip_lookup")
+weather = plugin("weather_module")
+
+# Sharding: launcher.py gives each process a range of shards, otherwise this process
+# runs as many shards as Discord recommends
+SHARD_COUNT = os.getenv("SHARD_COUNT")
+SHARD_IDS = os.getenv("SHARD_IDS")
+
+def shard_options():
+    """AutoShardedBot arguments for the shards this process should run."""
+    if not SHARD_COUNT:
+        return {}
+    options = {"shard_count": int(SHARD_COUNT)}
+    if SHARD_IDS:
+        options["shard_ids"] = [int(shard_id) for shard_id in SHARD_IDS.split(",")]
+    return options
+
 # Initialize the bot
 intents = discord.Intents.default()
-bot = commands.Bot(command_prefix="!", intents=intents)
 intents.message_content = True  # Enable message content access
-client = discord.Client(intents=intents)
-geolocator = Nominatim(user_agent="timezone_bot")
-tf = TimezoneFinder()
+bot = commands.AutoShardedBot(command_prefix="!", intents=intents, **shard_options())
+
+# Twitch streamers to watch
+TWITCH_USERNAMES = ["spiffypolecat", "kota9113","jsleezy_stream"]  # Replace with actual usernames
+# With EventSub enabled, polling only reconciles missed events
+POLL_SECONDS = 30
+RECONCILE_SECONDS = 300
+eventsub_receiver = None
+# Only the process holding this lease polls Twitch and announces streams
+POLLER_LEASE = "twitch_poller"
+LEASE_SECONDS = 30
+is_poller = False
+# Seconds after on_ready before lazy modules are loaded in the background
+WARMUP_DELAY = float(os.getenv("WARMUP_DELAY", "5"))
+warmup_task = None
+# Minimum seconds between edits of a scan's progress DM
+SCAN_PROGRESS_SECONDS = 10
 
 # Sync slash commands
 @bot.event
 async def on_ready():
     """Triggered when the bot is ready and slash commands are synced."""
+    global warmup_task
     try:
         synced = await bot.tree.sync()
-        logger.info(f"Synced {len(synced)} slash commands.")
-        logger.info(f"{bot.user.name} is now running!")
-        monitor_streams.start()
+        logger.info("Synced %d slash commands.", len(synced))
+        logger.info("%s is now running!", bot.user.name)
+        if not elect_poller.is_running():
+            elect_poller.start()
+        fact_buffer.start()
+        if metrics.ENABLED and metrics_server is None:
+            await start_metrics()
+        if warmup_task is None:
+            record("ready", time.perf_counter() - STARTED)
+            if os.getenv("WARMUP", "true").lower() == "true":
+                warmup_task = asyncio.create_task(warm_up(WARMUP_DELAY))
+    except Exception as e:
+        logger.error("Error syncing commands: %s", e)
+
+async def start_eventsub():
+    """Start the EventSub receiver and slow polling down to a reconciliation pass."""
+    global eventsub_receiver
+    eventsub_receiver = EventSubReceiver(EVENTSUB_SECRET, notify_live)
+    await eventsub_receiver.start()
+    created = await subscribe_stream_events(TWITCH_USERNAMES)
+    logger.info("EventSub enabled, created %d new subscriptions.", created)
+    monitor_streams.change_interval(seconds=RECONCILE_SECONDS)
+
+async def stop_eventsub():
+    global eventsub_receiver
+    if eventsub_receiver is not None:
+        await eventsub_receiver.stop()
+        eventsub_receiver = None
+    monitor_streams.change_interval(seconds=POLL_SECONDS)
+
+@tasks.loop(seconds=LEASE_SECONDS / 3)
+async def elect_poller():
+    """Take or renew the polling lease, and start or stop Twitch polling to match."""
+    global is_poller
+    try:
+        leader = await run_blocking("db", get_store().acquire_lease, POLLER_LEASE, LEASE_SECONDS)
     except Exception as e:
-        logger.error(f"Error syncing commands: {e}")
+        # Without a renewal the lease runs out, let another process take over
+        logger.error("Error renewing the Twitch polling lease: %s", e)
+        leader = False
+
+    if leader and not is_poller:
+        logger.info("This process now polls Twitch.")
+        try:
+            await run_blocking("db", load_live_status)
+        except Exception as e:
+            logger.error("Error loading Twitch live statuses: %s", e)
+        # Polling only runs while we hold the lease, so a task still running here is
+        # finishing the cancel from when the lease was lost. Start again once it has.
+        task = monitor_streams.get_task()
+        if task is not None and not task.done():
+            await asyncio.wait({task})
+        monitor_streams.start()
+        if eventsub_enabled():
+            try:
+                await start_eventsub()
+            except Exception as e:
+                logger.error("Error starting EventSub, polling instead: %s", e)
+    elif is_poller and not leader:
+        logger.info("Another process polls Twitch now.")
+        monitor_streams.cancel()
+        await stop_eventsub()
+    is_poller = leader
+
+async def start_metrics():
+    """Serve /metrics and start sampling event loop lag."""
+    global metrics_server
+    metrics.register_collector("cache", lambda: metrics.stats_gauges("bot_cache", "cache", cache_stats()))
+    metrics.register_collector("executor", lambda: metrics.stats_gauges(
+        "bot_executor", "command_class", executor_stats()))
+    metrics.register_collector("llm", lambda: metrics.stats_gauges(
+        "bot_llm", "scheduler", {"chat": chatgpt.module.scheduler.stats()} if chatgpt.loaded else {}))
+    metrics.loop_lag.start()
+    metrics_server = metrics.MetricsServer()
+    await metrics_server.start()
+
+async def notify_live(username, stream_details):
+    """Announce in the notification channel that a streamer went live."""
+    # The channel's guild may be on another process's shards, a partial channel can still be sent to
+    channel = bot.get_channel(NOTIFY_CHANNEL_ID) or bot.get_partial_messageable(NOTIFY_CHANNEL_ID)
+    logger.info("%s is live! Notifying channel.", username)
+    # Streamers going live together are announced in one embed
+    outbox.notify(
+        channel, "Live on Twitch", f"{username} is live!",
+        f"Title: {stream_details.get('title') or 'N/A'}\n"
+        f"Watch here: https://www.twitch.tv/{username}"
+    )
 
 # Monitor Twitch streams periodically
-@tasks.loop(seconds=30)
+@tasks.loop(seconds=POLL_SECONDS)
 async def monitor_streams():
     """Check Twitch streams and send notifications if live."""
-    twitch_usernames = ["spiffypolecat", "kota9113","jsleezy_stream"]  # Replace with actual usernames
-    channel = bot.get_channel(NOTIFY_CHANNEL_ID)
-    if not channel:
-        logger.error(f"Notification channel with ID {NOTIFY_CHANNEL_ID} not found.")
-        return
-    for username in twitch_usernames:
-        is_live, stream_details = check_stream_status(username)
-        if update_live_status(username, is_live):
-            logger.info(f"{username} is live! Notifying channel.")
-            await channel.send(
-                f"{username} is live on Twitch! \n"
-                f"Title: {stream_details['title']}\n"
-                f"Watch here: https://www.twitch.tv/{username}"
-            )
+    started = time.perf_counter()
+    statuses = await check_streams_status(TWITCH_USERNAMES)
+    for username, stream_details in statuses.items():
+        is_live = stream_details is not None
+        if await run_blocking("db", update_live_status, username, is_live):
+            await notify_live(username, stream_details)
         elif not is_live:
-            logger.info(f"{username} is not live or already notified.")
+            logger.debug("%s is not live or already notified.", username)
+    # This cycle's announcements don't need to wait for more
+    await outbox.flush_notifications()
+    metrics.stream_check_seconds.observe(time.perf_counter() - started)
 
-# Define a command to get a random fact
 @bot.event
 async def on_message(message):
     """Handle incoming messages."""
     if message.author == bot.user:
         return
 
-    # Command to get a random fact
-    if message.content.lower() == "!fact":
-        logger.info(f"User {message.author} requested a random fact.")
-        fact = get_random_fact()
-        await message.channel.send(f"Here's a random fact: {fact}")
-
-    if message.content.startswith("!lookup_ip"):
-        ip_address = message.content[len("!lookup_ip "):].strip()
-        if not ip_address:
-            await message.channel.send("Please provide an IP address. Usage: `!lookup_ip <IP>`")
-            return
-
-        logger.info(f"User {message.author} requested IP lookup for: {ip_address}")
-        result = lookup_ip(ip_address)
-        await message.channel.send(result)
-
-    # Check if the message starts with "!time"
-    if message.content.startswith("!time"):
-        # Extract location from the message, defaulting to "UTC" if none is provided
-        location = message.content[len("!time"):].strip() or "UTC"
-
-        try:
-            # Attempt to locate the place with GeoPy
-            place = geolocator.geocode(location)
-            if place:
-                # Get the timezone based on latitude and longitude
-                timezone_str = tf.timezone_at(lng=place.longitude, lat=place.latitude)
-                if timezone_str:
-                    tz = pytz.timezone(timezone_str)
-                    current_time = datetime.now(tz)
-                    formatted_time = current_time.strftime('%Y-%m-%d %H:%M:%S %Z%z')
-                    await message.channel.send(f"The current time in {location} is: {formatted_time}")
-                else:
-                    await message.channel.send("Sorry, I couldn't determine the timezone for that location.")
-            else:
-                await message.channel.send("Location not found. Please provide a valid city, state, or country.")
-        except Exception as e:
-            await message.channel.send(f"An error occurred: {e}")
-
-    if message.content.startswith("!chat"):
-        user_query = message.content[len("!chat "):]  # Extract the query after !chat
-        if not user_query.strip():
-            await message.channel.send("Please provide a prompt for ChatGPT. Usage: `!chat <your question>`")
-            return
-
-        logger.info(f"User {message.author} requested ChatGPT response: {user_query}")
-        response = get_chatgpt_response(user_query)
-        await message.channel.send(response)
-
-        # Check if the message starts with "!roll"
-
-    if message.content.startswith("!password"):
-        try:
-            parts = message.content.split()
-            length = int(parts[1]) if len(parts) > 1 else None
-            password = generate_password(length)
-            user_id = str(message.author.id)
-            store_password(user_id, password)
-            await message.author.send(f"Your generated password is: {password}")
-            await message.channel.send("Password sent to your direct messages!")
-        except ValueError:
-            await message.channel.send("Invalid length. Usage: `!generate_password [length]`")
-
-    elif message.content.startswith("!get_password"):
-        user_id = str(message.author.id)
-        password = retrieve_password(user_id)
-        if password:
-            await message.author.send(f"Your stored password is: {password}")
-        else:
-            await message.channel.send("No password found for your user ID.")
-
-    elif message.content.startswith("!roll"):
-        # Roll a d20
-        roll_result = random.choice(range(1, 21))
-        await message.channel.send(f"You rolled a d20 and got: {roll_result}")
-
-    if message.content.startswith("!image"):
-        prompt = message.content[len("!image "):].strip()
-        if not prompt:
-            await message.channel.send(
-                "Please provide a description for the image. Usage: `!generate_image <description>`")
-            return
+    try:
+        await dispatch(message)
+    except BusyError:
+        await message.channel.send("I'm busy with too many requests like that right now. Please try again shortly.")
+
+# Command to get a random fact
+@command("fact", description="Get a random fact.")
+async def fact_command(message):
+    logger.debug("User %s requested a random fact.", message.author.id)
+    fact = await fact_buffer.get()
+    await message.channel.send(f"Here's a random fact: {fact}")
+
+@command("lookup_ip", usage="!lookup_ip <IP> [IP ...]", description="Look up details for one or more IP addresses.",
+         args=TEXT)
+async def lookup_ip_command(message, ip_addresses):
+    logger.debug("User %s requested an IP lookup.", message.author.id)
+    module = await ip_lookup.load()
+    result = await module.lookup_ips(ip_addresses.replace(",", " ").split())
+    await send_long(message.channel, result)
+
+@command("time", usage="!time [location]", description="Get the current time in a location.", args=OPTIONAL_TEXT)
+async def time_command(message, location):
+    # Default to "UTC" if no location is provided
+    location = location or "UTC"
 
-        await message.channel.send("Generating your image, please wait...")
-        image_url = generate_image(prompt)
-        if "http" in image_url:
-            await message.channel.send(f"Here is your image: {image_url}")
+    try:
+        module = await timezones.load()
+        # Resolve from the bundled gazetteer first, only geocode on a miss
+        timezone_str = module.find_timezone_offline(location)
+        if timezone_str is None:
+            timezone_str = await module.find_timezone(location)
+        if timezone_str:
+            formatted_time = module.format_current_time(timezone_str)
+            await message.channel.send(f"The current time in {location} is: {formatted_time}")
         else:
-            await message.channel.send(image_url)
-
-    if message.content.startswith("!weather"):
-        city_name = message.content[len("!weather "):].strip()
-        if not city_name:
-            await message.channel.send("Please provide a city name. Usage: `!weather <city>`")
-            return
-
-        await message.channel.send("Fetching weather, please wait...")
-        weather_info = get_weather(city_name)
-        await message.channel.send(weather_info)
-
-    if message.content.startswith("!scan"):
-        ip_address = message.content[len("!scan "):].strip()
-        if not ip_address:
-            await message.channel.send("Please provide an IP address. Usage: `!scan <IP>`")
-            return
+            await message.channel.send("Location not found. Please provide a valid city, state, or country.")
+    except ExecutorBusyError:
+        raise
+    except Exception as e:
+        await message.channel.send(f"An error occurred: {e}")
+
+@command("chat", usage="!chat <your question>", description="Ask ChatGPT something.", args=TEXT)
+async def chat_command(message, user_query):
+    logger.debug("User %s requested a ChatGPT response.", message.author.id)
+    conversation_key = (message.channel.id, message.author.id)
+    module = await chatgpt.load()
+    if not module.STREAMING:
+        response = await module.get_chatgpt_reply(user_query, conversation_key)
+        await send_long(message.channel, response)
+        return
 
-        # Acknowledge the scan in the channel
-        await message.channel.send(
-            f"Scanning IP: {ip_address}, results will be sent to your DM. This may take a while...")
+    # Show the reply as it is generated, so users only wait for the first tokens
+    reply = StreamingReply(message.channel)
+    async for delta in module.stream_chatgpt_response(user_query, conversation_key):
+        await reply.append(delta)
+    await reply.finish()
+
+@command("forget", description="Clear your !chat history in this channel.")
+async def forget_command(message):
+    module = await chatgpt.load()
+    module.forget_conversation((message.channel.id, message.author.id))
+    await message.channel.send("I've forgotten our conversation in this channel.")
+
+def parse_password_length(text):
+    """Parse the optional length argument of !password."""
+    if not text:
+        return (None,)
+    try:
+        return (int(text.split()[0]),)
+    except ValueError:
+        raise ValueError("Invalid length.")
+
+@command("password", usage="!password [length]", description="Generate a password and DM it to you.",
+         args=parse_password_length, aliases=("generate_password",))
+async def password_command(message, length):
+    module = await passwords.load()
+    password = module.generate_password(length)
+    user_id = str(message.author.id)
+    await run_blocking("db", module.store_password, user_id, password)
+    await message.author.send(f"Your generated password is: {password}")
+    await message.channel.send("Password sent to your direct messages!")
+
+@command("get_password", description="DM you your stored password.")
+async def get_password_command(message):
+    module = await passwords.load()
+    user_id = str(message.author.id)
+    password = await run_blocking("db", module.retrieve_password, user_id)
+    if password:
+        await message.author.send(f"Your stored password is: {password}")
+    else:
+        await message.channel.send("No password found for your user ID.")
+
+@command("roll", description="Roll a d20.")
+async def roll_command(message):
+    # Roll a d20
+    roll_result = random.choice(range(1, 21))
+    await message.channel.send(f"You rolled a d20 and got: {roll_result}")
+
+@command("image", usage="!image <description>", description="Generate an AI image.", args=TEXT,
+         aliases=("generate_image",))
+async def image_command(message, prompt):
+    module = await images.load()
+    await module.image_jobs.submit(message, prompt)
+
+@command("cancel_image", description="Cancel your queued or running image requests.")
+async def cancel_image_command(message):
+    module = await images.load()
+    cancelled = await module.image_jobs.cancel(message.author.id)
+    if not cancelled:
+        await message.channel.send("You don't have any image requests in progress.")
+
+@command("weather", usage="!weather <city>", description="Get the current weather for a city.", args=TEXT)
+async def weather_command(message, city_name):
+    await message.channel.send("Fetching weather, please wait...")
+    module = await weather.load()
+    weather_info = await module.get_weather(city_name)
+    await message.channel.send(weather_info)
+
+@command("scan", usage="!scan <IP>", description="Run a vulnerability scan and DM you the results.", args=TEXT)
+async def scan_command(message, ip_address):
+    # Acknowledge the scan in the channel
+    await message.channel.send(
+        f"Scanning IP: {ip_address}, results will be sent to your DM. This may take a while...")
 
+    try:
+        # Relay progress by editing one DM, then send the report as it's parsed
+        progress_message = None
+        last_progress = 0.0
+        async for kind, text in scanner.scan(ip_address, message.author.id):
+            if kind == "progress":
+                now = time.monotonic()
+                if progress_message is None:
+                    progress_message = await outbox.send(message.author, text)
+                    last_progress = now
+                elif now - last_progress >= SCAN_PROGRESS_SECONDS:
+                    await progress_message.edit(content=text)
+                    last_progress = now
+                continue
+            await outbox.send(message.author, text)
+        if progress_message is not None:
+            await progress_message.edit(content=f"Scan of {ip_address} finished.")
+        logger.info("Scan results for %s sent to user %s.", ip_address, message.author.id)
+    except ScanLimitError as e:
+        await message.channel.send(str(e))
+    except discord.Forbidden:
+        # Handle case where DMs are disabled
+        await message.channel.send("I couldn't send you a DM. Please enable direct messages and try again.")
+        logger.warning("Failed to send DM to user %s. Direct messages may be disabled.", message.author.id)
+    except Exception as e:
+        # General error handling
+        await message.channel.send("An unexpected error occurred while performing the scan.")
+        logger.error("Error during scan or sending results: %s", e)
+
+@command("stats", description="Show runtime metrics (bot owner only).")
+async def stats_command(message):
+    if not await bot.is_owner(message.author):
+        await message.channel.send("Only the bot owner can use this command.")
+        return
+    await send_long(message.channel, metrics.stats_report())
+
+def parse_log_level(text):
+    """Parse the arguments of !loglevel: nothing, or a logger name and a level."""
+    parts = text.split()
+    if not parts:
+        return (None, None)
+    if len(parts) != 2:
+        raise ValueError("Give a logger name and a level.")
+    return tuple(parts)
+
+@command("loglevel", usage="!loglevel [logger level]",
+         description="Show log levels, or change one while the bot runs (bot owner only).",
+         args=parse_log_level)
+async def loglevel_command(message, name, level):
+    if not await bot.is_owner(message.author):
+        await message.channel.send("Only the bot owner can use this command.")
+        return
+    if name is not None:
         try:
-            # Perform the scan
-            scan_results = scan_ip(ip_address)
-
-            # Send results via DM
-            await message.author.send(f"Results of the scan for IP {ip_address}:\n\n{scan_results}")
-            logger.info(f"Scan results for {ip_address} sent to {message.author}.")
-        except discord.Forbidden:
-            # Handle case where DMs are disabled
-            await message.channel.send("I couldn't send you a DM. Please enable direct messages and try again.")
-            logger.warning(f"Failed to send DM to {message.author}. Direct messages may be disabled.")
-        except Exception as e:
-            # General error handling
-            await message.channel.send("An unexpected error occurred while performing the scan.")
-            logger.error(f"Error during scan or sending results: {e}")
+            set_level(name, level)
+        except ValueError as e:
+            await message.channel.send(str(e))
+            return
+        logger.warning("Log level of %s set to %s by user %s.", name, level.upper(), message.author.id)
+    await send_long(message.channel, "\n".join(f"`{logger_name}` {logger_level}"
+                                               for logger_name, logger_level in levels().items()))
 
-    else:
-        logger.info(f"Ignored message: {message.content}")
+@command("help", description="List the available commands.")
+async def help_command(message):
+    lines = [f"`{cmd.usage}` - {cmd.description}" for cmd in unique_commands()]
+    await send_long(message.channel, "\n".join(lines))
 
 # Slash command: Calculate a mathematical expression
 @bot.tree.command(name="calculate", description="Evaluate a mathematical expression.")
-async def calculate_command(interaction: discord.Interaction, expression: str):
+@discord.app_commands.describe(
+    expression="The expression, e.g. sqrt(2) * pi. Use x with values to evaluate it several times.",
+    values="Optional values for x: a range like 1..10 or 0..1..0.1, or a list like 1,2,5",
+)
+async def calculate_command(interaction: discord.Interaction, expression: str, values: str = None):
     """
     Slash command to calculate a mathematical expression.
     """
-    logger.info(f"User {interaction.user} requested a calculation: {expression}")
-    result = calculate(expression)
-    await interaction.response.send_message(f"Result: {result}")
+    logger.debug("User %s requested a calculation.", interaction.user.id)
+    retry_in, _ = limiter.acquire("calculate", interaction.user.id, interaction.guild_id)
+    if retry_in:
+        # Interactions must be answered, so every refusal gets a reply, visible only to the user
+        await interaction.response.send_message(retry_message(retry_in), ephemeral=True)
+        metrics.observe_command("calculate", "limited", 0.0)
+        return
+    with metrics.track_command("calculate"):
+        if values is None:
+            result = calculate(expression)
+            await interaction.response.send_message(f"Result: {result}")
+            return
+
+        results = calculate_batch(expression, values)
+        if isinstance(results, str):
+            await interaction.response.send_message(f"Result: {results}")
+            return
+        chunks = split_message("\n".join(f"x = {x}: {result}" for x, result in results))
+        await interaction.response.send_message(chunks[0])
+        for chunk in chunks[1:]:
+            await interaction.followup.send(chunk)
+
 
 
+async def run_bot():
+    """Run the bot and close shared resources when it stops."""
+    # Stop on SIGTERM the same way as on Ctrl+C, so the cleanup below runs
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass  # Not available on Windows
+    try:
+        async with bot:
+            await bot.start(DISCORD_TOKEN)
+    finally:
+        await fact_buffer.stop()
+        if images.loaded:
+            await images.module.image_jobs.stop()
+        elect_poller.cancel()
+        monitor_streams.cancel()
+        await stop_eventsub()
+        if is_poller:
+            # Let another process take over right away instead of when the lease expires
+            get_store().release_lease(POLLER_LEASE)
+        if metrics_server is not None:
+            await metrics_server.stop()
+        await outbox.stop()
+        await metrics.loop_lag.stop()
+        await http_client.close()
 
 # Start the bot
 if __name__ == "__main__":
-    bot.run(DISCORD_TOKEN)
+    try:
+        asyncio.run(run_bot())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass  # Stopped by SIGINT (Ctrl+C or the launcher) or SIGTERM
+    finally:
+        shutdown_executors()
@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import time
+from collections import deque
+import discord
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 2000  # Discord's maximum message length
+EMBED_FIELDS = 25  # Discord's maximum fields per embed
+FIELD_LIMIT = 1024  # Discord's maximum field value length
+EMBED_LIMIT = 6000  # Discord's maximum total characters in an embed
+# Discord lets a bot send about 5 messages per 5 seconds in one channel
+SEND_BURST = 5
+SEND_WINDOW = 5.0
+COALESCE_SECONDS = 2.0  # How long notifications wait for others to share their embed
+IDLE_SECONDS = 60  # A channel's send task exits after this long with nothing to send
+
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """
+    Split text into chunks that fit in a Discord message, preferring to break
+    at newlines, then spaces.
+    :param text: The text to split.
+    :param limit: Maximum length of each chunk.
+    :return: List of chunks in order.
+    """
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n ")
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class ChannelQueue:
+    """Sends one channel's messages in order, at most burst per window seconds."""
+
+    def __init__(self, channel, burst, window, on_idle):
+        """
+        :param channel: The channel, user or anything else with an async send().
+        :param burst: Messages that may be sent within one window.
+        :param window: Seconds the burst is counted over.
+        :param on_idle: Called with this queue when its task exits for lack of work.
+        """
+        self.channel = channel
+        self.burst = burst
+        self.window = window
+        self.on_idle = on_idle
+        self.items = asyncio.Queue()  # (list of send() kwargs, Future for the sent messages)
+        self.sent = deque(maxlen=burst)  # When the last burst messages were sent
+        self.task = asyncio.create_task(self._run())
+
+    async def _pace(self):
+        if len(self.sent) == self.burst:
+            wait = self.sent[0] + self.window - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    async def _run(self):
+        while True:
+            try:
+                payloads, future = await asyncio.wait_for(self.items.get(), IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                if self.items.empty():
+                    self.on_idle(self)
+                    return
+                continue
+            if future.cancelled():
+                continue  # The caller gave up while it was queued
+            messages = []
+            try:
+                for payload in payloads:
+                    await self._pace()
+                    messages.append(await self.channel.send(**payload))
+                    self.sent.append(time.monotonic())
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(messages)
+
+
+class _Batch:
+    """Notifications waiting to be sent as one embed."""
+
+    __slots__ = ("channel", "heading", "fields", "timer")
+
+    def __init__(self, channel, heading):
+        self.channel = channel
+        self.heading = heading
+        self.fields = []  # (name, value)
+        self.timer = None  # asyncio.TimerHandle of the scheduled flush
+
+
+class Outbox:
+    """
+    Outbound messages, queued per channel and paced to Discord's per-channel rate
+    limit so a burst of replies or alerts waits its turn instead of running into 429s.
+    The messages of one send_many() go out back to back, so long replies stay in order.
+    Notifications sent to the same channel within a short window share one embed.
+    """
+
+    def __init__(self, burst=SEND_BURST, window=SEND_WINDOW, coalesce_seconds=COALESCE_SECONDS):
+        """
+        :param burst: Messages per channel that may be sent within one window.
+        :param window: Seconds the burst is counted over.
+        :param coalesce_seconds: How long the first notification for a channel waits for others.
+        """
+        self.burst = burst
+        self.window = window
+        self.coalesce_seconds = coalesce_seconds
+        self.queues = {}  # channel id -> ChannelQueue
+        self._batches = {}  # (channel id, heading) -> _Batch
+        self._tasks = set()
+
+    def _forget(self, queue):
+        if self.queues.get(queue.channel.id) is queue:
+            del self.queues[queue.channel.id]
+
+    async def send_many(self, channel, payloads):
+        """
+        Queue several messages to go out one after another.
+        :param channel: The channel or user to send to.
+        :param payloads: List of dicts of send() arguments, e.g. {"content": "..."}.
+        :return: The sent messages.
+        :raises discord.HTTPException: If a send failed, the rest of the payloads aren't sent.
+        """
+        queue = self.queues.get(channel.id)
+        if queue is None:
+            queue = self.queues[channel.id] = ChannelQueue(channel, self.burst, self.window, self._forget)
+        future = asyncio.get_running_loop().create_future()
+        queue.items.put_nowait((payloads, future))
+        return await future
+
+    async def send(self, channel, content=None, **kwargs):
+        """Queue one message, see send_many(). :return: The sent message."""
+        messages = await self.send_many(channel, [dict(kwargs, content=content)])
+        return messages[0]
+
+    async def send_long(self, channel, text):
+        """Queue text split over as many messages as it needs. :return: The sent messages."""
+        return await self.send_many(channel, [{"content": chunk} for chunk in split_message(text)])
+
+    def notify(self, channel, heading, name, value):
+        """
+        Add a notification to the channel's next embed, which is sent once no more
+        have arrived for coalesce_seconds or flush_notifications() is called.
+        :param channel: The channel to notify.
+        :param heading: Embed title, only notifications with the same heading are combined.
+        :param name: Field name, e.g. who the notification is about.
+        :param value: Field text.
+        """
+        key = (channel.id, heading)
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _Batch(channel, heading)
+        else:
+            batch.timer.cancel()
+        batch.fields.append((name[:256], value[:FIELD_LIMIT]))
+        batch.timer = asyncio.get_running_loop().call_later(self.coalesce_seconds, self._flush_later, key)
+
+    def _flush_later(self, key):
+        task = asyncio.create_task(self._send_batch(self._batches.pop(key)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_batch(self, batch):
+        batch.timer.cancel()
+        payloads = []
+        fields = size = 0
+        for name, value in batch.fields:
+            # The title and every field name and value count towards the embed's limit
+            if not payloads or fields == EMBED_FIELDS or size + len(name) + len(value) > EMBED_LIMIT:
+                embed = discord.Embed(title=batch.heading)
+                payloads.append({"embed": embed})
+                fields, size = 0, len(batch.heading)
+            embed.add_field(name=name, value=value, inline=False)
+            fields += 1
+            size += len(name) + len(value)
+        try:
+            await self.send_many(batch.channel, payloads)
+        except Exception as e:
+            logger.error("Error sending %s notifications to channel %s: %s",
+                         len(batch.fields), batch.channel.id, e)
+
+    async def flush_notifications(self):
+        """Send every pending notification embed now."""
+        batches = list(self._batches.values())
+        self._batches.clear()
+        await asyncio.gather(*(self._send_batch(batch) for batch in batches))
+
+    async def stop(self):
+        """Drop pending notifications and stop every channel's send task."""
+        for batch in self._batches.values():
+            batch.timer.cancel()
+        self._batches.clear()
+        tasks = list(self._tasks) + [queue.task for queue in self.queues.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Don't leave callers waiting on messages that will never be sent
+        for queue in self.queues.values():
+            while not queue.items.empty():
+                queue.items.get_nowait()[1].cancel()
+        self.queues.clear()
+
+
+outbox = Outbox()
+
+
+async def send_long(channel, text):
+    """Send text to a channel, split over several messages if needed."""
+    return await outbox.send_long(channel, text)
+
+
+class StreamingReply:
+    """
+    A reply that grows as text is streamed in. The message is edited at most once
+    per edit interval, and continues in a new message when it reaches the length limit.
+    """
+
+    def __init__(self, channel, edit_interval=1.0, limit=MESSAGE_LIMIT):
+        """
+        :param channel: The channel to reply in.
+        :param edit_interval: Minimum seconds between edits of the same message.
+        :param limit: Maximum length of each message.
+        """
+        self.channel = channel
+        self.edit_interval = edit_interval
+        self.limit = limit
+        self.message = None  # The message currently being edited
+        self.text = ""  # Full text of the current message, including unsent tokens
+        self.sent_text = ""  # What the current message shows right now
+        self.last_edit = 0.0
+
+    async def append(self, delta):
+        """Add streamed text, updating Discord if the edit interval has passed."""
+        self.text += delta
+        if self.message is None or time.monotonic() - self.last_edit >= self.edit_interval:
+            await self.flush()
+
+    async def flush(self):
+        """Push the buffered text to Discord now."""
+        # Finish full messages and move the overflow to new ones
+        while len(self.text) > self.limit:
+            head, *_ = split_message(self.text, self.limit)
+            await self._show(head)
+            self.text = self.text[len(head):].lstrip("\n ")
+            self.message = None
+            self.sent_text = ""
+        if self.text.strip():
+            await self._show(self.text)
+
+    async def finish(self):
+        """Send whatever is left once the stream has ended."""
+        await self.flush()
+
+    async def _show(self, text):
+        if text == self.sent_text:
+            return
+        if self.message is None:
+            self.message = await outbox.send(self.channel, text)
+        else:
+            await self.message.edit(content=text)
+        self.sent_text = text
+        self.last_edit = time.monotonic()
@@ -0,0 +1,355 @@
+import asyncio
+import bisect
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Everything below is a no-op unless metrics are enabled
+ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Latency buckets in seconds, from cache hits to image generation
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    """A monotonically increasing count per label combination."""
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Observations counted into fixed buckets per label combination."""
+
+    def __init__(self, name, description, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        if not ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def summary(self, *label_values):
+        """
+        Approximate count, mean and percentiles of one series.
+        :return: Dict with count, mean, p50 and p95 in seconds, or None if nothing was observed.
+        """
+        with self._lock:
+            series = list(self.series.get(label_values, ()))
+        if not series:
+            return None
+        counts = series[:-1]
+        total = sum(counts)
+
+        def quantile(fraction):
+            # Upper bound of the bucket the quantile falls in
+            seen = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                seen += count
+                if seen >= fraction * total:
+                    return bound
+            return float("inf")
+
+        return {"count": total, "mean": series[-1] / total, "p50": quantile(0.5), "p95": quantile(0.95)}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((label_values, list(series)) for label_values, series in self.series.items())
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                labels = _labels(self.labels + ("le",), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class LatencyStats:
+    """Keeps recent samples of a duration to report percentiles."""
+
+    def __init__(self, size=1000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "p50": round(self.percentile(0.5), 3),
+            "p95": round(self.percentile(0.95), 3),
+            "max": round(max(self.samples, default=0.0), 3),
+        }
+
+
+commands_total = Counter("bot_commands_total", "Commands handled.", ("command", "status"))
+command_seconds = Histogram("bot_command_seconds", "Time to handle a command.", ("command",))
+upstream_total = Counter("bot_upstream_requests_total", "Requests to upstream APIs.", ("upstream", "outcome"))
+upstream_seconds = Histogram("bot_upstream_request_seconds", "Upstream API request latency.", ("upstream",))
+stream_check_seconds = Histogram("bot_monitor_streams_seconds", "Duration of one monitor_streams cycle.")
+loop_lag_seconds = Histogram("bot_event_loop_lag_seconds", "How late the event loop ran a scheduled callback.",
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+METRICS = [commands_total, command_seconds, upstream_total, upstream_seconds, stream_check_seconds,
+           loop_lag_seconds]
+
+# Gauges shown by !stats, the rest are only on /metrics
+STATS_GAUGES = ("hit_ratio", "_queued", "in_flight")
+
+# Functions returning {metric name: value} gauges, read when metrics are scraped
+collectors = {}
+
+
+def register_collector(name, collect):
+    """
+    Add gauges computed at scrape time, e.g. from a component's stats().
+    :param name: Unique name, registering again replaces the collector.
+    :param collect: Function returning a dict of {"metric_name{labels}": number}.
+    """
+    collectors[name] = collect
+
+
+def stats_gauges(prefix, label, stats):
+    """
+    Turn {name: {field: number}} stats, like executor_stats() returns, into gauges.
+    Nested dicts are flattened into field_subfield, anything that isn't a number is skipped.
+    :param prefix: Metric name prefix, e.g. "bot_executor".
+    :param label: Label name for the outer keys, e.g. "command_class".
+    :return: Dict of {"metric_name{labels}": number}.
+    """
+    gauges = {}
+    for name, fields in stats.items():
+        labels = _labels((label,), (name,))
+        for field, value in fields.items():
+            values = value.items() if isinstance(value, dict) else [(None, value)]
+            for sub, number in values:
+                if isinstance(number, (int, float)) and not isinstance(number, bool):
+                    metric = f"{prefix}_{field}_{sub}" if sub else f"{prefix}_{field}"
+                    gauges[f"{metric}{labels}"] = number
+    return gauges
+
+
+def observe_command(command, status, seconds):
+    if not ENABLED:
+        return
+    commands_total.inc(command, status)
+    command_seconds.observe(seconds, command)
+
+
+class _Timer:
+    __slots__ = ("name", "histogram", "counter", "started")
+
+    def __init__(self, name, histogram, counter):
+        self.name = name
+        self.histogram = histogram
+        self.counter = counter
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, self.name)
+        if exc_type is None:
+            outcome = "ok"
+        elif issubclass(exc_type, asyncio.CancelledError):
+            outcome = "cancelled"
+        else:
+            outcome = "error"
+        self.counter.inc(self.name, outcome)
+        return False
+
+
+_NOT_TRACKED = contextlib.nullcontext()
+
+
+def track_command(command):
+    """
+    Time a command that isn't dispatched by command_router, e.g. a slash command.
+    :param command: The command name.
+    :return: A context manager.
+    """
+    return _Timer(command, command_seconds, commands_total) if ENABLED else _NOT_TRACKED
+
+
+def track_upstream(upstream):
+    """
+    Time an upstream API call, counting it as an error if it raises.
+    :param upstream: "twitch", "weather", "ipapi", "openai", ...
+    :return: A context manager.
+    """
+    return _Timer(upstream, upstream_seconds, upstream_total) if ENABLED else _NOT_TRACKED
+
+
+class LoopLagSampler:
+    """Measures how late the event loop wakes up a task that sleeps for a fixed interval."""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.last = 0.0
+        self._task = None
+
+    def start(self):
+        if ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - started - self.interval)
+            loop_lag_seconds.observe(self.last)
+
+
+loop_lag = LoopLagSampler()
+
+
+def render():
+    """Return every metric in the Prometheus text format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for name, collect in list(collectors.items()):
+        try:
+            for key, value in collect().items():
+                lines.append(f"{key} {value}")
+        except Exception as e:
+            logger.error("Error collecting %s metrics: %s", name, e)
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves /metrics for Prometheus on a local port."""
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                                headers={"X-Content-Type-Options": "nosniff"})
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def stats_report(gauges=True):
+    """
+    Human readable summary for !stats.
+    :param gauges: Include the collector gauges.
+    :return: The report text.
+    """
+    if not ENABLED:
+        return "Metrics are disabled. Set METRICS_ENABLED=true to collect them."
+
+    def timing(summary):
+        return (f"{summary['count']} calls, mean {summary['mean'] * 1000:.0f} ms, "
+                f"p50 <= {summary['p50'] * 1000:.0f} ms, p95 <= {summary['p95'] * 1000:.0f} ms")
+
+    lines = ["**Commands**"]
+    for (command,) in sorted(list(command_seconds.series)):
+        errors = commands_total.values.get((command, "error"), 0)
+        lines.append(f"`{command}`: {timing(command_seconds.summary(command))}, {errors} errors")
+    lines.append("**Upstream APIs**")
+    for (upstream,) in sorted(list(upstream_seconds.series)):
+        errors = upstream_total.values.get((upstream, "error"), 0)
+        lines.append(f"`{upstream}`: {timing(upstream_seconds.summary(upstream))}, {errors} errors")
+    cycle = stream_check_seconds.summary()
+    if cycle:
+        lines.append(f"**monitor_streams**: {timing(cycle)}")
+    lag = loop_lag_seconds.summary()
+    if lag:
+        lines.append(f"**Event loop lag**: last {loop_lag.last * 1000:.1f} ms, p95 <= {lag['p95'] * 1000:.0f} ms")
+    if gauges:
+        lines.append("**Gauges**")
+        for name, collect in list(collectors.items()):
+            try:
+                values = collect()
+            except Exception as e:
+                logger.error("Error collecting %s metrics: %s", name, e)
+                continue
+            lines.extend(f"`{key}` {value:g}" for key, value in values.items()
+                         if any(field in key for field in STATS_GAUGES))
+    return "\n".join(lines)
@@ -2,43 +2,137 @@ import os
 import random
 import string
 import sqlite3
+import threading
+import time
 from cryptography.fernet import Fernet
 import logging
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Generate or load encryption key
 def load_key():
     key_file = "secret.key"
     if not os.path.exists(key_file):
-        key = Fernet.generate_key()
-        with open(key_file, "wb") as keyfile:
-            keyfile.write(key)
-    else:
-        with open(key_file, "rb") as keyfile:
-            key = keyfile.read()
-    return key
+        # Write the key aside and link it into place, so processes starting together agree on one key
+        temp_file = f"{key_file}.{os.getpid()}"
+        with open(temp_file, "wb") as keyfile:
+            keyfile.write(Fernet.generate_key())
+        try:
+            os.link(temp_file, key_file)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_file)
+    with open(key_file, "rb") as keyfile:
+        return keyfile.read()
+
+fernet = None
+_lock = threading.Lock()
 
-fernet = Fernet(load_key())
+def get_fernet():
+    """Return the Fernet instance, loading or creating the key on first use."""
+    global fernet
+    with _lock:
+        if fernet is None:
+            fernet = Fernet(load_key())
+    return fernet
 
 # Database setup
 DB_NAME = "passwords.db"
 
-def setup_database():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS passwords (
-            user_id TEXT NOT NULL,
-            password TEXT NOT NULL
-        )
-    """)
-    conn.commit()
-    conn.close()
 
-setup_database()
+class PasswordStore:
+    """
+    Encrypted passwords keyed by user ID, one row per user. Uses a single long-lived
+    connection in WAL mode; callers should run it on the "db" executor, which has one thread.
+    """
+
+    UPSERT = """
+        INSERT INTO passwords (user_id, password, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET password = excluded.password, updated_at = excluded.updated_at
+    """
+    SELECT = "SELECT password FROM passwords WHERE user_id = ?"
+
+    def __init__(self, path=DB_NAME):
+        # sqlite3 keeps compiled statements for UPSERT and SELECT in its statement cache
+        self.conn = sqlite3.connect(path, check_same_thread=False, cached_statements=32)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.Lock()
+        self.setup()
+
+    def setup(self):
+        """Create the table, migrating the old schema without a primary key if needed."""
+        with self._lock, self.conn:
+            row = self.conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'passwords'").fetchone()
+            if row is not None and "PRIMARY KEY" not in row[0].upper():
+                self._migrate()
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS passwords (
+                    user_id TEXT PRIMARY KEY,
+                    password BLOB NOT NULL,
+                    updated_at REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+
+    def _migrate(self):
+        # The old table appended a row per !password, keep the newest one per user.
+        # sqlite3 doesn't open a transaction for DDL, so take the write lock explicitly
+        # and either every step lands or none does.
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock
+            row = self.conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'passwords'").fetchone()
+            if "PRIMARY KEY" not in row[0].upper():
+                logger.info("Migrating the passwords table to one row per user.")
+                self.conn.execute("ALTER TABLE passwords RENAME TO passwords_legacy")
+                self.conn.execute("""
+                    CREATE TABLE passwords (
+                        user_id TEXT PRIMARY KEY,
+                        password BLOB NOT NULL,
+                        updated_at REAL NOT NULL
+                    ) WITHOUT ROWID
+                """)
+                self.conn.execute("""
+                    INSERT INTO passwords (user_id, password, updated_at)
+                    SELECT user_id, password, 0 FROM passwords_legacy
+                    WHERE rowid IN (SELECT MAX(rowid) FROM passwords_legacy GROUP BY user_id)
+                """)
+                self.conn.execute("DROP TABLE passwords_legacy")
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def put(self, user_id, encrypted_password):
+        with self._lock, self.conn:
+            self.conn.execute(self.UPSERT, (user_id, encrypted_password, time.time()))
+
+    def put_many(self, rows):
+        """Upsert (user_id, encrypted_password) pairs in one transaction."""
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.executemany(self.UPSERT, ((user_id, password, now) for user_id, password in rows))
+
+    def get(self, user_id):
+        with self._lock:
+            row = self.conn.execute(self.SELECT, (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self.conn.close()
+
+
+store = None
+
+def get_store():
+    """Return the shared PasswordStore, opening it on first use."""
+    global store
+    with _lock:
+        if store is None:
+            store = PasswordStore()
+    return store
 
 def generate_password(length=None):
     """
@@ -55,30 +149,22 @@ def generate_password(length=None):
 
     chars = string.ascii_letters + string.digits + string.punctuation
     password = ''.join(random.choice(chars) for _ in range(length))
-    logger.info(f"Password of length {length} generated successfully")
+    logger.info("Password of length %s generated successfully", length)
     return password
 
 def store_password(user_id, password):
-    """Encrypt and store the password."""
-    encrypted_password = fernet.encrypt(password.encode())
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO passwords (user_id, password) VALUES (?, ?)", (user_id, encrypted_password))
-    conn.commit()
-    conn.close()
-    logger.info(f"Password for user {user_id} stored successfully")
+    """Encrypt and store the password, replacing any previous one."""
+    encrypted_password = get_fernet().encrypt(password.encode())
+    get_store().put(user_id, encrypted_password)
+    logger.info("Password for user %s stored successfully", user_id)
 
 def retrieve_password(user_id):
     """Retrieve and decrypt the password for a user."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT password FROM passwords WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
+    result = get_store().get(user_id)
     if result:
-        decrypted_password = fernet.decrypt(result[0]).decode()
-        logger.info(f"Password for user {user_id} retrieved successfully")
+        decrypted_password = get_fernet().decrypt(result).decode()
+        logger.info("Password for user %s retrieved successfully", user_id)
         return decrypted_password
     else:
-        logger.warning(f"No password found for user {user_id}")
+        logger.warning("No password found for user %s", user_id)
         return None
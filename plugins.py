@@ -0,0 +1,118 @@
+import asyncio
+import importlib
+import inspect
+import logging
+import time
+from executor import run_blocking
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Startup phase or module name -> {"import": seconds, "init": seconds}
+timings = {}
+
+
+class LazyModule:
+    """
+    A command module that is imported and initialized the first time it's needed,
+    either by a command or by the warm-up after on_ready.
+    """
+
+    def __init__(self, name, init=None):
+        """
+        :param name: Module name to import.
+        :param init: Optional function taking the module. Plain functions run on the
+                     "startup" executor, coroutine functions on the event loop.
+        """
+        self.name = name
+        self.init = init
+        self.module = None
+        self._loading = None
+
+    @property
+    def loaded(self):
+        return self.module is not None
+
+    async def load(self):
+        """
+        Import and initialize the module if that hasn't happened yet. Concurrent
+        callers share one load; a failed load is retried by the next caller.
+        :return: The module.
+        """
+        if self.module is not None:
+            return self.module
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._load())
+        try:
+            return await asyncio.shield(self._loading)
+        except Exception:
+            self._loading = None
+            raise
+
+    async def _load(self):
+        started = time.perf_counter()
+        module = await run_blocking("startup", importlib.import_module, self.name)
+        import_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        if self.init is not None:
+            if inspect.iscoroutinefunction(self.init):
+                await self.init(module)
+            else:
+                await run_blocking("startup", self.init, module)
+        init_time = time.perf_counter() - started
+
+        record(self.name, import_time, init_time)
+        logger.info("Loaded %s in %.0f ms.", self.name, (import_time + init_time) * 1000)
+        self.module = module
+        return module
+
+
+plugins = {}
+
+
+def plugin(name, init=None):
+    """
+    Register a module to load lazily.
+    :param name: Module name to import.
+    :param init: Optional initialization function, see LazyModule.
+    :return: The LazyModule; await its load() to use the module.
+    """
+    lazy = plugins.get(name)
+    if lazy is None:
+        lazy = plugins[name] = LazyModule(name, init)
+    return lazy
+
+
+def record(name, import_time, init_time=0.0):
+    """Record how long a startup phase or module took to import and initialize."""
+    timings[name] = {"import": import_time, "init": init_time}
+
+
+async def warm_up(delay=0):
+    """
+    Load every registered module that hasn't been used yet, one at a time so
+    commands arriving meanwhile aren't starved of workers.
+    :param delay: Seconds to wait before starting.
+    """
+    await asyncio.sleep(delay)
+    for lazy in list(plugins.values()):
+        if lazy.loaded:
+            continue
+        try:
+            await lazy.load()
+        except Exception as e:
+            logger.error("Error warming up %s: %s", lazy.name, e)
+    logger.info("Startup timings:\n%s", startup_report())
+
+
+def startup_report():
+    """Return a table of import and init time per module, slowest first."""
+    rows = sorted(timings.items(), key=lambda item: item[1]["import"] + item[1]["init"], reverse=True)
+    lines = [f"{'module':<24} {'import ms':>10} {'init ms':>10}"]
+    for name, timing in rows:
+        lines.append(f"{name:<24} {timing['import'] * 1000:>10.1f} {timing['init'] * 1000:>10.1f}")
+    pending = [name for name, lazy in plugins.items() if not lazy.loaded]
+    if pending:
+        lines.append(f"not loaded yet: {', '.join(pending)}")
+    return "\n".join(lines)
@@ -1,20 +1,148 @@
+import asyncio
+import json
 import logging
-import requests
+import os
+import random
+from collections import deque
+from dotenv import load_dotenv
+import http_client
+
+# Load environment variables
+load_dotenv()
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_random_fact():
-    """Fetches a random fact from the API."""
-    url = "https://uselessfacts.jsph.pl/random.json?language=en"
-    try:
-        logger.info("Fetching a random fact from the API.")
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an error for bad HTTP status
-        fact = response.json().get("text", "No fact found.")
-        logger.info("Successfully fetched a random fact.")
-        return fact
-    except requests.RequestException as e:
-        logger.error(f"Error fetching the random fact: {e}")
-        return "Could not fetch a random fact at this time."
+FACT_URL = "https://uselessfacts.jsph.pl/random.json?language=en"
+
+async def _fetch_fact():
+    """Fetch one fact from the API as a dict with "id" and "text"."""
+    data = await http_client.get_json(FACT_URL, upstream="facts", hedge=True)  # Raises for bad HTTP status
+    return {"id": data.get("id") or data.get("text"), "text": data.get("text", "No fact found.")}
+
+
+class FactBuffer:
+    """
+    Keeps a buffer of prefetched facts so !fact can answer from memory. A background
+    task refills the buffer up to the high watermark whenever it drops to the low one.
+    """
+
+    def __init__(self, high_watermark=20, low_watermark=5, min_interval=1.0, recent_size=500,
+                 path="facts_buffer.json"):
+        """
+        :param high_watermark: Number of facts to refill up to.
+        :param low_watermark: Refill once the buffer drops to this many facts.
+        :param min_interval: Minimum seconds between API requests.
+        :param recent_size: Number of served facts remembered to avoid repeats.
+        :param path: File the buffer is saved to across restarts.
+        """
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.min_interval = min_interval
+        self.path = path
+        self.facts = deque()
+        self.recent = deque(maxlen=recent_size)
+        self.served = deque(maxlen=50)  # Texts to fall back on while the API is down
+        self._known_ids = set()  # Ids in the buffer or recently served
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def _remember(self, fact_id):
+        if len(self.recent) == self.recent.maxlen:
+            self._known_ids.discard(self.recent[0])
+        self.recent.append(fact_id)
+        self._known_ids.add(fact_id)
+
+    def load(self):
+        """Restore the buffer saved by a previous run."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            for fact_id in saved.get("recent", []):
+                self._remember(fact_id)
+            for fact in saved.get("facts", []):
+                if fact["id"] not in self._known_ids:
+                    self.facts.append(fact)
+                    self._known_ids.add(fact["id"])
+            logger.info("Restored %s buffered facts.", len(self.facts))
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("Error loading the fact buffer: %s", e)
+
+    def save(self):
+        """Save the buffer and recently served ids to disk."""
+        try:
+            with open(self.path, "w") as f:
+                json.dump({"facts": list(self.facts), "recent": list(self.recent)}, f)
+        except OSError as e:
+            logger.error("Error saving the fact buffer: %s", e)
+
+    def start(self):
+        """Load the saved buffer and start the background refill task."""
+        if self._task is not None:
+            return
+        self.load()
+        self._task = asyncio.create_task(self._refill_loop())
+        self._wake.set()
+
+    async def stop(self):
+        """Stop the refill task and save the buffer."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.save()
+
+    async def get(self):
+        """
+        Return a fact, from the buffer when possible.
+        :return: The fact text.
+        """
+        if len(self.facts) <= self.low_watermark:
+            self._wake.set()
+        if self.facts:
+            fact = self.facts.popleft()
+        else:
+            # Buffer is empty, fetch one directly
+            try:
+                fact = await _fetch_fact()
+            except http_client.REQUEST_ERRORS as e:
+                logger.error("Error fetching the random fact: %s", e)
+                if not self.served:
+                    return "Could not fetch a random fact at this time."
+                # A repeat beats an error while the API is down
+                return random.choice(self.served)
+        self._remember(fact["id"])
+        self.served.append(fact["text"])
+        return fact["text"]
+
+    async def _refill_loop(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            duplicates = 0
+            while len(self.facts) < self.high_watermark and duplicates < self.high_watermark:
+                try:
+                    fact = await _fetch_fact()
+                    if fact["id"] in self._known_ids:
+                        duplicates += 1
+                    else:
+                        self.facts.append(fact)
+                        self._known_ids.add(fact["id"])
+                except Exception as e:
+                    logger.error("Error prefetching a random fact: %s", e)
+                    break
+                await asyncio.sleep(self.min_interval)
+            logger.debug("Fact buffer refilled to %d facts.", len(self.facts))
+            self.save()
+
+
+fact_buffer = FactBuffer(
+    high_watermark=int(os.getenv("FACT_BUFFER_SIZE", "20")),
+    low_watermark=int(os.getenv("FACT_BUFFER_LOW", "5")),
+    path=os.getenv("FACT_BUFFER_PATH", "facts_buffer.json"),
+)
@@ -0,0 +1,163 @@
+import logging
+import math
+import os
+import time
+from dotenv import load_dotenv
+import metrics
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Each user gets a bucket per guild and command, and each guild one per command shared by its members
+USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "10"))
+USER_PER_MINUTE = float(os.getenv("RATE_LIMIT_USER_PER_MINUTE", "10"))
+GUILD_BURST = float(os.getenv("RATE_LIMIT_GUILD_BURST", "60"))
+GUILD_PER_MINUTE = float(os.getenv("RATE_LIMIT_GUILD_PER_MINUTE", "60"))
+# Tokens a command takes from the buckets, commands not listed aren't limited
+DEFAULT_COSTS = "scan=10,image=5,chat=2,weather=1,calculate=1"
+EVICT_INTERVAL = 60  # Seconds between sweeps for idle buckets
+
+limited_total = metrics.Counter("bot_rate_limited_total", "Commands refused by the rate limiter.",
+                                ("command", "scope"))
+metrics.METRICS.append(limited_total)
+
+
+def parse_costs(text):
+    """
+    Parse per-command costs.
+    :param text: Comma separated name=cost pairs, e.g. "scan=10,image=5".
+    :return: Dict of {command name: cost}.
+    """
+    costs = {}
+    for pair in text.split(","):
+        if not pair.strip():
+            continue
+        name, _, cost = pair.partition("=")
+        try:
+            costs[name.strip().lower()] = float(cost)
+        except ValueError:
+            logger.error("Ignoring invalid rate limit cost '%s'.", pair.strip())
+    return costs
+
+
+class TokenBucket:
+    """Tokens left and when they were last counted. Refill settings live on the RateLimiter."""
+
+    __slots__ = ("tokens", "updated", "warned")
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.warned = False  # The user was told they're limited since their last allowed command
+
+    def refill(self, rate, burst, now):
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+
+class RateLimiter:
+    """
+    Token buckets per (user, guild, command) and per (guild, command). A command is
+    allowed when both of its buckets hold its cost, and then takes it from both.
+    A bucket that has been idle long enough to refill is the same as a new one, so
+    those are dropped, which keeps memory bounded by the users active in the last
+    burst / rate seconds.
+    """
+
+    def __init__(self, costs, user_burst=USER_BURST, user_per_minute=USER_PER_MINUTE,
+                 guild_burst=GUILD_BURST, guild_per_minute=GUILD_PER_MINUTE):
+        """
+        :param costs: Dict of {command name: tokens per use}.
+        :param user_burst: Tokens a user's bucket holds.
+        :param user_per_minute: Tokens a user's bucket regains per minute.
+        :param guild_burst: Tokens a guild's bucket holds.
+        :param guild_per_minute: Tokens a guild's bucket regains per minute.
+        """
+        self.user_burst = user_burst
+        self.user_rate = user_per_minute / 60
+        self.guild_burst = guild_burst
+        self.guild_rate = guild_per_minute / 60
+        self.costs = {}
+        for name, cost in costs.items():
+            if cost > min(user_burst, guild_burst):
+                logger.warning("Rate limit cost of %s is more than a bucket holds, capping it.", name)
+                cost = min(user_burst, guild_burst)
+            self.costs[name] = cost
+        self.user_buckets = {}  # (user id, guild id, command) -> TokenBucket
+        self.guild_buckets = {}  # (guild id, command) -> TokenBucket
+        self._last_evict = time.monotonic()
+
+    def _bucket(self, buckets, key, rate, burst, now):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(burst, now)
+        else:
+            bucket.refill(rate, burst, now)
+        return bucket
+
+    def acquire(self, command, user_id, guild_id=None):
+        """
+        Take a command's cost from its buckets if they hold enough.
+        :param command: The command name.
+        :param user_id: Id of the user running it.
+        :param guild_id: Id of the guild it was run in, None in DMs.
+        :return: A tuple (retry_in, notify). retry_in is 0 if the command may run, otherwise
+                 the seconds until it can. notify is False if the user was already told.
+        """
+        cost = self.costs.get(command)
+        if not ENABLED or not cost:
+            return 0.0, False
+        now = time.monotonic()
+        if now - self._last_evict >= EVICT_INTERVAL:
+            self.evict(now)
+
+        user = self._bucket(self.user_buckets, (user_id, guild_id, command), self.user_rate, self.user_burst, now)
+        retry_in = (cost - user.tokens) / self.user_rate if user.tokens < cost else 0.0
+        scope = "user"
+        guild = None
+        if guild_id is not None:
+            guild = self._bucket(self.guild_buckets, (guild_id, command), self.guild_rate, self.guild_burst, now)
+            if guild.tokens < cost and (cost - guild.tokens) / self.guild_rate > retry_in:
+                retry_in = (cost - guild.tokens) / self.guild_rate
+                scope = "guild"
+
+        if retry_in:
+            limited_total.inc(command, scope)
+            notify = not user.warned
+            user.warned = True
+            return retry_in, notify
+        user.tokens -= cost
+        user.warned = False
+        if guild is not None:
+            guild.tokens -= cost
+        return 0.0, False
+
+    def evict(self, now=None):
+        """Drop buckets that have refilled since they were last used."""
+        now = time.monotonic() if now is None else now
+        self._last_evict = now
+        for buckets, rate, burst in ((self.user_buckets, self.user_rate, self.user_burst),
+                                     (self.guild_buckets, self.guild_rate, self.guild_burst)):
+            idle = [key for key, bucket in buckets.items() if bucket.tokens + (now - bucket.updated) * rate >= burst]
+            for key in idle:
+                del buckets[key]
+
+    def stats(self):
+        return {"user_buckets": len(self.user_buckets), "guild_buckets": len(self.guild_buckets)}
+
+
+limiter = RateLimiter(parse_costs(os.getenv("RATE_LIMIT_COSTS", DEFAULT_COSTS)))
+
+
+def retry_message(retry_in):
+    """The reply to a rate limited command."""
+    return f"You're using that command too often. Please try again in {max(1, math.ceil(retry_in))}s."
+
+
+metrics.register_collector("rate_limit", lambda: {
+    f"bot_rate_limit_{name}": value for name, value in limiter.stats().items()
+})
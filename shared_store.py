@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+STORE_PATH = os.getenv("SHARED_STORE_PATH", "shared_state.db")
+# Identifies this process as a lease owner, unique across the processes of one deployment
+PROCESS_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+
+class SharedStore:
+    """
+    State shared by every bot process on this machine, in a sqlite file in WAL mode:
+    JSON values by key, and leases that elect one process to do a job. Each call is
+    a single short transaction, fast enough to run on the event loop for small values.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        """
+        :param path: Path of the sqlite file, the same for every process.
+        """
+        self._lock = threading.Lock()
+        # Other processes may hold the write lock briefly, wait for it rather than fail
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+    def get(self, key, default=None):
+        """Return the value stored under key, or default."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set(self, key, value):
+        """Store a JSON-serializable value under key."""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def acquire_lease(self, name, ttl, owner=PROCESS_ID):
+        """
+        Take or renew a lease. Only one owner holds a lease at a time, until it
+        stops renewing and the lease expires.
+        :param name: Name of the job the lease is for, e.g. "twitch_poller".
+        :param ttl: Seconds the lease lasts without renewal.
+        :param owner: Who is asking, this process by default.
+        :return: True if owner holds the lease now.
+        """
+        now = time.time()
+        with self._lock:
+            # One statement, so checking and taking the lease can't race another process
+            self._conn.execute("""
+                INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+            """, (name, owner, now + ttl, now))
+            row = self._conn.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def release_lease(self, name, owner=PROCESS_ID):
+        """Give up a lease so another process can take it right away."""
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+
+store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the shared store, opening it on first use."""
+    global store
+    with _store_lock:
+        if store is None:
+            store = SharedStore()
+    return store
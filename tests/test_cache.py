@@ -0,0 +1,57 @@
+from cache import MISSING, TTLCache
+
+
+def test_returns_values_until_they_expire(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    clock.advance(59)
+    assert cache.get("a") == 1
+    clock.advance(2)
+    assert cache.get("a") is MISSING
+    assert len(cache) == 0
+
+
+def test_missing_keys():
+    assert TTLCache(maxsize=10, ttl=60).get("nope") is MISSING
+
+
+def test_none_is_a_cacheable_value(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", None)
+    assert cache.get("a") is None
+
+
+def test_evicts_the_least_recently_used(clock):
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # Now "b" is the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_setting_again_resets_the_ttl(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    clock.advance(50)
+    cache.set("a", 2)
+    clock.advance(50)
+    assert cache.get("a") == 2
+
+
+def test_keep_stale(clock):
+    cache = TTLCache(maxsize=10, ttl=60, keep_stale=True)
+    cache.set("a", 1)
+    clock.advance(61)
+    assert cache.get("a") is MISSING
+    assert cache.get_stale("a") == 1
+
+
+def test_expired_entries_are_dropped_without_keep_stale(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    clock.advance(61)
+    cache.get("a")
+    assert cache.get_stale("a") is MISSING
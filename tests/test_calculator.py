@@ -0,0 +1,98 @@
+import pytest
+from calculator import (MAX_BATCH, MAX_STEPS, CalculationError, calculate, calculate_batch, compile_expression,
+                        parse_values)
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("1 + 2 * 3", 7),
+    ("2^10", 1024),
+    ("-(3 - 5)", 2),
+    ("7 // 2 + 7 % 2", 4),
+    ("max(1, 5, 3)", 5),
+    ("round(2.567, 2)", 2.57),
+    ("round(2.5)", 2),
+    ("factorial(5)", 120),
+    ("sqrt(16)", 4.0),
+])
+def test_allowed_expressions(expression, expected):
+    assert calculate(expression) == expected
+
+
+@pytest.mark.parametrize("expression, error", [
+    ("__import__('os')", "Unknown function: __import__"),
+    ("open('x')", "Unknown function: open"),
+    ("(1).real", "Unsupported syntax: Attribute"),
+    ("'a' * 3", "Unsupported syntax: Constant"),
+    ("lambda: 1", "Unsupported syntax: Lambda"),
+    ("[1, 2]", "Unsupported syntax: List"),
+    ("x + 1", "Unknown name: x"),
+    ("round(2.5, ndigits=1)", "Unsupported syntax: Call"),
+    ("1 +", "Invalid mathematical expression."),
+    ("", "Invalid mathematical expression."),
+])
+def test_rejects_anything_not_whitelisted(expression, error):
+    assert calculate(expression) == f"Error: {error}"
+
+
+@pytest.mark.parametrize("expression, error", [
+    ("2 ** 1001", "Exponents are limited to 1000."),
+    ("9 ** 9 ** 9", "Exponents are limited to 1000."),
+    ("1000 ** 999", "Result is too large."),
+    ("10 ** 999 * 10 ** 999", "Result is too large."),
+    ("exp(1000)", "Result is too large."),
+    ("round(5, -100)", "round() takes a whole number of digits from -15 to 15."),
+    ("round(5, 0.5)", "round() takes a whole number of digits from -15 to 15."),
+    ("factorial(171)", "factorial() takes a whole number from 0 to 170."),
+    ("1 / 0", "Division by zero."),
+    ("sqrt(-1)", "Math error: math domain error"),
+    ("1" * 201, "Expressions are limited to 200 characters."),
+    ("+".join(["1"] * 60), "Expression is too long."),
+])
+def test_limits(expression, error):
+    assert calculate(expression) == f"Error: {error}"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("1,2,3", [1, 2, 3]),
+    (" 1, 2 ,3", [1, 2, 3]),
+    ("1.5,2", [1.5, 2]),
+    ("1..5", [1, 2, 3, 4, 5]),
+    ("0..1..0.25", [0, 0.25, 0.5, 0.75, 1]),
+    ("-2..2..2", [-2, 0, 2]),
+    ("3..3", [3]),
+])
+def test_parse_values(text, expected):
+    assert parse_values(text) == expected
+
+
+@pytest.mark.parametrize("text, error", [
+    ("", "No values to evaluate."),
+    (",", "No values to evaluate."),
+    ("5..1", "No values to evaluate."),
+    ("1..10..0", "The range step must be positive."),
+    ("1..10..-1", "The range step must be positive."),
+    ("1..2..3..4", "Ranges look like 1..10 or 0..1..0.1"),
+    ("a,b", "Values must be numbers."),
+    ("1..x", "Values must be numbers."),
+    (f"1..{MAX_BATCH + 1}", f"Ranges are limited to {MAX_BATCH} values."),
+    (",".join(["1"] * (MAX_BATCH + 1)), f"Batches are limited to {MAX_BATCH} values."),
+])
+def test_parse_values_errors(text, error):
+    with pytest.raises(CalculationError, match=error.replace(".", r"\.")):
+        parse_values(text)
+
+
+def test_batch_reports_errors_per_value():
+    assert calculate_batch("1/x", "-1,0,1") == [(-1, -1.0), (0, "Error: Division by zero."), (1, 1.0)]
+
+
+def test_batch_rejects_empty_values():
+    assert calculate_batch("x", "") == "Error: No values to evaluate."
+
+
+def test_batch_step_cap():
+    expression = "x" + " + x" * 20
+    _, nodes = compile_expression(expression)
+    assert nodes * MAX_BATCH > MAX_STEPS
+    assert calculate_batch(expression, f"1..{MAX_BATCH}").startswith("Error: That batch is too large")
+    assert len(calculate_batch(expression, "1..10")) == 10
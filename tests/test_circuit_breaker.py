@@ -0,0 +1,69 @@
+import pytest
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("test", failure_threshold=3, reset_timeout=30.0)
+
+
+def _fail(breaker, times):
+    for _ in range(times):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures(breaker):
+    _fail(breaker, 2)
+    assert breaker.state == CLOSED
+    _fail(breaker, 1)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.before_call()
+    assert raised.value.retry_in == pytest.approx(30.0)
+
+
+def test_success_resets_the_failure_count(breaker):
+    _fail(breaker, 2)
+    breaker.before_call()
+    breaker.record_success()
+    _fail(breaker, 2)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_one_probe_through(breaker, clock):
+    _fail(breaker, 3)
+    clock.advance(30)
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_successful_probe_closes(breaker, clock):
+    _fail(breaker, 3)
+    clock.advance(30)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.before_call()
+
+
+def test_failed_probe_opens_again(breaker, clock):
+    _fail(breaker, 3)
+    clock.advance(30)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    clock.advance(29)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_cancelled_probe_frees_the_slot(breaker, clock):
+    _fail(breaker, 3)
+    clock.advance(30)
+    breaker.before_call()
+    breaker.record_cancelled()
+    assert breaker.state == HALF_OPEN
+    breaker.before_call()
@@ -0,0 +1,79 @@
+import pytest
+import command_router
+from command_router import NO_ARGS, OPTIONAL_TEXT, TEXT, UsageError, command, parse_command
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(command_router, "registry", {})
+
+    @command("ping")
+    async def ping(message):
+        pass
+
+    @command("say", args=TEXT, aliases=("echo",))
+    async def say(message, text):
+        pass
+
+    @command("time", args=OPTIONAL_TEXT)
+    async def time_command(message, location):
+        pass
+
+    return command_router.registry
+
+
+def test_parses_command_and_text():
+    cmd, text = parse_command("!say hello   world ")
+    assert cmd.name == "say"
+    assert text == "hello   world"
+
+
+def test_command_names_are_case_insensitive():
+    assert parse_command("!PING")[0].name == "ping"
+
+
+def test_aliases_share_the_command():
+    assert parse_command("!echo hi")[0] is parse_command("!say hi")[0]
+
+
+def test_text_can_follow_a_newline():
+    assert parse_command("!say\nhello")[1] == "hello"
+
+
+@pytest.mark.parametrize("content", ["ping", "!", "!unknown", "", " !ping"])
+def test_ignores_messages_that_arent_commands(content):
+    assert parse_command(content) is None
+
+
+def test_missing_argument_text_is_empty():
+    assert parse_command("!time")[1] == ""
+
+
+def test_required_text_raises_usage_error():
+    cmd, text = parse_command("!say")
+    with pytest.raises(UsageError):
+        cmd.parse(text)
+
+
+def test_argument_styles():
+    assert parse_command("!ping")[0].parse("") == ()
+    assert parse_command("!time")[0].parse("") == ("",)
+
+
+def test_custom_parser_errors_become_usage_errors(registry):
+    def parse_number(text):
+        return (int(text),)
+
+    @command("double", args=parse_number)
+    async def double(message, number):
+        pass
+
+    cmd, text = parse_command("!double 4")
+    assert cmd.parse(text) == (4,)
+    with pytest.raises(UsageError):
+        cmd.parse("four")
+
+
+def test_duplicate_names_are_rejected():
+    with pytest.raises(ValueError):
+        command("PING", args=NO_ARGS)(lambda message: None)
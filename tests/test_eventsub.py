@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from twitch_notifier import EVENTSUB_MAX_AGE, _eventsub_signature, verify_eventsub_message
+
+SECRET = "s3cret-for-tests"
+BODY = b'{"subscription": {"type": "stream.online"}}'
+
+
+def _timestamp(age=0.0):
+    sent_at = datetime.now(timezone.utc) - timedelta(seconds=age)
+    # Twitch sends nanosecond precision
+    return sent_at.strftime("%Y-%m-%dT%H:%M:%S.%f") + "123Z"
+
+
+def _headers(secret=SECRET, body=BODY, age=0.0, message_id="msg-1"):
+    timestamp = _timestamp(age)
+    return {
+        "Twitch-Eventsub-Message-Id": message_id,
+        "Twitch-Eventsub-Message-Timestamp": timestamp,
+        "Twitch-Eventsub-Message-Signature": _eventsub_signature(secret, message_id, timestamp, body),
+    }
+
+
+def test_accepts_a_signed_fresh_message():
+    assert verify_eventsub_message(SECRET, _headers(), BODY)
+
+
+def test_rejects_another_secret():
+    assert not verify_eventsub_message(SECRET, _headers(secret="other"), BODY)
+
+
+def test_rejects_a_changed_body():
+    assert not verify_eventsub_message(SECRET, _headers(), BODY + b" ")
+
+
+def test_rejects_a_changed_message_id():
+    headers = _headers()
+    headers["Twitch-Eventsub-Message-Id"] = "msg-2"
+    assert not verify_eventsub_message(SECRET, headers, BODY)
+
+
+@pytest.mark.parametrize("age", [EVENTSUB_MAX_AGE + 5, -(EVENTSUB_MAX_AGE + 5)])
+def test_rejects_stale_or_future_messages(age):
+    assert not verify_eventsub_message(SECRET, _headers(age=age), BODY)
+
+
+def test_accepts_messages_within_the_max_age():
+    assert verify_eventsub_message(SECRET, _headers(age=EVENTSUB_MAX_AGE - 30), BODY)
+
+
+@pytest.mark.parametrize("missing", ["Twitch-Eventsub-Message-Id", "Twitch-Eventsub-Message-Timestamp",
+                                     "Twitch-Eventsub-Message-Signature"])
+def test_rejects_missing_headers(missing):
+    headers = _headers()
+    del headers[missing]
+    assert not verify_eventsub_message(SECRET, headers, BODY)
+
+
+def test_rejects_an_unparseable_timestamp():
+    headers = _headers()
+    headers["Twitch-Eventsub-Message-Timestamp"] = "yesterday"
+    headers["Twitch-Eventsub-Message-Signature"] = _eventsub_signature(SECRET, "msg-1", "yesterday", BODY)
+    assert not verify_eventsub_message(SECRET, headers, BODY)
@@ -0,0 +1,84 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from messaging import EMBED_FIELDS, EMBED_LIMIT, MESSAGE_LIMIT, Outbox, split_message
+
+
+def test_short_text_is_one_chunk():
+    assert split_message("hello") == ["hello"]
+
+
+def test_empty_text_is_no_chunks():
+    assert split_message("") == []
+
+
+def test_prefers_newlines():
+    text = "a" * 15 + "\n" + "b" * 8
+    assert split_message(text, limit=20) == ["a" * 15, "b" * 8]
+
+
+def test_falls_back_to_spaces():
+    text = "a" * 15 + " " + "b" * 8
+    assert split_message(text, limit=20) == ["a" * 15, "b" * 8]
+
+
+def test_ignores_breaks_early_in_the_chunk():
+    # Breaking at the newline would waste most of the chunk, so it cuts the word instead
+    text = "ab\n" + "c" * 30
+    assert split_message(text, limit=20) == [text[:20], text[20:]]
+
+
+def test_cuts_text_without_breaks_at_the_limit():
+    assert split_message("x" * 45, limit=20) == ["x" * 20, "x" * 20, "x" * 5]
+
+
+@pytest.mark.parametrize("text", [
+    "word " * 1000,
+    ("line of text\n" * 400),
+    "x" * 5000,
+])
+def test_chunks_fit_and_keep_every_word(text):
+    chunks = split_message(text)
+    assert all(len(chunk) <= MESSAGE_LIMIT for chunk in chunks)
+    assert "".join(chunks).replace("\n", "").replace(" ", "") == text.replace("\n", "").replace(" ", "")
+
+
+def _notification_embeds(fields):
+    outbox = Outbox()
+    sent = []
+
+    async def send_many(channel, payloads):
+        sent.extend(payload["embed"] for payload in payloads)
+
+    async def run():
+        outbox.send_many = send_many
+        channel = SimpleNamespace(id=1)
+        for name, value in fields:
+            outbox.notify(channel, "Live on Twitch", name, value)
+        await outbox.flush_notifications()
+
+    asyncio.run(run())
+    return sent
+
+
+def _embed_size(embed):
+    return len(embed.title) + sum(len(field.name) + len(field.value) for field in embed.fields)
+
+
+def test_notifications_share_an_embed():
+    embeds = _notification_embeds([(f"streamer{i}", "is live") for i in range(3)])
+    assert len(embeds) == 1
+    assert [field.name for field in embeds[0].fields] == ["streamer0", "streamer1", "streamer2"]
+
+
+def test_notification_embeds_respect_the_field_limit():
+    embeds = _notification_embeds([(f"streamer{i}", "is live") for i in range(EMBED_FIELDS + 1)])
+    assert [len(embed.fields) for embed in embeds] == [EMBED_FIELDS, 1]
+
+
+def test_notification_embeds_respect_the_size_limit():
+    fields = [(f"streamer{i}", "x" * 2000) for i in range(10)]
+    embeds = _notification_embeds(fields)
+    assert len(embeds) > 1
+    assert all(_embed_size(embed) <= EMBED_LIMIT for embed in embeds)
+    assert sum(len(embed.fields) for embed in embeds) == len(fields)
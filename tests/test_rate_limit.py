@@ -0,0 +1,91 @@
+import pytest
+import rate_limit
+from rate_limit import RateLimiter, parse_costs, retry_message
+
+
+@pytest.fixture
+def limiter(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "ENABLED", True)
+    return RateLimiter({"scan": 10, "chat": 2}, user_burst=10, user_per_minute=10,
+                       guild_burst=20, guild_per_minute=20)
+
+
+def test_parse_costs():
+    assert parse_costs("scan=10, Image=5,,bad=x") == {"scan": 10.0, "image": 5.0}
+
+
+def test_allows_up_to_the_burst(limiter):
+    for _ in range(5):
+        assert limiter.acquire("chat", 1, 100) == (0.0, False)
+    retry_in, notify = limiter.acquire("chat", 1, 100)
+    assert retry_in == pytest.approx(12.0)  # 2 tokens at 10 per minute
+    assert notify
+
+
+def test_only_notifies_once_until_allowed_again(limiter, clock):
+    limiter.acquire("scan", 1, 100)
+    assert limiter.acquire("scan", 1, 100)[1]
+    assert not limiter.acquire("scan", 1, 100)[1]
+    clock.advance(60)
+    assert limiter.acquire("scan", 1, 100) == (0.0, False)
+    assert limiter.acquire("scan", 1, 100)[1]
+
+
+def test_refills_over_time(limiter, clock):
+    limiter.acquire("scan", 1, 100)
+    clock.advance(30)
+    assert limiter.acquire("scan", 1, 100)[0] == pytest.approx(30.0)
+
+
+def test_uncosted_commands_are_not_limited(limiter):
+    for _ in range(100):
+        assert limiter.acquire("fact", 1, 100) == (0.0, False)
+
+
+def test_users_and_commands_have_separate_buckets(limiter):
+    limiter.acquire("scan", 1, 100)
+    assert limiter.acquire("scan", 2, 100) == (0.0, False)
+    assert limiter.acquire("chat", 1, 100) == (0.0, False)
+
+
+def test_guild_bucket_is_shared(limiter):
+    limiter.acquire("scan", 1, 100)
+    limiter.acquire("scan", 2, 100)
+    retry_in, _ = limiter.acquire("scan", 3, 100)
+    assert retry_in == pytest.approx(30.0)  # 10 tokens at 20 per minute
+    # Another guild and DMs aren't affected
+    assert limiter.acquire("scan", 3, 200) == (0.0, False)
+    assert limiter.acquire("scan", 4, None) == (0.0, False)
+
+
+def test_refused_commands_take_no_tokens(limiter, clock):
+    limiter.acquire("scan", 1, 100)
+    limiter.acquire("scan", 1, 100)
+    clock.advance(60)
+    assert limiter.acquire("scan", 1, 100) == (0.0, False)
+
+
+def test_disabled(limiter, monkeypatch):
+    monkeypatch.setattr(rate_limit, "ENABLED", False)
+    for _ in range(10):
+        assert limiter.acquire("scan", 1, 100) == (0.0, False)
+
+
+def test_evicts_refilled_buckets(limiter, clock):
+    limiter.acquire("scan", 1, 100)
+    limiter.acquire("chat", 2, 100)
+    clock.advance(12)
+    limiter.evict()
+    assert limiter.stats() == {"user_buckets": 1, "guild_buckets": 1}
+    clock.advance(60)
+    limiter.evict()
+    assert limiter.stats() == {"user_buckets": 0, "guild_buckets": 0}
+
+
+def test_costs_are_capped_at_the_bucket_size(clock):
+    assert RateLimiter({"scan": 50}, user_burst=10, guild_burst=20).costs == {"scan": 10}
+
+
+def test_retry_message_rounds_up():
+    assert retry_message(0.2).endswith("in 1s.")
+    assert retry_message(12.1).endswith("in 13s.")
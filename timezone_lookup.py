@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import mmap
+import os
+import threading
+import time
+import unicodedata
+from datetime import datetime
+import http_client
+from cache import MISSING, Cache, TTLCache
+from executor import run_blocking
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+NOMINATIM_HEADERS = {"User-Agent": "timezone_bot"}  # Nominatim requires an identifying user agent
+NOMINATIM_INTERVAL = 1.0  # Nominatim's usage policy allows at most 1 request per second
+
+# Sorted, tab-separated "name  latitude  longitude  timezone" lines
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gazetteer.tsv")
+
+# Geocoded locations that weren't in the gazetteer. Nominatim allows ~1 request/second,
+# so these are kept on disk as well.
+geocode_cache = Cache(
+    "timezone_geocode",
+    maxsize=2048,
+    ttl=30 * 24 * 3600,
+    disk_path=os.getenv("TIMEZONE_CACHE_PATH", "timezone_cache.db"),
+)
+# Locations Nominatim didn't find, so repeating a typo doesn't geocode it again. Kept
+# briefly and only in memory, since the place may just not have been indexed yet.
+not_found_cache = TTLCache(maxsize=1024, ttl=int(os.getenv("TIMEZONE_NOT_FOUND_TTL", "300")))
+
+_gazetteer = None
+_timezone_names = None
+_timezone_finder = None
+_lock = threading.Lock()
+_nominatim_lock = asyncio.Lock()
+_nominatim_last = 0.0
+
+
+def normalize_location(location):
+    """
+    Normalize a location name for lookups: lowercase, strip accents and punctuation.
+    :param location: Location as typed by the user.
+    :return: The normalized name.
+    """
+    text = unicodedata.normalize("NFKD", location).encode("ascii", "ignore").decode()
+    text = text.lower().replace(".", " ").replace("'", "").replace(",", " , ")
+    return " ".join(text.split())
+
+
+def _load_gazetteer():
+    """Memory-map the gazetteer file on first use."""
+    global _gazetteer
+    with _lock:
+        if _gazetteer is None:
+            with open(GAZETTEER_PATH, "rb") as f:
+                _gazetteer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            logger.info("Loaded gazetteer from %s (%s bytes).", GAZETTEER_PATH, len(_gazetteer))
+    return _gazetteer
+
+
+def _search_gazetteer(name):
+    """
+    Binary search the memory-mapped gazetteer for an exact name.
+    :param name: Normalized location name.
+    :return: A tuple (latitude, longitude, timezone) or None.
+    """
+    data = _gazetteer if _gazetteer is not None else _load_gazetteer()
+    key = name.encode()
+    lo, hi = 0, len(data)
+    # lo and hi always sit on line boundaries
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = data.rfind(b"\n", lo, mid) + 1 or lo
+        end = data.find(b"\n", start, hi)
+        if end == -1:
+            end = hi
+        line = data[start:end]
+        line_key, _, rest = line.partition(b"\t")
+        if line_key == key:
+            lat, lon, timezone = rest.decode().split("\t")
+            return float(lat), float(lon), timezone
+        if line_key < key:
+            lo = end + 1
+        else:
+            hi = start
+    return None
+
+
+def _lookup_timezone_name(location):
+    """Return the canonical timezone name if location is one, e.g. "europe/berlin"."""
+    global _timezone_names
+    if _timezone_names is None:
+        import pytz
+        _timezone_names = {name.lower(): name for name in pytz.all_timezones}
+    return _timezone_names.get(location.strip().lower().replace(" ", "_"))
+
+
+def find_timezone_offline(location):
+    """
+    Resolve a location to a timezone without any network calls.
+    :param location: A timezone name or a city, state or country name.
+    :return: The timezone name or None if the location isn't known locally.
+    """
+    timezone_name = _lookup_timezone_name(location)
+    if timezone_name:
+        return timezone_name
+
+    name = normalize_location(location)
+    entry = _search_gazetteer(name.replace(" ,", ""))
+    if entry is None and "," in name:
+        # "Paris, France" -> "paris"
+        entry = _search_gazetteer(name.split(" ,")[0])
+    if entry is None:
+        cached = geocode_cache.get(name)
+        return cached if isinstance(cached, str) else None
+    return entry[2]
+
+
+def _load_timezone_finder():
+    global _timezone_finder
+    with _lock:
+        if _timezone_finder is None:
+            from timezonefinder import TimezoneFinder
+            _timezone_finder = TimezoneFinder()
+    return _timezone_finder
+
+
+async def _wait_for_nominatim():
+    """Space geocoding requests at least NOMINATIM_INTERVAL apart across every caller."""
+    global _nominatim_last
+    async with _nominatim_lock:
+        delay = _nominatim_last + NOMINATIM_INTERVAL - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        _nominatim_last = time.monotonic()
+
+
+async def _geocode_timezone(location):
+    params = {"q": location, "format": "json", "limit": 1}
+    await _wait_for_nominatim()
+    places = await http_client.get_json(NOMINATIM_URL, params=params, headers=NOMINATIM_HEADERS,
+                                        upstream="nominatim")
+    if not places:
+        return None
+    # Loading the timezone polygons takes a while, keep it off the event loop
+    finder = _timezone_finder or await run_blocking("startup", _load_timezone_finder)
+    return finder.timezone_at(lng=float(places[0]["lon"]), lat=float(places[0]["lat"]))
+
+
+async def find_timezone(location):
+    """
+    Resolve a location to a timezone, falling back to geocoding with Nominatim when it
+    isn't in the local gazetteer. Geocoded results are cached, and misses briefly too.
+    :param location: A timezone name or a city, state or country name.
+    :return: The timezone name or None if the location couldn't be found.
+    """
+    timezone_name = find_timezone_offline(location)
+    if timezone_name:
+        return timezone_name
+    name = normalize_location(location)
+    if not_found_cache.get(name) is not MISSING:
+        return None
+    timezone_name = await geocode_cache.get_or_load_async(name, lambda: _geocode_timezone(location))
+    if timezone_name is None:
+        not_found_cache.set(name, True)
+    return timezone_name
+
+
+def format_current_time(timezone_name):
+    """
+    Format the current time in a timezone.
+    :param timezone_name: A pytz timezone name.
+    :return: The time as "YYYY-MM-DD HH:MM:SS TZ+hhmm".
+    """
+    import pytz
+    return datetime.now(pytz.timezone(timezone_name)).strftime('%Y-%m-%d %H:%M:%S %Z%z')
+
+
+def preload():
+    """Load the gazetteer and timezone names ahead of the first !time."""
+    _load_gazetteer()
+    _lookup_timezone_name("UTC")
+
+
+def build_gazetteer(rows, path=GAZETTEER_PATH):
+    """
+    Write a gazetteer file in the sorted format _search_gazetteer expects.
+    :param rows: Iterable of (name, latitude, longitude, timezone) tuples.
+    :param path: Output path.
+    :return: Number of entries written.
+    """
+    entries = {}
+    for name, lat, lon, timezone in rows:
+        key = normalize_location(name).replace(" ,", "")
+        # Keep the first entry for a name, so list the most important places first
+        entries.setdefault(key.encode(), f"{float(lat):.2f}\t{float(lon):.2f}\t{timezone}")
+    with open(path, "wb") as f:
+        for key in sorted(entries):
+            f.write(key + b"\t" + entries[key].encode() + b"\n")
+    return len(entries)
+
+
+def _read_geonames(path, min_population=100000):
+    """Yield gazetteer rows from a GeoNames cities dump (e.g. cities15000.txt), largest cities first."""
+    cities = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            population = int(fields[14] or 0)
+            if population >= min_population:
+                cities.append((population, fields[1], fields[4], fields[5], fields[17]))
+    cities.sort(key=lambda city: -city[0])
+    for _, name, lat, lon, timezone in cities:
+        yield name, lat, lon, timezone
+
+
+def _read_gazetteer(path=GAZETTEER_PATH):
+    """Yield the rows of an existing gazetteer file."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield line.rstrip("\n").split("\t")
+
+
+# Add the cities from a GeoNames dump to the bundled gazetteer: python timezone_lookup.py cities15000.txt
+if __name__ == "__main__":
+    import sys
+    # Existing entries (countries, states, aliases) win name clashes
+    rows = list(_read_gazetteer()) + list(_read_geonames(sys.argv[1]))
+    print(f"Wrote {build_gazetteer(rows)} entries to {GAZETTEER_PATH}")
@@ -1,71 +1,427 @@
-import requests
+import asyncio
+import hashlib
+import hmac
+import json
+import aiohttp
 import os
+import time
+import uuid
 import logging
+from aiohttp import web
+from collections import OrderedDict
+from datetime import datetime, timezone
 from dotenv import load_dotenv
+import http_client
+from executor import run_blocking
+from shared_store import get_store
 
 # Load environment variables
 load_dotenv()
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Twitch API credentials
 TWITCH_CLIENT_ID = os.getenv("TWITCH_CLIENT_ID")
 TWITCH_CLIENT_SECRET = os.getenv("TWITCH_CLIENT_SECRET")
 BASE_TWITCH_URL = "https://api.twitch.tv/helix"
-access_token = None
+TOKEN_URL = "https://id.twitch.tv/oauth2/token"
+HELIX_MAX_LOGINS = 100  # Helix /streams accepts up to 100 user_login values per call
+MAX_ATTEMPTS = 3
+# Server errors are retried by http_client, 401 and 429 here
+RETRY_STATUSES = (500, 502, 503, 504)
 
-# Dictionary to track streamers' live statuses
+# Dictionary to track streamers' live statuses, saved to the shared store so a
+# process that takes over polling doesn't announce streams again
 live_streams = {}
+LIVE_STATUS_KEY = "twitch_live_streams"
 
-def get_twitch_access_token():
-    """Get a Twitch API access token."""
-    global access_token
-    if not access_token:
-        url = "https://id.twitch.tv/oauth2/token"
+
+class TwitchTokenManager:
+    """Keeps an app access token fresh, refreshing it before it expires."""
+
+    def __init__(self, refresh_margin=300):
+        self.refresh_margin = refresh_margin  # Seconds before expiry to refresh
+        self.token = None
+        self.expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self):
+        return self.token is not None and time.monotonic() < self.expires_at - self.refresh_margin
+
+    async def get_token(self):
+        """Return a valid access token. Concurrent callers share one refresh."""
+        if self._is_fresh():
+            return self.token
+        async with self._lock:
+            # Another caller may have refreshed while we waited for the lock
+            if not self._is_fresh():
+                await self._refresh()
+            return self.token
+
+    async def _refresh(self):
         params = {
             "client_id": TWITCH_CLIENT_ID,
             "client_secret": TWITCH_CLIENT_SECRET,
             "grant_type": "client_credentials"
         }
-        response = requests.post(url, params=params)
+        response = await http_client.post(TOKEN_URL, params=params, upstream="twitch", retries=1,
+                                          retry_statuses=RETRY_STATUSES)
         response.raise_for_status()
-        access_token = response.json().get("access_token")
-        logger.info("Successfully obtained Twitch access token.")
-    return access_token
+        data = response.json()
+        self.token = data.get("access_token")
+        expires_in = data.get("expires_in", 3600)
+        # Don't let the margin swallow short-lived tokens
+        self.refresh_margin = min(self.refresh_margin, expires_in / 10)
+        self.expires_at = time.monotonic() + expires_in
+        logger.info("Successfully obtained Twitch access token (expires in %ss).", expires_in)
+
+    def invalidate(self, token):
+        """
+        Drop a token the API rejected.
+        :param token: The token that was rejected. Ignored if it was already replaced.
+        """
+        if token == self.token:
+            self.token = None
+            self.expires_at = 0.0
+
+
+class HelixRateLimiter:
+    """Paces Helix requests using the Ratelimit-Remaining and Ratelimit-Reset headers."""
 
-def check_stream_status(username):
+    def __init__(self, reserve=5):
+        self.reserve = reserve  # Requests to keep in hand for other callers
+        self.remaining = None
+        self.reset_at = 0.0  # Unix time the bucket refills
+
+    async def wait(self):
+        """Sleep until the bucket refills if it's nearly empty."""
+        if self.remaining is None:
+            return
+        if self.remaining > self.reserve:
+            self.remaining -= 1  # Count requests still in flight against the bucket
+            return
+        delay = self.reset_at - time.time()
+        if delay > 0:
+            logger.warning("Twitch rate limit nearly exhausted, waiting %.1fs.", delay)
+            await asyncio.sleep(delay)
+        self.remaining = None
+
+    def update(self, headers):
+        """Record the rate limit state from a Helix response."""
+        try:
+            self.remaining = int(headers["Ratelimit-Remaining"])
+            self.reset_at = float(headers["Ratelimit-Reset"])
+        except (KeyError, ValueError):
+            pass
+
+
+token_manager = TwitchTokenManager()
+rate_limiter = HelixRateLimiter()
+
+async def _helix_request(method, path, params=None, body=None):
     """
-    Check if a Twitch streamer is live.
-    :param username: Twitch username of the streamer.
-    :return: Boolean indicating live status and stream details.
+    Make an authenticated Helix request, refreshing the token and backing off as needed.
+    :param method: HTTP method.
+    :param path: Path under BASE_TWITCH_URL, e.g. "/streams".
+    :param body: Optional object sent as the JSON request body.
+    :return: The decoded JSON response, or None for empty responses.
     """
-    global access_token
-    url = f"{BASE_TWITCH_URL}/streams"
-    headers = {
-        "Client-ID": TWITCH_CLIENT_ID,
-        "Authorization": f"Bearer {get_twitch_access_token()}",
-    }
-    params = {"user_login": username}
-    response = requests.get(url, headers=headers, params=params)
-    if response.status_code == 401:  # Token expired, refresh it
-        logger.warning("Twitch access token expired. Refreshing...")
-        access_token = None
-        return check_stream_status(username)
-    response.raise_for_status()
-    data = response.json().get("data", [])
-    if data:
-        return True, data[0]  # Stream is live, return stream details
-    return False, None
+    url = f"{BASE_TWITCH_URL}{path}"
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        await rate_limiter.wait()
+        token = await token_manager.get_token()
+        headers = {
+            "Client-ID": TWITCH_CLIENT_ID,
+            "Authorization": f"Bearer {token}",
+        }
+        response = await http_client.request(method, url, headers=headers, params=params, json=body,
+                                             upstream="twitch", retry_statuses=RETRY_STATUSES)
+        rate_limiter.update(response.headers)
+        if attempt < MAX_ATTEMPTS:
+            if response.status == 401:  # Token expired or revoked, refresh it
+                logger.warning("Twitch access token rejected. Refreshing...")
+                token_manager.invalidate(token)
+                continue
+            if response.status == 429:  # Rate limited, wait for the bucket to refill
+                rate_limiter.remaining = 0
+                rate_limiter.reset_at = max(rate_limiter.reset_at, time.time() + 1)
+                continue
+        response.raise_for_status()
+        if response.status == 204:
+            return None
+        return response.json()
+
+async def _fetch_live_streams(logins):
+    """
+    Fetch the live streams for up to HELIX_MAX_LOGINS usernames in one request.
+    :param logins: List of lowercase Twitch usernames.
+    :return: List of stream objects for the users that are live.
+    """
+    params = [("user_login", login) for login in logins] + [("first", str(HELIX_MAX_LOGINS))]
+    data = await _helix_request("GET", "/streams", params=params)
+    return data.get("data", [])
+
+async def check_streams_status(usernames):
+    """
+    Check which of the given Twitch streamers are live, 100 usernames per Helix request.
+    :param usernames: Iterable of Twitch usernames.
+    :return: Dict mapping each username to its stream details, or None if not live.
+             Usernames in a batch that failed are left out.
+    """
+    logins = {username.lower(): username for username in usernames}
+    batches = [list(logins)[i:i + HELIX_MAX_LOGINS] for i in range(0, len(logins), HELIX_MAX_LOGINS)]
+    results = await asyncio.gather(*(_fetch_live_streams(batch) for batch in batches), return_exceptions=True)
+
+    statuses = {}
+    for batch, streams in zip(batches, results):
+        if isinstance(streams, Exception):
+            logger.error("Error checking %s Twitch streams: %s", len(batch), streams)
+            continue
+        for login in batch:
+            statuses[logins[login]] = None
+        for stream in streams:
+            username = logins.get(stream.get("user_login", "").lower())
+            if username is not None:
+                statuses[username] = stream
+    return statuses
 
 def update_live_status(username, is_live):
     """
     Update the live status of a streamer and determine if a notification is needed.
+    Saves changes to the shared store, so call it through run_blocking("db", ...).
     :param username: Twitch username of the streamer.
     :param is_live: Boolean indicating current live status.
     :return: Boolean indicating if a notification should be sent.
     """
     was_live = live_streams.get(username, False)
     live_streams[username] = is_live
-    return is_live and not was_live
\ No newline at end of file
+    if is_live != was_live:
+        get_store().set(LIVE_STATUS_KEY, live_streams)
+    return is_live and not was_live
+
+def load_live_status():
+    """Replace the live statuses with the ones saved by whichever process polled last."""
+    live_streams.clear()
+    live_streams.update(get_store().get(LIVE_STATUS_KEY, {}))
+
+# EventSub (push notifications) settings
+EVENTSUB_SECRET = os.getenv("TWITCH_EVENTSUB_SECRET")
+EVENTSUB_CALLBACK = os.getenv("TWITCH_EVENTSUB_CALLBACK")  # Public HTTPS URL that forwards to the receiver
+EVENTSUB_HOST = os.getenv("TWITCH_EVENTSUB_HOST", "0.0.0.0")
+EVENTSUB_PORT = int(os.getenv("TWITCH_EVENTSUB_PORT", "8080"))
+EVENTSUB_PATH = "/eventsub"
+EVENTSUB_TYPES = ("stream.online", "stream.offline")
+EVENTSUB_MAX_AGE = 600  # Twitch recommends rejecting messages older than 10 minutes
+
+
+def eventsub_enabled():
+    """Return True if the EventSub secret and callback URL are configured."""
+    return bool(EVENTSUB_SECRET and EVENTSUB_CALLBACK)
+
+def _eventsub_signature(secret, message_id, timestamp, body):
+    digest = hmac.new(secret.encode(), message_id.encode() + timestamp.encode() + body, hashlib.sha256)
+    return f"sha256={digest.hexdigest()}"
+
+def _parse_eventsub_timestamp(timestamp):
+    # Twitch sends RFC3339 with nanoseconds, which strptime can't parse
+    base = timestamp.rstrip("Z").partition(".")[0]
+    return datetime.strptime(base, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+
+def verify_eventsub_message(secret, headers, body):
+    """
+    Check that an EventSub message was signed with our secret and isn't stale.
+    :param secret: The secret the subscriptions were created with.
+    :param headers: The request headers.
+    :param body: The raw request body as bytes.
+    :return: True if the message is authentic.
+    """
+    try:
+        message_id = headers["Twitch-Eventsub-Message-Id"]
+        timestamp = headers["Twitch-Eventsub-Message-Timestamp"]
+        signature = headers["Twitch-Eventsub-Message-Signature"]
+        sent_at = _parse_eventsub_timestamp(timestamp)
+    except (KeyError, ValueError):
+        return False
+    if abs((datetime.now(timezone.utc) - sent_at).total_seconds()) > EVENTSUB_MAX_AGE:
+        return False
+    expected = _eventsub_signature(secret, message_id, timestamp, body)
+    return hmac.compare_digest(expected, signature)
+
+
+class EventSubReceiver:
+    """Local webhook server that receives stream.online/stream.offline events from Twitch."""
+
+    def __init__(self, secret, on_online, on_offline=None, host=EVENTSUB_HOST, port=EVENTSUB_PORT):
+        """
+        :param secret: The EventSub secret used to verify signatures.
+        :param on_online: Coroutine called as on_online(username, stream_details) when a streamer goes live.
+        :param on_offline: Optional coroutine called as on_offline(username) when a stream ends.
+        """
+        self.secret = secret
+        self.on_online = on_online
+        self.on_offline = on_offline
+        self.host = host
+        self.port = port
+        self._runner = None
+        self._seen_ids = OrderedDict()  # Twitch may redeliver messages
+        self._tasks = set()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(EVENTSUB_PATH, self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("EventSub receiver listening on %s:%s%s", self.host, self.port, EVENTSUB_PATH)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _is_duplicate(self, message_id):
+        if message_id in self._seen_ids:
+            return True
+        self._seen_ids[message_id] = None
+        if len(self._seen_ids) > 1000:
+            self._seen_ids.popitem(last=False)
+        return False
+
+    async def handle(self, request):
+        body = await request.read()
+        if not verify_eventsub_message(self.secret, request.headers, body):
+            logger.warning("Rejected EventSub message with an invalid signature or timestamp.")
+            return web.Response(status=403)
+
+        message = json.loads(body)
+        message_type = request.headers.get("Twitch-Eventsub-Message-Type")
+        if message_type == "webhook_callback_verification":
+            logger.info("Verified EventSub subscription %s.", message["subscription"]["type"])
+            return web.Response(text=message["challenge"], content_type="text/plain")
+        if message_type == "revocation":
+            logger.warning("EventSub subscription revoked: %s", message["subscription"].get("status"))
+            return web.Response(status=204)
+        if message_type != "notification" or self._is_duplicate(request.headers["Twitch-Eventsub-Message-Id"]):
+            return web.Response(status=204)
+
+        # Reply right away, Twitch retries if we take longer than a few seconds
+        task = asyncio.create_task(self._handle_event(message["subscription"]["type"], message["event"]))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response(status=204)
+
+    async def _handle_event(self, event_type, event):
+        username = event["broadcaster_user_login"]
+        try:
+            if event_type == "stream.online":
+                if await run_blocking("db", update_live_status, username, True):
+                    logger.info("%s went live (EventSub).", username)
+                    # The event has no title, so fetch the stream details
+                    stream = (await check_streams_status([username])).get(username)
+                    await self.on_online(username, stream or {"user_login": username})
+            elif event_type == "stream.offline":
+                await run_blocking("db", update_live_status, username, False)
+                if self.on_offline is not None:
+                    await self.on_offline(username)
+        except Exception as e:
+            logger.error("Error handling EventSub %s for %s: %s", event_type, username, e)
+
+
+async def _get_user_ids(usernames):
+    """
+    Resolve Twitch usernames to user IDs, 100 per request.
+    :return: Dict mapping lowercase username to user ID.
+    """
+    logins = [username.lower() for username in usernames]
+    user_ids = {}
+    for i in range(0, len(logins), HELIX_MAX_LOGINS):
+        params = [("login", login) for login in logins[i:i + HELIX_MAX_LOGINS]]
+        data = await _helix_request("GET", "/users", params=params)
+        for user in data.get("data", []):
+            user_ids[user["login"]] = user["id"]
+    return user_ids
+
+async def _list_eventsub_subscriptions():
+    subscriptions = []
+    params = {}
+    while True:
+        data = await _helix_request("GET", "/eventsub/subscriptions", params=params)
+        subscriptions.extend(data.get("data", []))
+        cursor = data.get("pagination", {}).get("cursor")
+        if not cursor:
+            return subscriptions
+        params = {"after": cursor}
+
+async def subscribe_stream_events(usernames, callback_url=EVENTSUB_CALLBACK, secret=EVENTSUB_SECRET):
+    """
+    Make sure every username has stream.online and stream.offline subscriptions.
+    :param usernames: Iterable of Twitch usernames.
+    :param callback_url: Public URL Twitch should deliver events to.
+    :param secret: Secret Twitch signs events with.
+    :return: Number of subscriptions created.
+    """
+    user_ids = await _get_user_ids(usernames)
+    existing = {
+        (sub["type"], sub["condition"].get("broadcaster_user_id"))
+        for sub in await _list_eventsub_subscriptions()
+        if sub["status"] in ("enabled", "webhook_callback_verification_pending")
+        and sub["transport"].get("callback") == callback_url
+    }
+
+    created = 0
+    for username, user_id in user_ids.items():
+        for event_type in EVENTSUB_TYPES:
+            if (event_type, user_id) in existing:
+                continue
+            await _helix_request("POST", "/eventsub/subscriptions", body={
+                "type": event_type,
+                "version": "1",
+                "condition": {"broadcaster_user_id": user_id},
+                "transport": {"method": "webhook", "callback": callback_url, "secret": secret},
+            })
+            created += 1
+            logger.info("Subscribed to %s for %s.", event_type, username)
+    return created
+
+async def send_test_event(event_type, username, url=None, secret=EVENTSUB_SECRET, user_id="0"):
+    """
+    Post a signed stand-in EventSub notification to a local receiver.
+    :param event_type: "stream.online" or "stream.offline".
+    :param username: Twitch username the event is for.
+    :param url: Receiver URL, defaults to the local receiver.
+    :return: The HTTP status the receiver replied with.
+    """
+    url = url or f"http://127.0.0.1:{EVENTSUB_PORT}{EVENTSUB_PATH}"
+    event = {
+        "broadcaster_user_id": user_id,
+        "broadcaster_user_login": username.lower(),
+        "broadcaster_user_name": username,
+    }
+    if event_type == "stream.online":
+        event.update({"id": "0", "type": "live", "started_at": datetime.now(timezone.utc).isoformat()})
+    body = json.dumps({
+        "subscription": {"id": str(uuid.uuid4()), "type": event_type, "version": "1", "status": "enabled",
+                         "condition": {"broadcaster_user_id": user_id}},
+        "event": event,
+    }).encode()
+    message_id = str(uuid.uuid4())
+    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    headers = {
+        "Content-Type": "application/json",
+        "Twitch-Eventsub-Message-Id": message_id,
+        "Twitch-Eventsub-Message-Timestamp": timestamp,
+        "Twitch-Eventsub-Message-Signature": _eventsub_signature(secret, message_id, timestamp, body),
+        "Twitch-Eventsub-Message-Type": "notification",
+        "Twitch-Eventsub-Subscription-Type": event_type,
+    }
+    async with aiohttp.ClientSession() as test_session:
+        async with test_session.post(url, data=body, headers=headers) as response:
+            return response.status
+
+
+# Send a stand-in event to a running bot: python twitch_notifier.py stream.online <username>
+if __name__ == "__main__":
+    import sys
+    status = asyncio.run(send_test_event(sys.argv[1], sys.argv[2]))
+    print(f"Receiver replied with HTTP {status}")
@@ -1,53 +1,206 @@
-import nmap
+import asyncio
+import ipaddress
 import logging
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+from dotenv import load_dotenv
+from cache import TTLCache, MISSING
+from messaging import MESSAGE_LIMIT, split_message
+
+# Load environment variables
+load_dotenv()
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+NMAP_ARGUMENTS = ["-sV", "--script=vuln", "--stats-every", "15s", "-oX", "-"]
+HOSTNAME_PATTERN = re.compile(r"^[A-Za-z0-9](?:[A-Za-z0-9-]{0,62}\.)*[A-Za-z0-9-]{1,63}$")
+
+
+class ScanLimitError(Exception):
+    """Raised when a scan can't start because of the concurrency limits."""
 
-def scan_ip(ip_address):
+
+def validate_target(target):
     """
-    Performs a vulnerability scan against an IP address.
-    :param ip_address: The IP address to scan.
-    :return: A string containing scan results or an error message.
+    Check that a scan target is an IP address or hostname, never an nmap option.
+    :return: The normalized target or None.
     """
+    target = target.strip()
     try:
-        # Initialize the Nmap scanner
-        nm = nmap.PortScanner()
-        logger.info(f"Starting scan on IP: {ip_address}")
-
-        # Run the scan
-        nm.scan(ip_address, arguments='-sV --script=vuln')
-
-        # Check if the host is up
-        if ip_address not in nm.all_hosts():
-            logger.warning(f"Host {ip_address} is down or unreachable.")
-            return f"Host {ip_address} is down or unreachable."
-
-        # Extract scan results
-        scan_results = f"Vulnerability Scan for {ip_address}:\n"
-        for proto in nm[ip_address].all_protocols():
-            ports = nm[ip_address][proto].keys()
-            for port in sorted(ports):
-                service = nm[ip_address][proto][port]
-                port_info = (
-                    f"Port {port}/{proto}:\n"
-                    f"  Service: {service['name']}\n"
-                    f"  Version: {service.get('version', 'N/A')}\n"
-                )
-                scan_results += port_info
-
-                # Add vulnerability information if available
-                if "script" in service:
-                    vulns = service["script"]
-                    scan_results += f"  Vulnerabilities:\n"
-                    for vuln, details in vulns.items():
-                        scan_results += f"    - {vuln}: {details}\n"
+        return str(ipaddress.ip_address(target))
+    except ValueError:
+        return target.lower() if HOSTNAME_PATTERN.match(target) else None
+
+
+class ReportBuilder:
+    """Collects report lines and hands them out in chunks that fit in a Discord message."""
+
+    def __init__(self, limit=MESSAGE_LIMIT):
+        self.limit = limit
+        self.parts = []
+        self.length = 0
+
+    def add(self, text):
+        """
+        Add text to the report.
+        :return: List of chunks that are complete and can be sent now.
+        """
+        ready = []
+        if self.length + len(text) > self.limit:
+            ready.extend(self.flush())
+        if len(text) > self.limit:
+            *full, text = split_message(text, self.limit)
+            ready.extend(full)
+        self.parts.append(text)
+        self.length += len(text)
+        return ready
+
+    def flush(self):
+        """Return whatever is buffered as a final chunk."""
+        text = "".join(self.parts)
+        self.parts, self.length = [], 0
+        return [text] if text.strip() else []
+
+
+def _format_port(port):
+    service = port.find("service")
+    service = service.attrib if service is not None else {}
+    lines = [
+        f"Port {port.get('portid')}/{port.get('protocol')}:\n",
+        f"  Service: {service.get('name', 'N/A')}\n",
+        f"  Version: {service.get('version', 'N/A')}\n",
+    ]
+    scripts = port.findall("script")
+    if scripts:
+        lines.append("  Vulnerabilities:\n")
+        lines.extend(f"    - {script.get('id')}: {script.get('output', '').strip()}\n" for script in scripts)
+    return "".join(lines)
+
 
+class Scanner:
+    """
+    Runs nmap as an async subprocess, parsing its XML output as it arrives so
+    progress and report chunks can be relayed while the scan is still running.
+    """
+
+    def __init__(self, max_scans=2, max_per_user=1, timeout=900, cache_ttl=3600):
+        """
+        :param max_scans: Scans allowed to run at the same time.
+        :param max_per_user: Scans each user may have running or waiting.
+        :param timeout: Seconds before a scan is killed.
+        :param cache_ttl: Seconds a finished report is reused for the same target.
+        """
+        self.max_per_user = max_per_user
+        self.timeout = timeout
+        self.cache = TTLCache(maxsize=256, ttl=cache_ttl)
+        self._semaphore = asyncio.Semaphore(max_scans)
+        self._user_scans = {}  # user_id -> scans running or waiting
+
+    async def scan(self, target, user_id):
+        """
+        Scan a target.
+        :param target: IP address or hostname to scan.
+        :param user_id: The user asking, for the per-user limit.
+        :return: Async generator of ("progress", text) and ("report", chunk) events.
+        """
+        target = validate_target(target)
+        if target is None:
+            yield "report", "Please provide a valid IP address or hostname."
+            return
+
+        cached = self.cache.get(target)
+        if cached is not MISSING:
+            logger.info("Serving cached scan results for %s.", target)
+            for chunk in cached:
+                yield "report", chunk
+            return
+
+        if self._user_scans.get(user_id, 0) >= self.max_per_user:
+            raise ScanLimitError("You already have a scan running. Please wait for it to finish.")
+        self._user_scans[user_id] = self._user_scans.get(user_id, 0) + 1
+        try:
+            if self._semaphore.locked():
+                yield "progress", "Waiting for a free scanner..."
+            async with self._semaphore:
+                async for event in self._run(target):
+                    yield event
+        finally:
+            self._user_scans[user_id] -= 1
+            if not self._user_scans[user_id]:
+                del self._user_scans[user_id]
+
+    async def _run(self, target):
+        logger.info("Starting scan on IP: %s", target)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                "nmap", *NMAP_ARGUMENTS, target,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        except FileNotFoundError:
+            logger.error("nmap is not installed.")
+            yield "report", "An error occurred while performing the scan."
+            return
+
+        parser = ET.XMLPullParser(events=("end",))
+        report = ReportBuilder()
+        chunks = []
+        host_up = False
+        deadline = time.monotonic() + self.timeout
+        yield "progress", f"Scan of {target} started."
+        report.add(f"Vulnerability Scan for {target}:\n")
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                data = await asyncio.wait_for(process.stdout.read(4096), remaining)
+                if not data:
+                    break
+                parser.feed(data)
+                for _, element in parser.read_events():
+                    if element.tag == "taskprogress":
+                        yield "progress", (f"Scanning {target}: {element.get('task')} "
+                                           f"{float(element.get('percent', 0)):.0f}% done")
+                    elif element.tag == "status" and element.get("state") == "up":
+                        host_up = True
+                    elif element.tag == "port":
+                        for ready in report.add(_format_port(element)):
+                            chunks.append(ready)
+                            yield "report", ready
+                        element.clear()
+            await process.wait()
+        except asyncio.TimeoutError:
+            logger.warning("Scan of %s timed out after %ss.", target, self.timeout)
+            yield "report", f"The scan of {target} timed out after {self.timeout // 60} minutes."
+            return
+        except ET.ParseError as e:
+            logger.error("Error parsing nmap output: %s", e)
+            yield "report", "An error occurred while performing the scan."
+            return
+        finally:
+            # Also runs when the caller stops iterating early or the task is cancelled
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+        if not host_up:
+            logger.warning("Host %s is down or unreachable.", target)
+            yield "report", f"Host {target} is down or unreachable."
+            return
+
+        for ready in report.flush():
+            chunks.append(ready)
+            yield "report", ready
+        self.cache.set(target, chunks)
         logger.info("Scan completed successfully.")
-        return scan_results
 
-    except Exception as e:
-        logger.error(f"Error performing scan: {e}")
-        return "An error occurred while performing the scan."
+
+scanner = Scanner(
+    max_scans=int(os.getenv("SCAN_MAX_CONCURRENT", "2")),
+    max_per_user=int(os.getenv("SCAN_MAX_PER_USER", "1")),
+    timeout=int(os.getenv("SCAN_TIMEOUT", "900")),
+    cache_ttl=int(os.getenv("SCAN_CACHE_TTL", "3600")),
+)
+
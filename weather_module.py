@@ -1,5 +1,7 @@
-import requests
 import logging
+import http_client
+from circuit_breaker import CircuitOpenError
+from cache import Cache
 from dotenv import load_dotenv
 import os
 
@@ -7,7 +9,6 @@ import os
 load_dotenv()
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # OpenWeatherMap API key
@@ -15,31 +16,73 @@ API_KEY = os.getenv("WEATHER_API_KEY")
 GEO_URL = "http://api.openweathermap.org/geo/1.0/direct"
 WEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
 
-def get_coordinates(city_name):
+# City coordinates never change, so keep them for a long time and on disk.
+# Weather is only cached briefly, keyed by coordinates rounded to ~1 km.
+coordinates_cache = Cache(
+    "weather_coordinates",
+    maxsize=int(os.getenv("WEATHER_GEO_CACHE_SIZE", "1024")),
+    ttl=30 * 24 * 3600,
+    disk_path=os.getenv("WEATHER_CACHE_PATH", "weather_cache.db"),
+)
+weather_cache = Cache(
+    "weather",
+    maxsize=int(os.getenv("WEATHER_CACHE_SIZE", "256")),
+    ttl=int(os.getenv("WEATHER_CACHE_TTL", "600")),
+)
+
+def normalize_city_name(city_name):
+    """Normalize a city name so that "new  york" and "New York" share a cache entry."""
+    return " ".join(city_name.lower().split())
+
+async def _fetch_coordinates(city_name):
+    logger.debug("Fetching coordinates for city: %s", city_name)
+    params = {"q": city_name, "appid": API_KEY}
+    data = await http_client.get_json(GEO_URL, params=params, upstream="weather", hedge=True)
+
+    if not data:
+        logger.debug("City '%s' not found.", city_name)
+        return None
+
+    lat, lon = data[0]["lat"], data[0]["lon"]
+    logger.debug("Coordinates for %s: (%s, %s)", city_name, lat, lon)
+    return [lat, lon]
+
+async def get_coordinates(city_name):
     """
-    Fetches latitude and longitude for a city.
+    Fetches latitude and longitude for a city, using the cache when possible.
     :param city_name: Name of the city.
     :return: A tuple (latitude, longitude) or None if not found.
+    :raises: http_client.REQUEST_ERRORS if the lookup failed and nothing was cached.
     """
-    try:
-        logger.info(f"Fetching coordinates for city: {city_name}")
-        params = {"q": city_name, "appid": API_KEY}
-        response = requests.get(GEO_URL, params=params)
-        response.raise_for_status()
-        data = response.json()
+    key = normalize_city_name(city_name)
+    coordinates = await coordinates_cache.get_or_load_async(key, lambda: _fetch_coordinates(key),
+                                                            stale_if_error=True)
+    return tuple(coordinates) if coordinates else None
 
-        if not data:
-            logger.error(f"City '{city_name}' not found.")
-            return None
+async def _fetch_weather(lat, lon):
+    logger.debug("Fetching weather for coordinates: (%s, %s)", lat, lon)
+    params = {"lat": lat, "lon": lon, "appid": API_KEY, "units": "imperial"}
+    data = await http_client.get_json(WEATHER_URL, params=params, upstream="weather", hedge=True)
 
-        lat, lon = data[0]["lat"], data[0]["lon"]
-        logger.info(f"Coordinates for {city_name}: ({lat}, {lon})")
-        return lat, lon
-    except Exception as e:
-        logger.error(f"Error fetching coordinates: {e}")
-        return None
+    # Extract weather details
+    city = data["name"]
+    country = data["sys"]["country"]
+    temperature = data["main"]["temp"]
+    weather_description = data["weather"][0]["description"]
+    humidity = data["main"]["humidity"]
+    wind_speed = data["wind"]["speed"]
 
-def get_weather(city_name):
+    weather_info = (
+        f"Weather in {city}, {country}:\n"
+        f"- Temperature: {temperature}°F\n"
+        f"- Condition: {weather_description.capitalize()}\n"
+        f"- Humidity: {humidity}%\n"
+        f"- Wind Speed: {wind_speed} m/s"
+    )
+    logger.debug("Weather data fetched successfully")
+    return weather_info
+
+async def get_weather(city_name):
     """
     Fetches the current weather for a given city using its coordinates.
     :param city_name: Name of the city.
@@ -47,35 +90,20 @@ def get_weather(city_name):
     """
     try:
         # Get city coordinates
-        coordinates = get_coordinates(city_name)
+        coordinates = await get_coordinates(city_name)
         if not coordinates:
             return "City not found. Please check the name and try again."
 
-        lat, lon = coordinates
-        logger.info(f"Fetching weather for coordinates: ({lat}, {lon})")
-        params = {"lat": lat, "lon": lon, "appid": API_KEY, "units": "imperial"}
-        response = requests.get(WEATHER_URL, params=params)
-        response.raise_for_status()
-        data = response.json()
-
-        # Extract weather details
-        city = data["name"]
-        country = data["sys"]["country"]
-        temperature = data["main"]["temp"]
-        weather_description = data["weather"][0]["description"]
-        humidity = data["main"]["humidity"]
-        wind_speed = data["wind"]["speed"]
-
-        weather_info = (
-            f"Weather in {city}, {country}:\n"
-            f"- Temperature: {temperature}°F\n"
-            f"- Condition: {weather_description.capitalize()}\n"
-            f"- Humidity: {humidity}%\n"
-            f"- Wind Speed: {wind_speed} m/s"
-        )
-        logger.info("Weather data fetched successfully")
-        return weather_info
+        lat, lon = round(coordinates[0], 2), round(coordinates[1], 2)
+        return await weather_cache.get_or_load_async(f"{lat},{lon}", lambda: _fetch_weather(lat, lon),
+                                                     stale_if_error=True)
 
+    except CircuitOpenError as e:
+        logger.warning("Not fetching weather: %s", e)
+        return f"The weather service is unavailable right now. Please try again in {max(1, round(e.retry_in))}s."
+    except http_client.REQUEST_ERRORS as e:
+        logger.error("Error fetching weather: %s", e)
+        return "The weather service didn't answer. Please try again later."
     except Exception as e:
-        logger.error(f"Error fetching weather: {e}")
+        logger.error("Error fetching weather: %s", e)
         return "An unexpected error occurred while fetching weather data."